@@ -20,10 +20,6 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
-import socket
-import signal
-import threading
-from subprocess import Popen, PIPE
 
 
 PROGRAM_NAME = 'nightshift'
@@ -37,6 +33,213 @@ PROGRAM_VERSION = '0.4'
 '''
 
 
+# Construct name of socket
+socket_path = '%s.%s~%s' % ('/dev/shm/', PROGRAM_NAME, os.environ['USER'])
+'''
+The pathname of the interprocess communication socket for nightshift
+'''
+
+status_file_path = socket_path + '.status'
+'''
+The pathname of the file the daemon publishes the status of the first redshift
+instance in, the file for any other instance has '.' and its name appended
+'''
+
+STATUS_FILE_HEADER = '<QqQHH'
+'''
+:str  The layout of the header of a status file: the sequence number, which is odd while the
+      file is being written; the process ID of the daemon, 0 if the status is not available
+      without asking the daemon, because redshift has not been started or is being released;
+      the start time of the daemon, see `process_start_time`, so that a process that has been
+      given the process ID of a daemon that has died is not taken for it; the size of the
+      status record, see `STATUS_RECORD`, which follows the header; and the size of the
+      status message, as the daemon replies to 'status', which follows the record
+'''
+
+
+ONE_SHOT_OPTIONS = { '-s' : 'status',  '--status'  : 'status'
+                   , '+x' : 'toggle',  '--toggle'  : 'toggle'
+                   , '+d' : 'disable', '--disable' : 'disable'
+                   , '+e' : 'enable',  '--enable'  : 'enable'
+                   , '+f' : 'freeze',  '--freeze'  : 'freeze'
+                   , '+t' : 'thaw',    '--thaw'    : 'thaw'
+                   , '-x' : 'kill',    '--kill'    : 'kill',  '--reset' : 'kill'
+                   }
+'''
+:dict<str, str>  Options that can be performed by `fast_path`, and their actions
+'''
+
+
+def process_start_time(pid):
+    '''
+    Get when a process was started, in clock ticks after boot, which together with
+    the process ID identifies the process until the next boot, after which the
+    status files, being in /dev/shm, no longer exist
+    
+    @param   pid:int  The process ID
+    @return  :int?    The start time of the process, `None` if it is not running
+    '''
+    try:
+        with open('/proc/%i/stat' % pid, 'rb') as file:
+            stat = file.read()
+    except OSError:
+        return None
+    # The name of the process, the second field, is in parentheses and can contain
+    # anything, the start time is the 20th field after the closing parenthesis
+    try:
+        return int(stat[stat.rindex(b')') + 2:].split(b' ')[19])
+    except (ValueError, IndexError):
+        return None
+
+
+def read_status_file():
+    '''
+    Read the status message from the status file of the first redshift instance
+    
+    @return  :bytes?  The status message, ending with an empty line, `None` if the file does
+                      not exist or is not owned by the user, the daemon has exited or the
+                      status is not available
+    '''
+    import mmap, _struct
+    try:
+        fd = os.open(status_file_path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return None
+    try:
+        # /dev/shm is writable by everyone, only trust a file the user owns
+        if not os.fstat(fd).st_uid == os.getuid():
+            return None
+        status_file = mmap.mmap(fd, 0, mmap.MAP_SHARED, mmap.PROT_READ)
+    except (OSError, ValueError):
+        return None
+    finally:
+        os.close(fd)
+    header_size = _struct.calcsize(STATUS_FILE_HEADER)
+    with status_file:
+        # The daemon increments the sequence number before and after it writes the file,
+        # retry until a read starts and ends with the same even sequence number
+        for _attempt in range(1000):
+            (sequence, pid, start_time, record_size, message_size) = _struct.unpack_from(STATUS_FILE_HEADER, status_file, 0)
+            if sequence % 2 == 1:
+                continue
+            offset = header_size + record_size
+            message = status_file[offset : offset + message_size]
+            if _struct.unpack_from('<Q', status_file, 0)[0] == sequence:
+                break
+        else:
+            return None
+    if (pid == 0) or not process_start_time(pid) == start_time:
+        return None
+    return message
+
+
+def fast_path():
+    '''
+    Perform the actions for -s, +x, +d, +e, +f, +t and -x without loading the
+    rest of nightshift, its user interface or the configuration script, if only
+    these options are used and the daemon is running; otherwise return
+    '''
+    # Parse options, like the full option parser
+    actions = {}
+    for arg in sys.argv[1:]:
+        if (arg[:2] in ('--', '++')) or (arg[:1] not in ('-', '+')):
+            subargs = [arg]
+        else:
+            subargs = [arg[0] + letter for letter in arg[1:]]
+        for arg in subargs:
+            if arg not in ONE_SHOT_OPTIONS:
+                return
+            action = ONE_SHOT_OPTIONS[arg]
+            if action in ('enable', 'disable'):
+                actions['set_status'] = action
+            elif action in ('freeze', 'thaw'):
+                actions['set_freeze'] = action
+            elif action == 'kill':
+                actions['kill'] = min(actions.get('kill', 0) + 1, 2)
+            else:
+                actions[action] = action
+    if len(actions) == 0:
+        return
+    
+    # Read the status without communicating with the daemon, if that is all that is requested
+    if list(actions) == ['status']:
+        message = read_status_file()
+        if message is not None:
+            sys.stdout.buffer.write(message[:-1])
+            sys.stdout.buffer.flush()
+            sys.exit(0)
+    
+    # Put together the messages in the same order as `run_as_client`
+    messages = [actions.get('set_status', actions.get('toggle', None)), actions.get('set_freeze', None)]
+    messages += ['kill'] * actions.get('kill', 0)
+    messages += [actions.get('status', None), 'close']
+    message = ''.join(m + '\n' for m in messages if m is not None)
+    
+    # Use the low-level socket module, the socket
+    # module takes longer to import than all of this
+    import _socket
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        # The daemon is not running, let the full path start it
+        sock.close()
+        return
+    sock.sendall(message.encode('utf-8'))
+    if 'status' in actions:
+        buf = b''
+        while b'\n\n' not in buf:
+            got = sock.recv(1024)
+            if len(got) == 0:
+                break
+            buf += got
+        sys.stdout.buffer.write(buf.split(b'\n\n')[0] + b'\n')
+        sys.stdout.buffer.flush()
+    sock.close()
+    sys.exit(0)
+fast_path()
+
+
+import math
+import time
+import heapq
+import itertools
+import socket
+import signal
+import selectors
+import threading
+from subprocess import Popen, PIPE
+
+
+def load_module(module):
+    '''
+    Load a module from the same directory or zip file as this module, with shared globals
+    
+    @param  module:str  The name of the module
+    '''
+    # Get the Python version
+    v = sys.version_info
+    if (v.major > 3) or ((v.major == 3) and (v.minor >= 4)):
+        # The (new) Python 3.4 way
+        import importlib.util
+        exec(importlib.util.find_spec(module).loader.get_code(module), globals())
+    else:
+        # The deprecated legacy way
+        import importlib
+        exec(importlib.find_loader(module).get_code(module), globals())
+
+
+## Stand in for redshift if re-executed to replay its output
+if sys.argv[1:2] == ['==replay']:
+    load_module('timewarp')
+    replay_transcript(read_transcript(sys.argv[3]), float(sys.argv[2]))
+elif sys.argv[1:2] == ['==simulate']:
+    load_module('timewarp')
+    parameters = [float(arg) for arg in sys.argv[3:]]
+    transcript = synthesise_transcript(parameters[0:2], parameters[2:4], parameters[4:6])
+    replay_transcript(transcript, float(sys.argv[2]))
+
+
 ## Set process title
 def setproctitle(title):
     '''
@@ -73,6 +276,20 @@ backlog = 5
 :int  The size of the server socket's backlog
 '''
 
+client_queue_limit = 64 * 1024
+'''
+:int  The maximum number of bytes that may be queued for a client before
+      it is considered stuck and is disconnected
+'''
+
+slow_client_policy = 'coalesce'
+'''
+:str  What to do with status updates for a client that has not received
+      everything queued for it: 'coalesce' to only send the latest status
+      once it has caught up, or 'disconnect' to queue them and disconnect
+      the client when its queue exceeds `client_queue_limit`
+'''
+
 red_args = None
 '''
 :list<str>?  Raw arguments passed to redshift
@@ -83,6 +300,48 @@ red_opts = ['-v']
 :list<str>  Nightshift parsed options passed to redshift
 '''
 
+red_lazy = False
+'''
+:bool  Whether the daemon shall not start redshift until a client needs it
+'''
+
+red_idle_timeout = None
+'''
+:float?  The number of seconds the daemon shall be without clients before it
+         terminates redshift, which is started again when a client needs it,
+         `None` to keep redshift running
+'''
+
+red_instances = None
+'''
+:dict<str, list<str>>?  The redshift instances the daemon shall run, by name, with the
+                        options, in addition to `red_opts`, to run each one with, for
+                        example one per monitor; `None` for one instance named 'default'
+'''
+
+focus_rules = None
+'''
+:list<(str, str)>?  Rules for the windows redshift shall be disabled for while they are focused:
+                    the field, 'instance', 'class' or 'title', and the pattern: the exact value,
+                    a prefix followed by '*', or a regular expression, that shall match anywhere,
+                    after 're:'; `None` to not follow the focus
+'''
+
+focus_debounce = 0.25
+'''
+:float  The number of seconds the focus must stay before redshift is disabled or enabled for it
+'''
+
+instance_name = None
+'''
+:str?  The redshift instance the client shall address, `None` for the default
+'''
+
+command_prefix = ''
+'''
+:str  The prefix of commands sent by the client, to address `instance_name`
+'''
+
 daemon = 0
 '''
 :int  Whether or not to run as daemon, 2 if revived
@@ -126,14 +385,136 @@ config_file = None
 :str?  The configuration file, same as the first element in `conf_opts`
 '''
 
+record_file = None
+'''
+:str?  File to record the output of redshift to, with the time of each line
+'''
+
+replay_file = None
+'''
+:str?  File with recorded output of redshift to replay instead of running redshift
+'''
+
+wait_timeout = 5
+'''
+:float  The number of seconds the daemon waits for redshift to reach the
+        requested state, for commands sent with --wait
+'''
+
+command_mode = None
+'''
+:str?  'ack' if the daemon shall acknowledge control commands, 'wait' if it shall
+       reply when redshift has reached the requested state, otherwise `None`
+'''
+
+lock_wait_threshold = None
+'''
+:float?  Waits for the lock of a `TimedCondition` that are longer than this
+         number of seconds are logged to stderr, `None` to log none
+'''
+
+ramp_output = None
+'''
+:str?  File the daemon shall write the gamma ramps for the current status to, computed
+       by nightshift itself, with the name of the instance appended, after a dot, for
+       all but the first redshift instance; `None` to not calculate any gamma ramps
+'''
+
+ramp_size = 256
+'''
+:int  The number of stops in each gamma ramp written to `ramp_output`
+'''
+
+
+profile_file = socket_path + '.prof'
+'''
+:str  The file the daemon writes profiling statistics to, unless another file is requested
+'''
+
+show_metrics = None
+'''
+:str?  'text' or 'openmetrics' to print the daemon's metrics in that format, otherwise `None`
+'''
+
+show_forecast = False
+'''
+:bool  Whether to print the colour temperature and brightness redshift
+       will target every hour for the next 24 hours
+'''
+
+pending_replies = 0
+'''
+:int  The number of acknowledgements the client has not yet received from the daemon
+'''
+
+client_reader = None
+'''
+:FrameReader?  Splits the data the client receives from the daemon into messages
+'''
+
+client_outbox = ''
+'''
+:str  Commands the client has not yet sent, they are sent together by `flush_commands`
+'''
+
+ui_fps = 30
+'''
+:float  The maximum number of times a second the user interface is redrawn
+'''
+
+batch_file = None
+'''
+:str?  File with commands to send to the daemon over one connection, '-' for stdin
+'''
+
+watch = False
+'''
+:bool  Whether to print a line whenever the status changes, until the daemon exits
+'''
+
+watch_format = 'json'
+'''
+:str  'json' to print the status as JSON objects with --watch, otherwise a template
+      for `str.format` with the status fields, see `watch_values`, as keyword arguments
+'''
+
+watch_interval = 0
+'''
+:float  The minimum number of seconds between lines printed by --watch
+'''
+
+watch_fields = None
+'''
+:str?  Comma-separated list of the status fields to print with --watch, all if `None`
+'''
+
+client_failed = False
+'''
+:bool  Whether a command was ignored by the daemon or timed out
+'''
+
+simulate = False
+'''
+:bool  Whether to replay a synthetic day instead of running redshift
+'''
+
+replay_speed = 1
+'''
+:float  How many times faster than real time recorded or synthetic output is replayed
+'''
+
 
 ## Parse options
 add_to_red_opts = False
 reading_conf_opts = False
+argumented = None
 for arg in sys.argv[1:]:
     if add_to_red_opts:
         red_opts.append(arg)
         add_to_red_opts = False
+    elif argumented is not None:
+        globals()[argumented] = arg
+        argumented = None
     elif reading_conf_opts:
         if arg == '}':
             reading_conf_opts = False
@@ -171,6 +552,8 @@ for arg in sys.argv[1:]:
                     -W --warranty                   Show program warrantly disclaimer
                     
                     -d --daemon                     Start as daemon
+                       --lazy                       Do not start redshift until it is needed
+                       --idle-timeout   SECONDS     Stop redshift when there are no clients
                     -x --reset --kill               Remove adjustment from screen
                     +x --toggle                     Temporarily disable or enable adjustments
                     +d --disable                    Temporarily disable adjustments
@@ -178,7 +561,28 @@ for arg in sys.argv[1:]:
                     +f --freeze                     Temporarily freeze the redshift process
                     +t --thaw                       Thaw the redshift process
                     -s --status                     Print status information
+                       --ack                        Print the daemon's acknowledgement of commands
+                       --wait                       Wait until redshift has carried out commands
+                       --timeout        SECONDS     Give up waiting after that many seconds
+                       --batch          FILE        Send the commands in a file, '-' for stdin, to the daemon
+                       --metrics                    Print the daemon's counters and latencies
+                       --openmetrics                Print the daemon's metrics in OpenMetrics format
+                       --forecast                   Print the targeted settings for the next 24 hours
+                       --watch                      Print a line whenever the status changes
+                       --format         FORMAT      Print the status as json, or with a template, with --watch
+                       --interval       SECONDS     Print at most one line per that many seconds with --watch
+                       --fields         FIELDS      Print only these comma-separated fields with --watch
+                       --fps            FPS         Redraw the user interface at most this many times a second
+                       --log-lock-waits SECONDS     Let the daemon log lock waits longer than this
                     +c --script         FILE        Load nightshift configuration script from specified file
+                    -i --instance       NAME        Address the redshift instance with the specified name
+                    
+                       --record         FILE        Record the output of redshift to a file
+                       --replay         FILE        Replay recorded output instead of running redshift
+                       --simulate                   Replay a synthetic day instead of running redshift
+                       --speed          FACTOR      Replay that many times faster than real time
+                       --ramp-output    FILE        Let the daemon write the gamma ramps to a file
+                       --ramp-size      STOPS       The number of stops in each gamma ramp
                     
                     -c --config         FILE        Load redshift settings from specified file
                     -b --brightness     DAY:NIGHT   Screen brightness to set at daytime/night
@@ -220,6 +624,28 @@ for arg in sys.argv[1:]:
             elif arg in ('+t', '--thaw'):               set_freeze = False
             elif arg in ('-s', '--status'):             status = True
             elif arg in ('+c', '--script'):             config_file = []
+            elif arg in ('-i', '--instance'):           argumented = 'instance_name'
+            elif arg == '--record':                     argumented = 'record_file'
+            elif arg == '--replay':                     argumented = 'replay_file'
+            elif arg == '--speed':                      argumented = 'replay_speed'
+            elif arg == '--simulate':                   simulate = True
+            elif arg == '--lazy':                       red_lazy = True
+            elif arg == '--idle-timeout':               argumented = 'red_idle_timeout'
+            elif arg == '--ack':                        command_mode = 'ack'
+            elif arg == '--wait':                       command_mode = 'wait'
+            elif arg == '--timeout':                    argumented = 'wait_timeout'
+            elif arg == '--metrics':                    show_metrics = 'text'
+            elif arg == '--batch':                      argumented = 'batch_file'
+            elif arg == '--openmetrics':                show_metrics = 'openmetrics'
+            elif arg == '--forecast':                   show_forecast = True
+            elif arg == '--watch':                      watch = True
+            elif arg == '--format':                     argumented = 'watch_format'
+            elif arg == '--interval':                   argumented = 'watch_interval'
+            elif arg == '--fields':                     argumented = 'watch_fields'
+            elif arg == '--fps':                        argumented = 'ui_fps'
+            elif arg == '--log-lock-waits':             argumented = 'lock_wait_threshold'
+            elif arg == '--ramp-output':                argumented = 'ramp_output'
+            elif arg == '--ramp-size':                  argumented = 'ramp_size'
             else:
                 add_to_red_opts = True
                 if   arg in ('-c', '--config'):         red_opts.append('-c')
@@ -237,9 +663,62 @@ for arg in sys.argv[1:]:
             add_to_red_opts = False
         if isinstance(config_file, list) and (len(config_file) > 0):
             config_file = ''.join(config_file)
-if isinstance(config_file, list):
+if isinstance(config_file, list) or (argumented is not None):
     sys.stderr.write('%s: error: premature end of arguments\n' % sys.argv[0])
     sys.exit(1)
+try:
+    replay_speed = float(replay_speed)
+    if not replay_speed > 0:
+        raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid replay speed: %s\n' % (sys.argv[0], replay_speed))
+    sys.exit(1)
+if instance_name is not None:
+    command_prefix = '@%s ' % instance_name
+try:
+    if lock_wait_threshold is not None:
+        lock_wait_threshold = float(lock_wait_threshold)
+        if lock_wait_threshold < 0:
+            raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid lock wait threshold: %s\n' % (sys.argv[0], lock_wait_threshold))
+    sys.exit(1)
+try:
+    if red_idle_timeout is not None:
+        red_idle_timeout = float(red_idle_timeout)
+        if red_idle_timeout < 0:
+            raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid idle timeout: %s\n' % (sys.argv[0], red_idle_timeout))
+    sys.exit(1)
+try:
+    ui_fps = float(ui_fps)
+    if not ui_fps > 0:
+        raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid frame rate: %s\n' % (sys.argv[0], ui_fps))
+    sys.exit(1)
+try:
+    ramp_size = int(ramp_size)
+    if ramp_size < 2:
+        raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid ramp size: %s\n' % (sys.argv[0], ramp_size))
+    sys.exit(1)
+try:
+    watch_interval = float(watch_interval)
+    if watch_interval < 0:
+        raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid interval: %s\n' % (sys.argv[0], watch_interval))
+    sys.exit(1)
+try:
+    wait_timeout = float(wait_timeout)
+    if not wait_timeout > 0:
+        raise ValueError()
+except ValueError:
+    sys.stderr.write('%s: error: invalid timeout: %s\n' % (sys.argv[0], wait_timeout))
+    sys.exit(1)
 
 
 # Parse help request for -l and -m
@@ -264,233 +743,1436 @@ while '-t' in red_opts[i:]:
 
 
 
-# Construct name of socket
-socket_path = '%s.%s~%s' % ('/dev/shm/', PROGRAM_NAME, os.environ['USER'])
-'''
-The pathname of the interprocess communication socket for nightshift
-'''
+# The status of redshift
+red_brightness, red_temperature = 1, 6500
+red_brightnesses, red_temperatures = (1, 1), (5500, 3500)
+red_period, red_location = 1, (0, 0)
+red_status, red_running, red_dying, red_frozen = True, True, False, False
+red_condition = None
+
+
+## Create locale free environment for redshift
+redshift_env = os.environ.copy()
+for var in ('LANG', 'LANGUAGE', 'LC_ALL', 'LC_MESSAGES'):
+    redshift_env[var] = 'C'
+
+
+daemon_instances = []
+'''
+:list<RedshiftInstance>  The redshift instances the daemon runs, the first one
+                         keeps its status in the global `red_*` variables
+'''
+
+daemon_supervisor = None
+'''
+:ChildSupervisor?  The supervisor of the redshift instances
+'''
+
+daemon_socket = None
+'''
+:socket?  The server socket, `None` until `start_daemon_threads` has been called
+'''
+
+TOGGLE_TIMEOUT = 2
+'''
+:float  The number of seconds the daemon waits for redshift to report that it has toggled
+'''
+
+daemon_focus = None
+'''
+:FocusTracker?  Follows the focus for `focus_rules`, `None` if there are no rules
+'''
+
+daemon_idle_generation = 0
+'''
+:int  The number of times a client has connected, so that a scheduled
+      release of redshift can tell whether the daemon is still idle
+'''
+
+daemon_selector = None
+'''
+:selectors.BaseSelector?  The selector that multiplexes the server socket, the
+                          client sockets and redshift's output in the daemon
+'''
+
+daemon_clients = set()
+'''
+:set<Client>  All clients that are connected to the daemon
+'''
+
+daemon_timers = []
+'''
+:list<(float, int, ()→void)>  Heap of functions the event loop shall call, with the
+                              monotonic time to call them at and a sequence number
+'''
+
+daemon_timer_sequence = 0
+'''
+:int  The sequence number of the last function added to `daemon_timers`
+'''
+
+daemon_profiler = None
+'''
+:DaemonProfiler?  The profiler of the daemon, if it is being profiled
+'''
+
+daemon_waiters = []
+'''
+:list<CommandWaiter>  Clients waiting for redshift to reach the state they requested
+'''
+
+FORECAST_LIMIT = 10000
+'''
+:int  The maximum number of times a 'forecast' or 'query' command can ask about
+'''
+
+FORECAST_TIMES = (-62167219200, 64060588800)
+'''
+:(int, int)  The earliest and latest times, in seconds since the Epoch, that a 'query' command
+             can ask about: the years 0 to 4000, outside which the solar equations are inaccurate
+'''
+
+CONTROL_COMMANDS = ('toggle', 'disable', 'enable', 'freeze', 'thaw', 'kill')
+'''
+:tuple<str>  The commands that control redshift, and can be acknowledged or waited for
+'''
+
+BATCH_FAILURES = ('ignored', 'timeout', 'exited', 'unknown', 'no such instance')
+'''
+:tuple<str>  The results of commands, and outcomes of waits for groups, that make --batch fail
+'''
+
+
+class Client:
+    '''
+    A connection to a client, serviced by the daemon's event loop
+    '''
+    
+    def __init__(self, sock, instance):
+        '''
+        Constructor
+        
+        @param  sock:socket                The socket connected to the client
+        @param  instance:RedshiftInstance  The redshift instance the client gets the status of
+        '''
+        self.sock = sock
+        '''
+        :socket  The socket connected to the client
+        '''
+        
+        self.instance = instance
+        '''
+        :RedshiftInstance  The redshift instance the client gets the status of, by default
+        '''
+        
+        self.reader = FrameReader(b'\n')
+        '''
+        :FrameReader  Splits the data received from the client into commands
+        '''
+        
+        self.outbuf = bytearray()
+        '''
+        :bytearray  Data that has not yet been sent to the client
+        '''
+        
+        self.listening = False
+        '''
+        :bool  Whether the client has requested to receive status updates
+        '''
+        
+        self.delta = False
+        '''
+        :bool  Whether the client has requested to only receive changed fields in status updates
+        '''
+        
+        self.sequence = None
+        '''
+        :int?  The version of the last status sent to the client in delta mode
+        '''
+        
+        self.binary = False
+        '''
+        :bool  Whether the client has requested to receive status as binary records
+        '''
+        
+        self.stale = False
+        '''
+        :bool  Whether a status update has been held back because the client has
+               not yet received everything queued for it
+        '''
+        
+        self.closing = False
+        '''
+        :bool  Whether the connection should be closed once `outbuf` is empty
+        '''
+        
+        self.arrival = None
+        '''
+        :float?  When the output from redshift that caused the oldest status
+                 update that has not been delivered to the client arrived
+        '''
+        
+        self.stream = None
+        '''
+        :iterator<bytes>?  The rest of a long reply, that is queued as the client receives it
+        '''
+        
+        self.group = None
+        '''
+        :list<str>?  The commands sent after 'begin', that shall be performed
+                     together when 'commit' is sent, `None` outside a group
+        '''
+
+
+class CommandWaiter:
+    '''
+    A client waiting for redshift to reach the state it requested
+    '''
+    
+    def __init__(self, client, command, predicate, start, instances, group = None):
+        '''
+        Constructor
+        
+        @param  client:Client                     The client
+        @param  command:str                       The command the client sent
+        @param  predicate:()→bool               Whether redshift has reached the requested state
+        @param  start:float                       The monotonic time the command was received
+        @param  instances:list<RedshiftInstance>  The redshift instances the command was sent to
+        @param  group:str?                        The reply to a group of commands, without
+                                                  the outcome of the wait and what follows it,
+                                                  `None` if the client sent a single command
+        '''
+        self.client = client
+        '''
+        :Client  The client
+        '''
+        
+        self.command = command
+        '''
+        :str  The command the client sent
+        '''
+        
+        self.predicate = predicate
+        '''
+        :()→bool  Whether redshift has reached the requested state
+        '''
+        
+        self.start = start
+        '''
+        :float  The monotonic time the command was received
+        '''
+        
+        self.instances = instances
+        '''
+        :list<RedshiftInstance>  The redshift instances the command was sent to
+        '''
+        
+        self.group = group
+        '''
+        :str?  The reply to a group of commands, without the outcome of the wait
+               and what follows it, `None` if the client sent a single command
+        '''
+
+
+def read_status(instance):
+    '''
+    Read status from redshift, called by the event loop when redshift's output is readable
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    proc = instance.proc
+    try:
+        got = os.read(proc.stdout.fileno(), 4096)
+    except BlockingIOError:
+        return
+    except OSError:
+        got = b''
+    if len(got) == 0:
+        # redshift is exiting, the event loop is
+        # stopped when its supervisor reports it
+        daemon_selector.unregister(proc.stdout)
+        proc.stdout.close()
+        return
+    arrival = time.monotonic()
+    if instance.recorder is not None:
+        instance.recorder.write(got)
+    if instance.parser.feed(got):
+        notify_listeners(instance, arrival)
+        if instance.starting and instance.has_reported():
+            instance_ready(instance)
+        reconcile_status(instance)
+
+
+def supervise_redshift(supervisor):
+    '''
+    Update the status when redshift stops, continues or exits, called by the
+    event loop when there are events from redshift's supervisor
+    
+    @param  supervisor:ChildSupervisor  The supervisor of the redshift instances
+    '''
+    arrival = time.monotonic()
+    for (proc, event) in supervisor.read():
+        instance = [instance for instance in daemon_instances if instance.proc is proc][0]
+        ns = instance.ns
+        if (event == 'exited') and instance.releasing:
+            # It will be started again when it is needed
+            if not proc.stdout.closed:
+                daemon_selector.unregister(proc.stdout)
+                proc.stdout.close()
+            (instance.proc, instance.releasing) = (None, False)
+            if instance is daemon_instances[0]:
+                restart_daemon_threads(proc)
+            instance_ready(instance)
+            continue
+        if (event == 'stopped') and instance.halting:
+            # Stopped by `kill_redshift`, so it has received the last SIGTERM, redshift
+            # exits when it receives the next one, so the rest are coalesced into it
+            (instance.halting, instance.kills) = (False, 0)
+            proc.terminate()
+            proc.send_signal(signal.SIGCONT)
+            continue
+        red_condition.acquire()
+        try:
+            if event == 'stopped':
+                ns['red_frozen'] = True
+            elif event == 'continued':
+                ns['red_frozen'] = False
+            elif event == 'exited':
+                ns['red_running'] = False
+            red_condition.notify_all()
+        finally:
+            red_condition.release()
+        if event == 'exited':
+            notify_listeners(instance, arrival)
+            if instance.starting:
+                instance_ready(instance)
+        else:
+            broadcast_status(instance, arrival)
+
+
+def start_instance(instance):
+    '''
+    Start a redshift instance, clients that need it are held back
+    until it has reported its status, see `instance_ready`
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    instance.start(daemon_supervisor)
+    callback = lambda events, instance = instance : read_status(instance)
+    daemon_selector.register(instance.proc.stdout, selectors.EVENT_READ, callback)
+    if instance is daemon_instances[0]:
+        restart_daemon_threads(None)
+
+
+def restart_daemon_threads(proc):
+    '''
+    Stop the threads started by `start_daemon_threads` and start them again with the
+    current process of the first redshift instance, called when it has been started
+    and when it has exited after it was released because the daemon was idle
+    
+    @param  proc:Popen?  The process the threads were started with
+    '''
+    if daemon_socket is not None:
+        stop_daemon_threads(proc, daemon_socket)
+        start_daemon_threads(daemon_instances[0].proc, daemon_socket)
+
+
+def instance_ready(instance):
+    '''
+    Continue with the commands that were held back while a redshift instance was starting,
+    called when it has reported its status, or has exited or been released before that
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    instance.starting = False
+    for client in list(daemon_clients):
+        if client.reader.pending():
+            handle_messages(client)
+            if client in daemon_clients:
+                flush_client(client)
+
+
+def ensure_started(instance):
+    '''
+    Start a redshift instance if it has not been started, because of `red_lazy`,
+    or if it has been released, because of `red_idle_timeout`
+    
+    @param   instance:RedshiftInstance  The redshift instance
+    @return  :bool                      Whether the instance is ready to be used
+    '''
+    if (instance.proc is None) and instance.ns['red_running']:
+        start_instance(instance)
+    return not (instance.starting or instance.releasing)
+
+
+def release_if_idle(generation):
+    '''
+    Terminate the redshift instances if no client has connected since the release was scheduled
+    
+    @param  generation:int  The value of `daemon_idle_generation` when the release was scheduled
+    '''
+    if (generation == daemon_idle_generation) and (len(daemon_clients) == 0):
+        for instance in daemon_instances:
+            if (instance.proc is not None) and not (instance.releasing or instance.ns['red_dying']):
+                instance.release()
+
+
+def schedule_release():
+    '''
+    Schedule the termination of the redshift instances, if
+    `red_idle_timeout` is set and there are no clients
+    '''
+    if (red_idle_timeout is not None) and (len(daemon_clients) == 0):
+        generation = daemon_idle_generation
+        daemon_call_later(red_idle_timeout, lambda : release_if_idle(generation))
+
+
+def kill_redshift(instance):
+    '''
+    Send SIGTERM to redshift, once for every time it has been requested
+    
+    redshift exits immediately if it receives SIGTERM a second time, but if
+    the first one has not yet been delivered, the second would be merged into
+    it. redshift is then stopped, which it cannot be before it has received
+    the first one, and the second is sent when its supervisor reports that
+    it has stopped, see `supervise_redshift`
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    proc = instance.proc
+    if (instance.kills == 0) or (proc.returncode is not None) or instance.halting:
+        return
+    if signal_pending(proc.pid, signal.SIGTERM):
+        instance.halting = True
+        proc.send_signal(signal.SIGSTOP)
+        return
+    instance.kills -= 1
+    proc.terminate()
+    kill_redshift(instance)
+
+
+def daemon_call_later(delay, function):
+    '''
+    Let the event loop call a function
+    
+    @param  delay:float        The number of seconds to wait before calling the function
+    @param  function:()→void  The function
+    '''
+    global daemon_timer_sequence
+    daemon_timer_sequence += 1
+    heapq.heappush(daemon_timers, (time.monotonic() + delay, daemon_timer_sequence, function))
+
+
+def start_profiling():
+    '''
+    Start profiling the daemon, unless it is already being profiled
+    '''
+    global daemon_profiler
+    if daemon_profiler is None:
+        daemon_profiler = DaemonProfiler()
+
+
+def stop_profiling(file = None):
+    '''
+    Stop profiling the daemon and write the statistics
+    
+    @param   file:str?    The file to write the statistics to, `profile_file` if `None`
+    @return  :list<str>   The files written, empty if the daemon was not being profiled
+    '''
+    global daemon_profiler
+    if daemon_profiler is None:
+        return []
+    (profiler, daemon_profiler) = (daemon_profiler, None)
+    try:
+        return profiler.stop(profile_file if file is None else file)
+    except OSError as err:
+        sys.stderr.write('%s: cannot write profile: %s\n' % (sys.argv[0], err))
+        return []
+
+
+def toggle_profiling(signo, frame):
+    '''
+    Start or stop profiling the daemon, called when SIGUSR2 is received
+    
+    @param  signo:int     The signal
+    @param  frame:frame?  The interrupted frame
+    '''
+    if daemon_profiler is None:
+        start_profiling()
+    else:
+        stop_profiling()
+
+
+def generate_status_message():
+    '''
+    Generate message to send to the client to inform about the status
+    
+    @return  :str  Status message
+    '''
+    return render_status_message(current_status_values())
+
+
+def status_published(instance):
+    '''
+    Record a new status of a redshift instance, and write its gamma ramps, called when
+    the status has been published, before it is sent to the clients
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    instance.history.record(time.time(), instance.snapshot().values)
+    output_ramps(instance)
+    reconcile_status(instance)
+    if (daemon_focus is not None) and daemon_focus.blocked:
+        apply_focus()
+
+
+def publish_status_files():
+    '''
+    Write the status of the redshift instances to their status files,
+    unless neither it nor whether it is available has changed
+    '''
+    for instance in daemon_instances:
+        if instance.status_file is None:
+            continue
+        unstarted = (instance.proc is None) and instance.ns['red_running']
+        available = not (unstarted or instance.starting or instance.releasing)
+        state = (instance.snapshot().version, available)
+        if not state == instance.status_file.state:
+            instance.status_file.publish(state, instance.snapshot().record(), instances_message([instance]))
+
+
+def output_ramps(instance):
+    '''
+    Write the gamma ramps for the published status of a redshift
+    instance to `ramp_output`, unless they have not changed
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    if ramp_output is None:
+        return
+    values = dict(zip((name for (name, _format) in STATUS_FIELDS), instance.snapshot().values))
+    if values['Enabled'] and values['Running']:
+        (temperature, brightness) = (values['Current temperature'], values['Current brightness'])
+    else:
+        (temperature, brightness) = (NEUTRAL_TEMPERATURE, 1)
+    ramps = colour_ramps(temperature, brightness, red_opt_gamma(instance.opts + (red_args or [])), ramp_size)
+    if ramps is not instance.ramps:
+        file = ramp_output if instance is daemon_instances[0] else '%s.%s' % (ramp_output, instance.name)
+        try:
+            write_ramps(file, ramps)
+            instance.ramps = ramps
+        except OSError as err:
+            sys.stderr.write('%s: cannot write gamma ramps: %s\n' % (sys.argv[0], err))
+
+
+def notify_listeners(instance = None, arrival = None):
+    '''
+    Publish the status and send it to all clients that have
+    requested status updates, unless it has not changed
+    
+    @param  instance:RedshiftInstance?  The redshift instance, the first one if `None`
+    @param  arrival:float?              When the event that changed the status happened
+    '''
+    if instance is None:
+        instance = daemon_instances[0]
+    if publish_status(instance.ns):
+        status_published(instance)
+        for client in list(daemon_clients):
+            if client.listening and (client.instance is instance):
+                send_status(client, arrival = arrival)
+        check_waiters()
+
+
+def broadcast_status(instance = None, arrival = None):
+    '''
+    Publish the status and send it to all connected clients, unless it has not changed
+    
+    @param  instance:RedshiftInstance?  The redshift instance, the first one if `None`
+    @param  arrival:float?              When the event that changed the status happened
+    '''
+    if instance is None:
+        instance = daemon_instances[0]
+    if publish_status(instance.ns):
+        status_published(instance)
+        for client in list(daemon_clients):
+            if client.instance is instance:
+                send_status(client, arrival = arrival)
+        check_waiters()
+
+
+def control_redshift(instance, command):
+    '''
+    Perform a command that controls redshift
+    
+    @param   instance:RedshiftInstance  The redshift instance
+    @param   command:str                The command, one of `CONTROL_COMMANDS`
+    @return  :str                       'sent' if redshift was, or will be, signalled, 'unchanged' if it
+                                        already is, or will be, in the requested state, or 'ignored'
+                                        if it cannot be done
+    '''
+    global metric_toggle_requests
+    (proc, ns) = (instance.proc, instance.ns)
+    if proc is None:
+        # redshift has not been started, or has been released, and is not needed
+        if command == 'kill':
+            ns['red_running'] = False
+            notify_listeners(instance)
+        return 'sent'
+    if command in ('toggle', 'disable', 'enable'):
+        if ns['red_dying'] or ns['red_frozen']:
+            return 'ignored'
+        # Commands change the desired state, relative to the state redshift will be in when
+        # it has carried out the earlier commands, redshift is signalled by `reconcile_status`
+        target = instance.target()
+        wanted = (not target) if command == 'toggle' else (command == 'enable')
+        if wanted == target:
+            return 'unchanged'
+        instance.desired = wanted
+        metric_toggle_requests += 1
+        if not instance.reconciling:
+            # Signal redshift when all commands that have been received have been performed
+            instance.reconciling = True
+            daemon_call_later(0, lambda : reconcile_commands(instance))
+        return 'sent'
+    elif command == 'freeze':
+        # `red_frozen` is updated when redshift's supervisor reports that it has stopped
+        if ns['red_dying']:
+            return 'ignored'
+        proc.send_signal(signal.SIGTSTP)
+    elif command == 'thaw':
+        # `red_frozen` is updated when redshift's supervisor reports that it has continued
+        proc.send_signal(signal.SIGCONT)
+    elif command == 'kill':
+        # Thaw redshift, in case it is frozen, so that it can exit
+        proc.send_signal(signal.SIGCONT)
+        ns['red_dying'] = True
+        instance.kills += 1
+        kill_redshift(instance)
+        notify_listeners(instance)
+    return 'sent'
+
+
+def reconcile_commands(instance):
+    '''
+    Signal redshift to toggle if the commands that have been performed since the
+    event loop last called this have left it in another than the desired state
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    instance.reconciling = False
+    reconcile_status(instance)
+
+
+def reconcile_status(instance):
+    '''
+    Signal redshift to toggle if it is not in the desired state, unless it has already been
+    signalled but has not yet reported the outcome, in which case this is called again when
+    it has: so redshift is signalled at most once per 'Status' line it prints however many
+    commands are received meanwhile, and commands that are received together, while it is
+    not toggling, result in one signal if they change its state, and none if they cancel out
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    '''
+    global metric_toggle_signals
+    if (instance.desired is None) or (instance.proc is None) or instance.toggling():
+        return
+    ns = instance.ns
+    if ns['red_status'] == instance.desired:
+        instance.desired = None
+    elif not (ns['red_dying'] or ns['red_frozen']):
+        instance.proc.send_signal(signal.SIGUSR1)
+        instance.awaited = awaited = instance.parser.counts.get(b'Status', 0) + 1
+        metric_toggle_signals += 1
+        daemon_call_later(TOGGLE_TIMEOUT, lambda : toggle_timed_out(instance, awaited))
+
+
+def toggle_timed_out(instance, awaited):
+    '''
+    Stop waiting for redshift to report that it has toggled, if it has not in `TOGGLE_TIMEOUT`
+    seconds, and give up reaching the desired state, rather than risk toggling repeatedly
+    
+    @param  instance:RedshiftInstance  The redshift instance
+    @param  awaited:int                The value of `RedshiftInstance.awaited` when it was signalled
+    '''
+    if (instance.awaited == awaited) and instance.toggling():
+        instance.awaited = instance.parser.counts.get(b'Status', 0)
+        instance.desired = None
+
+
+def control_instances(instances, command):
+    '''
+    Perform a command that controls redshift on a number of redshift instances
+    
+    @param   instances:list<RedshiftInstance>  The redshift instances
+    @param   command:str                       The command, one of `CONTROL_COMMANDS`
+    @return  :str                              'ignored' if any instance ignored the command, otherwise
+                                               'sent' if any was signalled, otherwise 'unchanged'
+    '''
+    results = set(control_redshift(instance, command) for instance in instances)
+    return 'ignored' if 'ignored' in results else ('sent' if 'sent' in results else 'unchanged')
+
+
+def commit_group(client):
+    '''
+    Perform the commands a client has sent between 'begin' and 'commit', under one
+    acquisition of `red_condition`, so that no other thread can see the state between
+    them, and send one reply with the outcome of each command and the resulting status
+    
+    redshift carries out the commands after they have been performed, so the reply is
+    sent, as for 'wait', when the instances have reached the state the group leads to,
+    or `wait_timeout` seconds have passed, and it says which in its `Waited` field
+    
+    Only commands that control redshift and 'status' can be used in a group,
+    with or without instance prefixes, other commands are reported as unknown
+    
+    @param   client:Client  The client
+    @return  :bool          `False` if the group is held back because it
+                            needs a redshift instance that is starting
+    '''
+    start = time.monotonic()
+    (commands, needed) = ([], [])
+    for message in client.group:
+        (targets, command) = (None, message)
+        if message.startswith('@'):
+            (target, _space, command) = message[1:].partition(' ')
+            targets = [i for i in daemon_instances if (target == '*') or (i.name == target)]
+        if command == 'status':
+            needed += targets or [client.instance]
+        elif (command in CONTROL_COMMANDS) and not command == 'kill':
+            needed += targets or daemon_instances
+        commands.append((message, command, targets))
+    if not all([ensure_started(instance) for instance in needed]):
+        return False
+    (reply, shown, ignored) = (['Batch: %i\n' % len(commands)], [], False)
+    (toggled, processes) = ([], {})
+    red_condition.acquire()
+    try:
+        for (message, command, targets) in commands:
+            if targets == []:
+                result = 'no such instance'
+            elif command in CONTROL_COMMANDS:
+                result = control_instances(targets or daemon_instances, command)
+                ignored |= result == 'ignored'
+                for instance in targets or daemon_instances:
+                    if command in ('toggle', 'disable', 'enable'):
+                        toggled += [] if instance in toggled else [instance]
+                    else:
+                        processes[instance] = command
+            elif command == 'status':
+                result = 'done'
+                shown += [i for i in targets or [client.instance] if i not in shown]
+            else:
+                result = 'unknown'
+            reply.append('Command: %s\nResult: %s\n' % (message, result))
+    finally:
+        red_condition.release()
+    client.group = None
+    # The last freeze, thaw or kill decides whether redshift shall be frozen or running,
+    # and whether it shall be enabled is the state the toggles have left it to reach
+    predicates = [command_outcome(instance, command) for (instance, command) in processes.items()]
+    for instance in toggled:
+        if not processes.get(instance, None) == 'kill':
+            (ns, wanted) = (instance.ns, instance.target())
+            predicates.append(lambda ns = ns, wanted = wanted : ns['red_status'] == wanted)
+    predicate = lambda predicates = predicates : all(p() for p in predicates)
+    waiter = CommandWaiter(client, 'commit', predicate, start, shown or [client.instance], ''.join(reply))
+    for instance in daemon_instances:
+        notify_listeners(instance)
+    if ignored:
+        reply_to_waiter(waiter, 'ignored')
+    elif waiter.predicate():
+        reply_to_waiter(waiter, 'done')
+    else:
+        daemon_waiters.append(waiter)
+        daemon_call_later(wait_timeout, lambda waiter = waiter : expire_waiter(waiter))
+    return True
+
+
+def command_outcome(instance, command):
+    '''
+    Get a predicate for whether redshift has reached the state a command requests,
+    must be called before the command is performed
+    
+    @param   instance:RedshiftInstance  The redshift instance
+    @param   command:str                The command, one of `CONTROL_COMMANDS`
+    @return  :()→bool                 Whether redshift has reached the requested state
+    '''
+    ns = instance.ns
+    if command == 'toggle':
+        target = not instance.target()
+        return lambda : ns['red_status'] == target
+    return { 'disable' : lambda : not ns['red_status']
+           , 'enable'  : lambda : ns['red_status']
+           , 'freeze'  : lambda : ns['red_frozen']
+           , 'thaw'    : lambda : not ns['red_frozen']
+           , 'kill'    : lambda : not ns['red_running']
+           }[command]
+
+
+def instances_message(instances):
+    '''
+    Get the status message of redshift instances, each preceded by an
+    `Instance` field if the daemon runs more than one instance
+    
+    @param   instances:list<RedshiftInstance>  The redshift instances
+    @return  :bytes                            The status message, ending with an empty line
+    '''
+    if len(daemon_instances) == 1:
+        return instances[0].snapshot().message
+    message = [('Instance: %s\n' % i.name).encode('utf-8') + i.snapshot().message[:-1] for i in instances]
+    return b''.join(message) + b'\n'
+
+
+def reply_to_command(client, command, result, start, instances):
+    '''
+    Send the outcome of a command, followed by the current status, to a client
+    
+    @param  client:Client                     The client
+    @param  command:str                       The command
+    @param  result:str                        The outcome of the command
+    @param  start:float                       The monotonic time the command was received
+    @param  instances:list<RedshiftInstance>  The redshift instances the command was sent to
+    '''
+    header = 'Command: %s\nResult: %s\nLatency: %f\n' % (command, result, time.monotonic() - start)
+    send_to_client(client, header.encode('utf-8') + instances_message(instances))
+
 
+def reply_to_waiter(waiter, result):
+    '''
+    Send the outcome of a wait, followed by the current status, to a client
+    
+    @param  waiter:CommandWaiter  The waiting client
+    @param  result:str            The outcome of the wait
+    '''
+    if waiter.group is None:
+        reply_to_command(waiter.client, waiter.command, result, waiter.start, waiter.instances)
+    else:
+        reply = '%sWaited: %s\nLatency: %f\n' % (waiter.group, result, time.monotonic() - waiter.start)
+        send_to_client(waiter.client, reply.encode('utf-8') + instances_message(waiter.instances))
 
-# The status of redshift
-red_brightness, red_temperature = 1, 6500
-red_brightnesses, red_temperatures = (1, 1), (5500, 3500)
-red_period, red_location = 1, (0, 0)
-red_status, red_running, red_dying, red_frozen = True, True, False, False
-red_condition, broadcast_condition = None, None
 
+def check_waiters():
+    '''
+    Reply to the clients waiting for a state that redshift has now reached,
+    called whenever a new status has been published
+    '''
+    for waiter in list(daemon_waiters):
+        if waiter.predicate():
+            daemon_waiters.remove(waiter)
+            reply_to_waiter(waiter, 'done')
 
-## Create locale free environment for redshift
-redshift_env = os.environ.copy()
-for var in ('LANG', 'LANGUAGE', 'LC_ALL', 'LC_MESSAGES'):
-    redshift_env[var] = 'C'
+
+def expire_waiter(waiter, result = 'timeout'):
+    '''
+    Stop waiting for redshift to reach the state a client requested
+    
+    @param  waiter:CommandWaiter  The waiting client
+    @param  result:str            The outcome to report to the client
+    '''
+    if waiter in daemon_waiters:
+        daemon_waiters.remove(waiter)
+        reply_to_waiter(waiter, result)
+
+
+def send_status(client, resync = False, arrival = None):
+    '''
+    Send the current status to a client, only with the changed
+    fields if the client is in delta mode and up to date
+    
+    @param  client:Client   The client
+    @param  resync:bool     Whether to send the full status even if the client is in delta mode
+    @param  arrival:float?  When the event that changed the status happened, for `metric_delivery`
+    '''
+    snapshot = client.instance.snapshot()
+    if (arrival is not None) and (client.arrival is None):
+        client.arrival = arrival
+    if (len(client.outbuf) > 0) and (slow_client_policy == 'coalesce') and not resync:
+        # The latest status will be sent when the client has caught up
+        client.stale = True
+        return
+    if client.binary:
+        send_to_client(client, snapshot.record(), record = True)
+    elif not client.delta:
+        send_to_client(client, snapshot.message)
+    elif resync or (client.sequence is None) or (client.sequence < snapshot.version - 1):
+        send_to_client(client, snapshot.tagged_message())
+        client.sequence = snapshot.version
+    elif client.sequence == snapshot.version - 1:
+        send_to_client(client, snapshot.delta_message())
+        client.sequence = snapshot.version
+
+
+def send_to_client(client, message, record = False):
+    '''
+    Queue a message for a client and send as much of it as possible without blocking
+    
+    @param  client:Client   The client
+    @param  message:bytes   The message
+    @param  record:bool     Whether the message is a status record rather than text, on a binary
+                            connection every message is sent in a frame of its type, see `FRAME_HEADER`
+    '''
+    if client not in daemon_clients:
+        return
+    if client.binary:
+        message = encode_frame(FRAME_STATUS if record else FRAME_TEXT, message)
+    if client.stream is not None:
+        # Send the message after the long reply that is being sent
+        client.stream = itertools.chain(client.stream, [message])
+        return
+    if len(message) > client_queue_limit // 2:
+        # A long reply, such as a forecast, is not a sign that the client is too slow,
+        # send it as the client is able to receive it instead of dropping the client
+        size = client_queue_limit // 4
+        client.stream = (message[i : i + size] for i in range(0, len(message), size))
+        flush_client(client)
+        return
+    if len(client.outbuf) + len(message) > client_queue_limit:
+        drop_client(client)
+        return
+    client.outbuf += message
+    flush_client(client)
+
+
+def stream_to_client(client, chunks):
+    '''
+    Send a long reply to a client as the client is able to receive it, after what has already been queued
+    
+    @param  client:Client           The client
+    @param  chunks:iterable<bytes>  The reply, in parts
+    '''
+    if client.binary:
+        chunks = (encode_frame(FRAME_TEXT, chunk) for chunk in chunks)
+    client.stream = chunks if client.stream is None else itertools.chain(client.stream, chunks)
+    flush_client(client)
+
+
+def continue_stream(client):
+    '''
+    Queue more of a long reply to a client, as long as no
+    more than half of `client_queue_limit` is queued
+    
+    @param  client:Client  The client
+    '''
+    while (client.stream is not None) and (len(client.outbuf) <= client_queue_limit // 2):
+        chunk = next(client.stream, None)
+        if chunk is None:
+            client.stream = None
+        else:
+            client.outbuf += chunk
+
+
+def flush_client(client):
+    '''
+    Send as much as possible of a client's queued output, and of the rest of a long
+    reply, without blocking, and close the connection if it has broken or the client is done
+    
+    @param  client:Client  The client
+    '''
+    global metric_bytes_sent, metric_send_time
+    start = time.monotonic()
+    try:
+        while True:
+            continue_stream(client)
+            if len(client.outbuf) == 0:
+                break
+            sent = client.sock.send(client.outbuf)
+            del client.outbuf[:sent]
+            metric_bytes_sent += sent
+    except (BlockingIOError, InterruptedError):
+        pass
+    except OSError:
+        drop_client(client)
+        return
+    finally:
+        metric_send_time += time.monotonic() - start
+    if (len(client.outbuf) == 0) and (client.arrival is not None) and not client.stale:
+        kind = 'binary' if client.binary else ('delta' if client.delta else 'listen')
+        metric_delivery[kind].observe(time.monotonic() - client.arrival)
+        client.arrival = None
+    if (len(client.outbuf) == 0) and client.stale:
+        client.stale = False
+        if client.listening:
+            send_status(client)
+            return
+    if (len(client.outbuf) == 0) and client.closing:
+        if not any(waiter.client is client for waiter in daemon_waiters):
+            drop_client(client)
+        return
+    # Stop reading from a client that sends commands faster than it reads the replies
+    events = selectors.EVENT_READ if len(client.outbuf) <= client_queue_limit // 2 else 0
+    if len(client.outbuf) > 0:
+        events |= selectors.EVENT_WRITE
+    if not daemon_selector.get_key(client.sock).events == events:
+        daemon_selector.modify(client.sock, events, daemon_selector.get_key(client.sock).data)
+
+
+def drop_client(client):
+    '''
+    Close the connection to a client
+    
+    @param  client:Client  The client
+    '''
+    if client in daemon_clients:
+        daemon_clients.remove(client)
+        daemon_selector.unregister(client.sock)
+        client.sock.close()
+        daemon_waiters[:] = [waiter for waiter in daemon_waiters if waiter.client is not client]
+        schedule_release()
 
 
-def read_status(proc, sock):
+def accept_client(sock):
     '''
-    Read status from redshift
+    Accept pending connections, called by the event loop when the server socket is readable
     
-    @param  proc:Popen   The redshift process
     @param  sock:socket  The server socket
     '''
-    global red_brightness, red_temperature
-    global red_brightnesses, red_temperatures
-    global red_period, red_location
-    global red_status, red_running
-    released = True
+    global daemon_idle_generation
     while True:
-        got = proc.stdout.readline()
-        if (got is None) or (len(got) == 0):
-            if red_frozen:
-                proc.wait()
-                continue
-            break
-        got = got.decode('utf-8', 'replace')[:-1]
-        if ': 'not in got:
-            continue
-        (key, value) = got.split(': ')
-        if released:
-            red_condition.acquire()
         try:
-            if key == 'Location':
-                def coordcomp(v):
-                    v = (v + ' N').split(' ')[:2]
-                    return float(v[0]) * (-1 if v[1] in 'SW' else 1)
-                red_location = [coordcomp(v) for v in value.split(', ')]
-                # Followed by 'Temperatures'
-            elif key == 'Temperatures':
-                red_temperatures = [float(v.split(' ')[0][:-1]) for v in value.split(', ')]
-                # Followed by two parameter 'Brightness'
-            elif key == 'Period':
-                if value == 'Night':
-                    red_period = 0
-                elif value == 'Daytime':
-                    red_period = 1
-                else:
-                    red_period = float(value.split(' ')[1][1 : -1]) / 100
-                # Followed by 'Color temperature'
-            elif key == 'Color temperature':
-                red_temperature = float(value[:-1])
-                # Followed by one parameter 'Brightness'
-            elif key == 'Brightness':
-                if ':' in value:
-                    red_brightnesses = [float(v) for v in value.split(':')]
-                else:
-                    red_brightness = float(value)
-                # Neither version is followed by anything, notify and release
-                released = True
-            elif key == 'Status':
-                red_status = value == 'Enabled'
-                # Not followed by anything, notify and release
-                released = True
-            if released:
-                red_condition.notify_all()
-                red_condition.release()
-        except:
-            pass
-    if released:
-        red_condition.acquire()
-    red_running = False
-    red_condition.notify_all()
-    red_condition.release()
-    sock.shutdown(socket.SHUT_RDWR)
+            (client_sock, _client_address) = sock.accept()
+        except (BlockingIOError, InterruptedError):
+            break
+        except OSError:
+            break # We have shut down the socket
+        client_sock.setblocking(False)
+        daemon_idle_generation += 1
+        client = Client(client_sock, daemon_instances[0])
+        daemon_clients.add(client)
+        callback = lambda events, client = client : service_client(client, events)
+        daemon_selector.register(client_sock, selectors.EVENT_READ, callback)
 
 
-def broadcast_status(sock):
+def service_client(client, events):
+    '''
+    Handle readiness of a client's socket
+    
+    @param  client:Client  The client
+    @param  events:int     The events the socket is ready for
+    '''
+    if events & selectors.EVENT_WRITE:
+        flush_client(client)
+        if (client in daemon_clients) and client.reader.pending():
+            # Continue with the commands held back while the output was queued
+            handle_messages(client)
+            if client in daemon_clients:
+                flush_client(client)
+    if (events & selectors.EVENT_READ) and (client in daemon_clients):
+        use_client(client)
+
+
+def use_client(client):
     '''
-    Broadcast status updates
+    Communication with client, called by the event loop when the client's socket is readable
     
-    @param  sock:socket  The socket connected to the client
+    Commands may be prefixed with '@NAME ' to address the redshift instance named NAME, or
+    with '@* ' to address all instances. Without a prefix, commands that control redshift
+    address all instances, and commands for the status address the client's instance.
+    
+    @param  client:Client  The client
     '''
     try:
-        while True:
-            broadcast_condition.acquire()
+        got = client.sock.recv(4096)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError:
+        got = b''
+    if len(got) == 0:
+        drop_client(client)
+        return
+    client.reader.feed(got)
+    handle_messages(client)
+    if client in daemon_clients:
+        flush_client(client)
+
+
+def handle_messages(client):
+    '''
+    Perform the complete commands a client has sent
+    
+    When more than half of `client_queue_limit` is queued for the client, the remaining
+    commands are held back until the output has been sent, rather than disconnecting
+    a client that sends many commands before reading the replies
+    
+    A command that needs a redshift instance that is not running, because of
+    `red_lazy` or `red_idle_timeout`, starts it, and it and the following
+    commands are held back until the instance has reported its status
+    
+    @param  client:Client  The client
+    '''
+    while not client.closing:
+        if (len(client.outbuf) > client_queue_limit // 2) or (client.stream is not None):
+            break
+        line = client.reader.next()
+        if line is None:
+            break
+        try:
+            message = line.decode('utf-8', 'strict')
+        except UnicodeDecodeError:
+            drop_client(client)
+            return
+        if message == 'begin':
+            client.group = []
+            continue
+        elif message == 'commit':
+            if (client.group is not None) and not commit_group(client):
+                client.reader.unread()
+                return
+            continue
+        elif client.group is not None:
+            client.group.append(message)
+            continue
+        targets = None
+        if message.startswith('@'):
+            (target, _space, message) = message[1:].partition(' ')
+            targets = [i for i in daemon_instances if (target == '*') or (i.name == target)]
+            if len(targets) == 0:
+                send_to_client(client, ('Error: no such instance: %s\n\n' % target).encode('utf-8'))
+                continue
+        (mode, _space, command) = message.partition(' ')
+        control = command.split(' ')[0] if mode in ('ack', 'wait') else message
+        if (message in ('status', 'listen', 'listen delta', 'resync')) or (mode in ('forecast', 'query')):
+            needed = targets or [client.instance]
+        elif (control in CONTROL_COMMANDS) and not control == 'kill':
+            needed = targets or daemon_instances
+        else:
+            needed = []
+        if not all([ensure_started(instance) for instance in needed]):
+            client.reader.unread()
+            return
+        if message == 'status':
+            if targets is None:
+                targets = [client.instance]
+            if client.binary:
+                for instance in targets:
+                    send_to_client(client, instance.snapshot().record(), record = True)
+            else:
+                send_to_client(client, instances_message(targets))
+        elif message in CONTROL_COMMANDS:
+            control_instances(targets or daemon_instances, message)
+        elif (mode in ('ack', 'wait')) and (command.split(' ')[0] in CONTROL_COMMANDS):
+            # 'ack COMMAND' is replied to when the command has been performed,
+            # 'wait COMMAND [TIMEOUT]' when redshift has reached the requested state
+            start = time.monotonic()
+            (command, _space, timeout) = command.partition(' ')
             try:
-                broadcast_condition.wait()
-                red_condition.acquire()
-                try:
-                    message = generate_status_message()
-                    sock.sendall((message + '\n').encode('utf-8'))
-                finally:
-                    red_condition.release()
-            finally:
-                broadcast_condition.release()
-    except:
-        pass
+                timeout = float(timeout) if timeout else wait_timeout
+            except ValueError:
+                timeout = wait_timeout
+            targets = targets or daemon_instances
+            predicates = [command_outcome(instance, command) for instance in targets]
+            predicate = lambda predicates = predicates : all(p() for p in predicates)
+            waiter = CommandWaiter(client, command, predicate, start, targets)
+            result = control_instances(targets, command)
+            for instance in targets:
+                notify_listeners(instance)
+            if (mode == 'ack') or (result == 'ignored'):
+                reply_to_command(client, command, result, start, targets)
+            elif waiter.predicate():
+                reply_to_command(client, command, 'done', start, targets)
+            else:
+                daemon_waiters.append(waiter)
+                daemon_call_later(timeout, lambda waiter = waiter : expire_waiter(waiter))
+        elif message == 'close':
+            client.closing = True
+        elif message in ('listen', 'listen delta', 'resync'):
+            if targets is not None:
+                if not client.instance is targets[0]:
+                    client.sequence = None
+                client.instance = targets[0]
+            if message == 'listen':
+                client.listening = True
+            else:
+                if message == 'listen delta':
+                    client.listening = True
+                    client.delta = True
+                send_status(client, resync = True)
+        elif message == 'profile start':
+            start_profiling()
+            send_to_client(client, 'Profiling: yes\n\n'.encode('utf-8'))
+        elif (message == 'profile stop') or message.startswith('profile stop '):
+            files = stop_profiling(message[len('profile stop '):] or None)
+            send_to_client(client, ('Profiling: no\n%s\n' % ''.join('Profile: %s\n' % f for f in files)).encode('utf-8'))
+        elif mode == 'history':
+            # 'history [SINCE [RESOLUTION]]', SINCE is relative to now if negative
+            try:
+                args = [float(arg) for arg in command.split(' ') if arg]
+                since = args[0] if len(args) > 0 else -3600
+                resolution = args[1] if len(args) > 1 else 0
+                if len(args) > 2:
+                    raise ValueError()
+            except ValueError:
+                send_to_client(client, ('Error: invalid history: %s\n\n' % message).encode('utf-8'))
+                continue
+            if since < 0:
+                since += time.time()
+            instance = (targets or [client.instance])[0]
+            stream_to_client(client, instance.history.lines(since, resolution))
+        elif mode in ('forecast', 'query'):
+            send_to_client(client, forecast_message(message, targets or [client.instance]))
+        elif message in ('metrics', 'metrics openmetrics'):
+            send_to_client(client, render_metrics(message == 'metrics openmetrics').encode('utf-8'))
+        elif message in ('hello binary', 'hello text'):
+            # Acknowledge in the old format, after this everything is sent in the new format
+            send_to_client(client, (message + '\n\n').encode('utf-8'))
+            client.binary = message == 'hello binary'
+
+
+def forecast_message(message, instances):
+    '''
+    Perform a 'forecast' or 'query' command
+    
+    'forecast [HOURS [STEP]]' calculates the dayness, colour temperature and brightness
+    redshift will target from now on, every STEP seconds, 3600 by default, for HOURS
+    hours, 24 by default, one 'Forecast: TIME DAYNESS TEMPERATURE BRIGHTNESS' line each
+    
+    'query TIME LATITUDE LONGITUDE...' calculates the same for any number of times and
+    locations, with the instance's temperatures and brightnesses, one 'Query: TIME
+    LATITUDE LONGITUDE DAYNESS TEMPERATURE BRIGHTNESS' line each
+    
+    @param   message:str                       The command
+    @param   instances:list<RedshiftInstance>  The redshift instances to use the settings of
+    @return  :bytes                            The reply to the command
+    '''
+    (command, *args) = message.split(' ')
+    try:
+        args = [float(arg) for arg in args]
+        if command == 'forecast':
+            hours = args[0] if len(args) > 0 else 24
+            step = args[1] if len(args) > 1 else 3600
+            if (len(args) > 2) or not (hours >= 0) or not (step > 0):
+                raise ValueError()
+            # Check the number of times before creating them
+            count = hours * 3600 / step
+            if not (math.isfinite(count) and (count < FORECAST_LIMIT)):
+                raise ValueError()
+            now = time.time()
+            points = [(now + i * step, None) for i in range(int(count) + 1)]
+        else:
+            if (len(args) == 0) or (len(args) > 3 * FORECAST_LIMIT) or not len(args) % 3 == 0:
+                raise ValueError()
+            points = [(args[i], (args[i + 1], args[i + 2])) for i in range(0, len(args), 3)]
+            for (t, (latitude, longitude)) in points:
+                # Comparisons with NaN are false, so NaN is rejected as well as infinities
+                if not (FORECAST_TIMES[0] <= t <= FORECAST_TIMES[1]):
+                    raise ValueError()
+                if not ((-90 <= latitude <= 90) and (-180 <= longitude <= 180)):
+                    raise ValueError()
+    except ValueError:
+        return ('Error: invalid %s: %s\n\n' % (command, message)).encode('utf-8')
+    lines = []
+    for instance in instances:
+        if len(daemon_instances) > 1:
+            lines.append('Instance: %s' % instance.name)
+        values = instance.snapshot().values
+        (temperatures, brightnesses) = ((values[4], values[5]), (values[1], values[2]))
+        # Calculate the times at each location together, to share the tables
+        locations = {}
+        for (i, (_t, location)) in enumerate(points):
+            locations.setdefault(location or (values[7], values[8]), []).append(i)
+        rows = [None] * len(points)
+        for (location, indices) in locations.items():
+            results = forecast([points[i][0] for i in indices], location, temperatures, brightnesses)
+            for (i, row) in zip(indices, results):
+                rows[i] = (location, row)
+        for (location, (t, dayness, temperature, brightness)) in rows:
+            if command == 'forecast':
+                lines.append('Forecast: %f %f %f %f' % (t, dayness, temperature, brightness))
+            else:
+                lines.append('Query: %f %f %f %f %f %f' % ((t,) + location + (dayness, temperature, brightness)))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
 
 
-def generate_status_message():
+def red_opt_pair(opt, default, opts = None):
     '''
-    Generate message to send to the client to inform about the status
+    Get the value of a redshift option that takes two numbers separated by a colon
     
-    @return  :str  Status message
+    @param   opt:str                 The option, for example '-t'
+    @param   default:(float, float)  The value to use if the option is not used or not numerical
+    @param   opts:list<str>?         The options to look in, `red_opts` if `None`
+    @return  :(float, float)         The value of the option
     '''
-    message =  'Current brightness: %f\n'  % red_brightness
-    message += 'Daytime brightness: %f\n'  % red_brightnesses[0]
-    message += 'Night brightness: %f\n'    % red_brightnesses[1]
-    message += 'Current temperature: %f\n' % red_temperature
-    message += 'Daytime temperature: %f\n' % red_temperatures[0]
-    message += 'Night temperature: %f\n'   % red_temperatures[1]
-    message += 'Dayness: %f\n'             % red_period
-    message += 'Latitude: %f\n'            % red_location[0]
-    message += 'Longitude: %f\n'           % red_location[1]
-    message += 'Enabled: %s\n'             % ('yes' if red_status  else 'no')
-    message += 'Running: %s\n'             % ('yes' if red_running else 'no')
-    message += 'Dying: %s\n'               % ('yes' if red_dying   else 'no')
-    message += 'Frozen: %s\n'              % ('yes' if red_frozen  else 'no')
-    return message
+    opts = red_opts if opts is None else opts
+    value = default
+    for i in range(len(opts) - 1):
+        if opts[i] == opt:
+            try:
+                value = tuple(float(v) for v in opts[i + 1].split(':'))
+                if len(value) == 1:
+                    value *= 2
+                elif not len(value) == 2:
+                    value = default
+            except ValueError:
+                value = default
+    return value
 
 
-def use_client(sock, proc):
+def redshift_command(opts = None):
     '''
-    Communication with client
+    Get the command that starts redshift, or that replays output instead of running redshift
     
-    @param  sock:socket  The socket connected to the client
-    @param  proc:Popen   The redshift process
+    @param   opts:list<str>?  The options to run redshift with, `red_opts` if `None`
+    @return  :list<str>       The command
     '''
-    global red_dying, red_frozen
-    buf = ''
-    closed = False
-    while not closed:
-        try:
-            got = sock.recv(128).decode('utf-8', 'strict')
-            if (got is None) or (len(got) == 0):
-                break
-        except:
-            break
-        buf += got
-        while '\n' in buf:
-            buf = buf.split('\n')
-            message, buf = buf[0], '\n'.join(buf[1:])
-            if message == 'status':
-                red_condition.acquire()
-                try:
-                    message = generate_status_message()
-                    sock.sendall((message + '\n').encode('utf-8'))
-                finally:
-                    red_condition.release()
-            elif message == 'toggle':
-                if (not red_dying) and (not red_frozen):
-                    proc.send_signal(signal.SIGUSR1)
-            elif message == 'disable':
-                if (not red_dying) and (not red_frozen):
-                    if red_status:
-                        proc.send_signal(signal.SIGUSR1)
-            elif message == 'enable':
-                if (not red_dying) and (not red_frozen):
-                    if not red_status:
-                        proc.send_signal(signal.SIGUSR1)
-            elif message == 'freeze':
-                broadcast_condition.acquire()
-                try:
-                    if not red_frozen:
-                        red_frozen = True
-                        proc.send_signal(signal.SIGTSTP)
-                    broadcast_condition.notify_all()
-                finally:
-                    broadcast_condition.release()
-            elif message == 'thaw':
-                broadcast_condition.acquire()
-                try:
-                    if red_frozen:
-                        red_frozen = False
-                        proc.send_signal(signal.SIGCONT)
-                    broadcast_condition.notify_all()
-                finally:
-                    broadcast_condition.release()
-            elif message == 'kill':
-                if red_frozen:
-                    red_frozen = False
-                    proc.send_signal(signal.SIGCONT)
-                red_dying = True
-                proc.terminate()
-                import time
-                time.sleep(0.05) # XXX sometimes redshift is too slow
-            elif message == 'close':
-                closed = True
-            elif message == 'listen':
-                def listen():
-                    while True:
-                        red_condition.acquire()
-                        try:
-                            red_condition.wait()
-                            message = generate_status_message()
-                            sock.sendall((message + '\n').encode('utf-8'))
-                        except:
-                            break
-                        finally:
-                            red_condition.release()
-                thread = threading.Thread(target = listen)
-                thread.setDaemon(True)
-                thread.start()
-    sock.close()
+    opts = red_opts if opts is None else opts
+    if replay_file is not None:
+        return [sys.executable, sys.argv[0], '==replay', str(replay_speed), replay_file]
+    elif simulate:
+        parameters  = red_opt_pair('-l', red_location, opts)
+        parameters += red_opt_pair('-t', red_temperatures, opts)
+        parameters += red_opt_pair('-b', red_brightnesses, opts)
+        return [sys.executable, sys.argv[0], '==simulate', str(replay_speed)] + [str(p) for p in parameters]
+    command = ['redshift'] + opts
+    if red_args is not None:
+        command += red_args
+    return command
+
+
+def watch_config(watcher, sock):
+    '''
+    Rerun the configuration script if it has been modified, called by the
+    event loop when there are events from the configuration script's watcher
+    
+    @param  watcher:ConfigWatcher  The configuration script's watcher
+    @param  sock:socket            The server socket
+    '''
+    if watcher.read():
+        # redshift may have been started, or stopped and started again, since the daemon started
+        reload_config(daemon_instances[0].proc, sock)
+        start_focus_rules()
+
+
+def create_focus_source():
+    '''
+    Create the source of focus events for `focus_rules`, configuration
+    scripts can redefine this to use another source, e.g. `FakeFocusSource`
+    
+    @return  :object  The focus event source, see `XFocusSource`
+    '''
+    return XFocusSource()
+
+
+def start_focus_rules():
+    '''
+    Start, update or stop following the focus for `focus_rules`, called
+    when the daemon starts and when the configuration script is reloaded
+    '''
+    global daemon_focus
+    if focus_rules is None:
+        stop_focus_rules()
+        return
+    try:
+        rules = FocusRules(focus_rules)
+    except ValueError as err:
+        sys.stderr.write('%s: %s\n' % (sys.argv[0], err))
+        return
+    if daemon_focus is not None:
+        daemon_focus.rules = rules
+        daemon_focus.cache.clear()
+        focus_changed(daemon_focus.source.first(), force = True)
+        return
+    try:
+        source = create_focus_source()
+    except Exception as err:
+        sys.stderr.write('%s: cannot follow the focus: %s\n' % (sys.argv[0], err))
+        return
+    daemon_focus = FocusTracker(rules, source)
+    daemon_selector.register(source, selectors.EVENT_READ, lambda events : read_focus(source))
+    focus_changed(source.first())
+
+
+def stop_focus_rules():
+    '''
+    Stop following the focus, and enable redshift if it was disabled because of the focus
+    '''
+    global daemon_focus
+    if daemon_focus is None:
+        return
+    (tracker, daemon_focus) = (daemon_focus, None)
+    if len(tracker.disabled) > 0:
+        control_instances([i for i in daemon_instances if i in tracker.disabled], 'enable')
+    daemon_selector.unregister(tracker.source)
+    tracker.source.close()
+
+
+def read_focus(source):
+    '''
+    Read the focus events, called by the event loop when there are events from
+    the focus event source, stop following the focus if the source has broken,
+    for example because the connection to the X display has been closed
+    
+    @param  source:object  The focus event source, see `XFocusSource`
+    '''
+    try:
+        events = source.read()
+    except OSError as err:
+        sys.stderr.write('%s: cannot follow the focus anymore: %s\n' % (sys.argv[0], err))
+        stop_focus_rules()
+        return
+    focus_changed(events)
+
+
+def focus_changed(events, force = False):
+    '''
+    Decide for the focused window, and carry out the decision when the
+    focus has stayed for `focus_debounce` seconds, if it has changed
+    
+    @param  events:list<(int, str?, str?, str?)>  The focus events, see `FocusTracker.decide`
+    @param  force:bool                            Whether to carry out the decision even if it is unchanged
+    '''
+    if daemon_focus.update(events) or force:
+        generation = daemon_focus.generation
+        daemon_call_later(focus_debounce, lambda : apply_focus(generation))
+
+
+def apply_focus(generation = None):
+    '''
+    Disable each redshift instance that is enabled if the focused window matches `focus_rules`,
+    or enable the instances again if the focus has left and they were disabled because of it
+    
+    @param  generation:int?  The value of `FocusTracker.generation` when the decision was made,
+                             nothing is done if it has been superseded; `None` to retry a
+                             decision that could not be carried out
+    '''
+    tracker = daemon_focus
+    if tracker is None:
+        return
+    if generation is None:
+        if not tracker.blocked:
+            return
+    elif not generation == tracker.generation:
+        return
+    tracker.blocked = False
+    for instance in daemon_instances:
+        if tracker.wanted:
+            if (instance in tracker.disabled) or not instance.target():
+                # Already disabled, by us or by the user, who shall enable it again
+                continue
+            command = 'disable'
+        elif instance in tracker.disabled:
+            command = 'enable'
+        else:
+            continue
+        if control_redshift(instance, command) == 'ignored':
+            # redshift is frozen or dying, try again when the status changes
+            tracker.blocked = True
+        elif tracker.wanted:
+            tracker.disabled.add(instance)
+        else:
+            tracker.disabled.remove(instance)
 
 
 def start_daemon_threads(proc, sock):
     '''
     Start the threads for the daemon
     
+    When the first redshift instance is started, or has been stopped because of
+    `red_idle_timeout`, `stop_daemon_threads` is called, and then this function
+    is called again with the new process
+    
     @param  sock:socket  The server socket
-    @param  proc:Popen   The redshift process
+    @param  proc:Popen?  The process of the first redshift instance, the others are listed
+                         in `daemon_instances`, `None` if it is not running because of
+                         `red_lazy` or `red_idle_timeout`
     '''
     pass
 
@@ -501,46 +2183,117 @@ def run_as_daemon(sock):
     
     @param  sock:socket  The server socket
     '''
-    global red_condition, broadcast_condition, red_pid
+    global red_condition, daemon_selector, daemon_supervisor, daemon_socket
     
-    # Create status conditions
-    red_condition = threading.Condition()
-    broadcast_condition = threading.Condition()
+    # Create the status condition
+    red_condition = TimedCondition('red_condition')
     
-    # Start redshift
-    command = ['redshift'] + red_opts
-    if red_args is not None:
-        command += red_args
-    proc = Popen(command, stdout = PIPE, stderr = open(os.devnull))
+    # Create the redshift instances, each with a parser for its output
+    daemon_instances[:] = create_instances()
     
-    start_daemon_threads(proc, sock)
+    # Create the status files, so that clients can read the status without communicating
+    for instance in daemon_instances:
+        path = status_file_path if instance is daemon_instances[0] else '%s.%s' % (status_file_path, instance.name)
+        try:
+            instance.status_file = StatusFile(path)
+        except OSError as err:
+            sys.stderr.write('%s: cannot create status file: %s\n' % (sys.argv[0], err))
     
-    # Read status from redshift
-    thread = threading.Thread(target = read_status, args = (proc, sock))
-    thread.setDaemon(True)
-    thread.start()
+    # Start recording redshift's output
+    if record_file is not None:
+        daemon_instances[0].recorder = TranscriptRecorder(record_file)
     
-    red_condition.acquire()
-    broke = False
-    while red_running:
-        red_condition.release()
+    # Multiplex the server socket, the clients and redshift's output
+    daemon_selector = selectors.DefaultSelector()
+    sock.setblocking(False)
+    daemon_selector.register(sock, selectors.EVENT_READ, lambda events : accept_client(sock))
+    
+    # Start redshift, unless it shall not be started until it is needed
+    supervisor = daemon_supervisor = ChildSupervisor()
+    for instance in daemon_instances:
+        if not red_lazy:
+            start_instance(instance)
+        publish_status(instance.ns)
+        status_published(instance)
+    daemon_socket = sock
+    start_daemon_threads(daemon_instances[0].proc, sock)
+    schedule_release()
+    
+    # Profile the daemon when requested with SIGUSR2
+    signal.signal(signal.SIGUSR2, toggle_profiling)
+    
+    daemon_selector.register(supervisor, selectors.EVENT_READ, lambda events : supervise_redshift(supervisor))
+    supervise_redshift(supervisor)
+    
+    # Disable redshift while windows that match `focus_rules` are focused
+    start_focus_rules()
+    
+    # Rerun the configuration script when it is modified
+    watcher = None
+    if config_file is not None:
         try:
-            (client_sock, _client_address) = sock.accept()
+            watcher = ConfigWatcher(config_file)
+            daemon_selector.register(watcher, selectors.EVENT_READ, lambda events : watch_config(watcher, sock))
+        except OSError:
+            watcher = None # inotify is not available, the configuration script will not be reloaded
+    
+    while any(instance.ns['red_running'] for instance in daemon_instances):
+        publish_status_files()
+        timeout = None
+        if len(daemon_timers) > 0:
+            timeout = max(daemon_timers[0][0] - time.monotonic(), 0)
+        for (key, events) in daemon_selector.select(timeout):
+            key.data(events)
+        now = time.monotonic()
+        while (len(daemon_timers) > 0) and (daemon_timers[0][0] <= now):
+            heapq.heappop(daemon_timers)[2]()
+    
+    # Tell the clients still waiting that redshift will not reach the state they requested
+    for waiter in list(daemon_waiters):
+        expire_waiter(waiter, 'exited')
+    
+    # Give the clients a last chance to receive what has been sent to them
+    for client in list(daemon_clients):
+        try:
+            client.sock.settimeout(1)
+            client.sock.sendall(client.outbuf)
         except:
-            broke = True
-            break # We have shut down the socket so that accept halts
-        client_thread = threading.Thread(target = use_client, args = (client_sock, proc))
-        client_thread.setDaemon(True)
-        client_thread.start()
-        # Broadcast status from redshift
-        broadacast_thread = threading.Thread(target = broadcast_status, args = (client_sock,))
-        broadacast_thread.setDaemon(True)
-        broadacast_thread.start()
-        red_condition.acquire()
+            pass
+        drop_client(client)
+    if daemon_focus is not None:
+        daemon_focus.source.close()
+    daemon_selector.close()
+    supervisor.close()
+    stop_profiling()
+    for instance in daemon_instances:
+        if instance.status_file is not None:
+            instance.status_file.close()
+    if watcher is not None:
+        watcher.close()
+    if daemon_instances[0].recorder is not None:
+        daemon_instances[0].recorder.close()
+
+
+def activated_socket():
+    '''
+    Get the listening socket passed by the service manager, if the daemon was
+    socket activated, as described by the environment variables LISTEN_PID and
+    LISTEN_FDS, the socket is the first file descriptor after stdin, stdout and stderr
     
-    if not broke:
-        red_condition.release()
-    thread.join()
+    @return  :socket?  The server socket, `None` if the daemon was not socket activated
+    '''
+    if not os.environ.get('LISTEN_PID', '') == str(os.getpid()):
+        return None
+    try:
+        fds = int(os.environ.get('LISTEN_FDS', ''))
+    except ValueError:
+        return None
+    # Do not let redshift think that it has been socket activated
+    for var in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        os.environ.pop(var, None)
+    if fds < 1:
+        return None
+    return socket.socket(fileno = 3)
 
 
 def do_daemon(reexec):
@@ -555,14 +2308,16 @@ def do_daemon(reexec):
             print('%s: error: %s can be used when running as the daemon' % (disallowed, sys.argv[0]))
             sys.exit(1)
     
-    # Create server socket
-    try:
-        os.unlink(socket_path)
-    except:
-        pass # The fill does (probably) not exist
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.bind(socket_path)
-    sock.listen(backlog)
+    # Create server socket, unless the service manager has created it
+    sock = activated_socket()
+    if sock is None:
+        try:
+            os.unlink(socket_path)
+        except:
+            pass # The fill does (probably) not exist
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(socket_path)
+        sock.listen(backlog)
     
     # Signal respawner
     if reexec:
@@ -587,62 +2342,181 @@ def do_status():
     '''
     Run actions for --status when the daemon is running
     '''
-    sock.sendall('status\n'.encode('utf-8'))
-    buf = ''
+    global client_failed
+    queue_command('status')
+    flush_commands()
+    buf = (client_reader.receive(sock) or b'').decode('utf-8', 'replace') + '\n'
+    if buf.startswith('Error: '):
+        sys.stderr.write('%s: %s' % (sys.argv[0], buf[len('Error: '):]))
+        client_failed = True
+        return
+    sys.stdout.buffer.write(buf.encode('utf-8'))
+    sys.stdout.buffer.flush()
+
+
+def do_metrics():
+    '''
+    Run actions for --metrics and --openmetrics
+    '''
+    global client_outbox
+    if show_metrics == 'openmetrics':
+        client_outbox += 'metrics openmetrics\n'
+    else:
+        client_outbox += 'metrics\n'
+    flush_commands()
     while True:
-        got = sock.recv(1024)
-        if (got is None) or (len(got) == 0):
+        # Skip status updates until the metrics arrive
+        message = client_reader.receive(sock)
+        if message is None:
+            return
+        message = message.decode('utf-8', 'replace')
+        if message.startswith('# TYPE') or message.startswith('Lines parsed'):
+            break
+    sys.stdout.buffer.write((message + '\n').encode('utf-8'))
+    sys.stdout.buffer.flush()
+
+
+def send_command(command):
+    '''
+    Send a command that controls redshift, to be acknowledged
+    or waited for by the daemon if --ack or --wait is used
+    
+    @param  command:str  The command
+    '''
+    global pending_replies
+    if command_mode == 'ack':
+        command = 'ack %s' % command
+    elif command_mode == 'wait':
+        command = 'wait %s %f' % (command, wait_timeout)
+    if command_mode is not None:
+        pending_replies += 1
+    queue_command(command)
+
+
+def queue_command(command):
+    '''
+    Queue a command to the daemon, to be sent by `flush_commands`
+    together with the other commands
+    
+    @param  command:str  The command, without line break
+    '''
+    global client_outbox
+    client_outbox += command_prefix + command + '\n'
+
+
+def flush_commands():
+    '''
+    Send the queued commands to the daemon
+    '''
+    global client_outbox
+    if len(client_outbox) > 0:
+        (message, client_outbox) = (client_outbox, '')
+        sock.sendall(message.encode('utf-8'))
+
+
+def await_replies():
+    '''
+    Print the daemon's replies to the commands sent by `send_command`,
+    other messages received in the meantime are skipped
+    '''
+    global pending_replies, client_failed
+    flush_commands()
+    while pending_replies > 0:
+        message = client_reader.receive(sock)
+        if message is None:
+            # The daemon has exited
+            client_failed = True
             break
-        buf += got.decode('utf-8', 'replace')
-        if '\n\n' in buf:
+        message = message.decode('utf-8', 'replace')
+        if message.startswith('Error: '):
+            sys.stderr.write('%s: %s\n' % (sys.argv[0], message[len('Error: '):]))
+            client_failed = True
             break
-    buf = buf.split('\n\n')[0] + '\n'
-    sys.stdout.buffer.write(buf.encode('utf-8'))
+        if not message.startswith('Command: '):
+            continue
+        pending_replies -= 1
+        if message.split('\n')[1] not in ('Result: sent', 'Result: unchanged', 'Result: done'):
+            client_failed = True
+        sys.stdout.buffer.write((message + '\n\n').encode('utf-8'))
     sys.stdout.buffer.flush()
 
 
+def do_batch():
+    '''
+    Run actions for --batch: send all commands in the file over the connection at
+    once, and print everything the daemon sends back until it closes the connection
+    '''
+    global client_failed, client_outbox
+    if batch_file == '-':
+        commands = sys.stdin.buffer.read()
+    else:
+        with open(batch_file, 'rb') as file:
+            commands = file.read()
+    for command in commands.decode('utf-8', 'strict').split('\n'):
+        command = command.strip()
+        if (len(command) == 0) or command.startswith('#'):
+            continue
+        elif command.startswith('@'):
+            # The command names its own instances
+            client_outbox += command + '\n'
+        else:
+            queue_command(command)
+    client_outbox += 'close\n'
+    flush_commands()
+    while True:
+        message = client_reader.receive(sock)
+        if message is None:
+            break
+        sys.stdout.buffer.write(message + b'\n\n')
+        sys.stdout.buffer.flush()
+        for line in message.decode('utf-8', 'replace').split('\n'):
+            (key, _colon, value) = line.partition(': ')
+            if (key == 'Error') or ((key in ('Result', 'Waited')) and (value in BATCH_FAILURES)):
+                client_failed = True
+
+
 def do_toggle():
     '''
     Run actions for --toggle
     '''
-    sock.sendall('toggle\n'.encode('utf-8'))
+    send_command('toggle')
 
 
 def do_disable():
     '''
     Run actions for --disable
     '''
-    sock.sendall('disable\n'.encode('utf-8'))
+    send_command('disable')
 
 
 def do_enable():
     '''
     Run actions for --enable
     '''
-    sock.sendall('enable\n'.encode('utf-8'))
+    send_command('enable')
 
 
 def do_freeze():
     '''
     Run actions for --freeze
     '''
-    sock.sendall('freeze\n'.encode('utf-8'))
+    send_command('freeze')
 
 
 def do_thaw():
     '''
     Run actions for --thaw
     '''
-    sock.sendall('thaw\n'.encode('utf-8'))
+    send_command('thaw')
 
 
 def do_kill():
     '''
     Run actions for --kill
     '''
-    sock.sendall('kill\n'.encode('utf-8'))
+    send_command('kill')
     if kill > 1:
-        sock.sendall('kill\n'.encode('utf-8'))
+        send_command('kill')
 
 
 def create_daemon():
@@ -715,7 +2589,7 @@ def create_client():
         sock.close()
         sock = None
         
-        if status:
+        if status or (show_metrics is not None):
             not_running()
             sys.exit(0)
     
@@ -730,10 +2604,121 @@ def create_client():
     return sock
 
 
+def do_forecast():
+    '''
+    Run actions for --forecast
+    '''
+    queue_command('forecast')
+    flush_commands()
+    while True:
+        # Skip status updates until the forecast arrives
+        message = client_reader.receive(sock)
+        if message is None:
+            return
+        message = message.decode('utf-8', 'replace')
+        if message.startswith('Forecast: ') or message.startswith('Instance: ') or message.startswith('Error: '):
+            break
+    for line in message.split('\n'):
+        if line.startswith('Forecast: '):
+            (t, dayness, temperature, brightness) = [float(v) for v in line[len('Forecast: '):].split(' ')]
+            line = '%s  %3.0f %% day  %5.0f K  %3.0f %%' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(t)),
+                                                         dayness * 100, temperature, brightness * 100)
+        print(line)
+
+
+def watch_values(message, keys):
+    '''
+    Get the status values in a status message, keyed by the names of the fields
+    in lower case, with spaces replaced by underscores, e.g. 'current_temperature'
+    
+    @param   message:str               The status message
+    @param   keys:list<str>            The keys of the fields to include, in order
+    @return  :dict<str, float|bool>    The values, numbers as floats and yes/no as booleans
+    '''
+    values = {}
+    for line in message.split('\n'):
+        (name, _colon, value) = line.partition(': ')
+        key = name.lower().replace(' ', '_')
+        if key in keys:
+            values[key] = (value == 'yes') if value in ('yes', 'no') else float(value)
+    return {key : values[key] for key in keys if key in values}
+
+
+def do_watch():
+    '''
+    Run actions for --watch: request status updates once, and print a line each time the
+    printed fields change, at most once per --interval, until the daemon exits
+    '''
+    global client_failed
+    import json
+    all_keys = [name.lower().replace(' ', '_') for (name, _format) in STATUS_FIELDS]
+    keys = all_keys if watch_fields is None else [key.strip() for key in watch_fields.split(',')]
+    for key in keys:
+        if key not in all_keys:
+            sys.stderr.write('%s: error: unrecognised field: %s\n' % (sys.argv[0], key))
+            client_failed = True
+            return
+    if watch_format == 'json':
+        render = lambda values : json.dumps(values, separators = (',', ':'))
+    else:
+        render = lambda values : watch_format.format_map(values)
+        try:
+            render(dict((key, 0.0) for key in keys))
+        except (KeyError, IndexError, ValueError) as err:
+            sys.stderr.write('%s: error: invalid format: %s\n' % (sys.argv[0], err))
+            client_failed = True
+            return
+    
+    # The daemon sends the status now, and then whenever it changes
+    queue_command('status')
+    queue_command('listen')
+    flush_commands()
+    (last_line, last_time, pending) = (None, None, None)
+    try:
+        while True:
+            if pending is not None:
+                remaining = last_time + watch_interval - time.monotonic()
+                if remaining <= 0:
+                    sys.stdout.write(pending + '\n')
+                    sys.stdout.flush()
+                    (last_line, last_time, pending) = (pending, time.monotonic(), None)
+            # Wait for the next message, or until a held back line can be printed
+            sock.settimeout(None if pending is None else remaining)
+            try:
+                message = client_reader.receive(sock)
+            except socket.timeout:
+                continue
+            if message is None:
+                # The daemon has exited
+                break
+            message = message.decode('utf-8', 'replace')
+            if message.startswith('Error: '):
+                sys.stderr.write('%s: %s\n' % (sys.argv[0], message[len('Error: '):]))
+                client_failed = True
+                break
+            line = render(watch_values(message, keys))
+            if line == last_line:
+                pending = None
+            elif (last_time is None) or (time.monotonic() - last_time >= watch_interval):
+                sys.stdout.write(line + '\n')
+                sys.stdout.flush()
+                (last_line, last_time, pending) = (line, time.monotonic(), None)
+            else:
+                pending = line
+    except BrokenPipeError:
+        # The reader, e.g. a status bar, has exited, do not complain when stdout is flushed at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
 def run_as_client():
     '''
     Perform client actions
     '''
+    # Send commands from a file
+    if batch_file is not None:
+        do_batch()
+        return
+    
     # Temporarily disable or enable redshift
     if set_status is not None:
         if set_status:
@@ -754,14 +2739,33 @@ def run_as_client():
     if kill > 0:
         do_kill()
     
+    # Print the outcome of the commands
+    if pending_replies > 0:
+        await_replies()
+    
+    # Get the daemon's metrics
+    if show_metrics is not None:
+        do_metrics()
+    
+    # Get the targeted settings for the next 24 hours
+    if show_forecast:
+        do_forecast()
+    
     # Get redshift status
     if status:
         do_status()
         sock.close()
+        return
+    
+    # Print the status whenever it changes
+    if watch:
+        do_watch()
+        return
     
     # Start user interface
-    if (kill == 0) and not (status or toggle or (set_status is not None) or (set_freeze is not None)):
-        sock.sendall('listen\n'.encode('utf-8'))
+    if (kill == 0) and not (toggle or (set_status is not None) or (set_freeze is not None) or (show_metrics is not None) or show_forecast):
+        queue_command('listen delta')
+        flush_commands()
         user_interface()
 
 
@@ -769,19 +2773,25 @@ def do_client():
     '''
     Do everything that has to do with being a client
     '''
-    global sock
+    global sock, client_outbox, client_reader
     # Connect to client
     sock = create_client()
+    client_reader = FrameReader(b'\n\n')
     
     # Perform client actions
     run_as_client()
     
     # Close socket
     try:
-        sock.sendall('close\n'.encode('utf-8'))
+        client_outbox += 'close\n'
+        flush_commands()
     except:
         pass
     sock.close()
+    
+    # Report commands that were not carried out
+    if client_failed:
+        sys.exit(1)
 
 
 def respawn_daemon():
@@ -843,17 +2853,9 @@ for key in l:
     g[key] = l[key]
 
 
-## Import interface.py with shared globals
-# Get the Python version
-v = sys.version_info
-if (v.major > 3) or ((v.major == 3) and (v.minor >= 4)):
-    # The (new) Python 3.4 way
-    import importlib.util
-    exec(importlib.util.find_spec('interface').loader.get_code('interface'), g)
-else:
-    # The deprecated legacy way
-    import importlib
-    exec(importlib.find_loader('interface').get_code('interface'), g)
+## Import interface.py and the other modules with shared globals
+for module in ('framing', 'snapshot', 'parsing', 'timewarp', 'config', 'supervise', 'metrics', 'profiling', 'ramps', 'solar', 'history', 'statusfile', 'focus', 'instance', 'interface'):
+    load_module(module)
 
 
 ## Load extension and configurations via nightshiftrc
@@ -903,21 +2905,11 @@ if config_file is None:
 # command line argument is the invoked command.
 conf_opts = [config_file] + conf_opts
 if config_file is not None:
-    code = None
-    # Read configuration script file
-    with open(config_file, 'rb') as script:
-        code = script.read()
-    # Decode configurion script file and add a line break
-    # at the end to ensure that the last line is empty.
-    # If it is not, we will get errors.
-    code = code.decode('utf-8', 'strict') + '\n'
-    # Compile the configuration script,
-    code = compile(code, config_file, 'exec')
-    # and run it, with it have the same
-    # globals as this module, so that it can
-    # not only use want we have defined, but
+    # Compile the configuration script, unless it is cached,
+    # and run it, with it have the same globals as this module,
+    # so that it can not only use want we have defined, but
     # also redefine it for us.
-    exec(code, g)
+    run_config(config_file)
 
 
 run()
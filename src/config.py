@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import struct
+import marshal
+
+
+CONFIG_CACHE_HEADER = struct.Struct('<4sqq')
+'''
+:struct.Struct  The header of a cached compiled configuration script: Python's bytecode
+                magic number, and the modification time, in nanoseconds, and size of
+                the script when it was compiled
+'''
+
+config_pristine = None
+'''
+:dict<str, ?>?  The globals as they were before the configuration script was run
+'''
+
+
+def config_cache_file(file):
+    '''
+    Get the pathname of the cached compiled version of a configuration script
+    
+    @param   file:str  The configuration script
+    @return  :str?     The cache file, `None` if there is no cache directory
+    '''
+    import hashlib
+    if ('XDG_CACHE_HOME' in os.environ) and (not os.environ['XDG_CACHE_HOME'] == ''):
+        cache = os.environ['XDG_CACHE_HOME']
+    elif ('HOME' in os.environ) and (not os.environ['HOME'] == ''):
+        cache = os.environ['HOME'] + os.sep + '.cache'
+    else:
+        return None
+    name = hashlib.sha1(os.path.realpath(file).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.sep.join([cache, PROGRAM_NAME, name + '.rcc'])
+
+
+def compile_config(file):
+    '''
+    Compile a configuration script, or load it from the cache
+    if it has not been modified since it was last compiled
+    
+    @param   file:str  The configuration script
+    @return  :code     The compiled configuration script
+    '''
+    import importlib.util
+    with open(file, 'rb') as script:
+        attr = os.fstat(script.fileno())
+        header = CONFIG_CACHE_HEADER.pack(importlib.util.MAGIC_NUMBER, attr.st_mtime_ns, attr.st_size)
+        cache = config_cache_file(file)
+        if cache is not None:
+            try:
+                with open(cache, 'rb') as cached:
+                    cached = cached.read()
+                if cached[:CONFIG_CACHE_HEADER.size] == header:
+                    return marshal.loads(cached[CONFIG_CACHE_HEADER.size:])
+            except (OSError, ValueError, EOFError, TypeError):
+                pass # Not cached, or cached by another version of Python
+        code = script.read()
+    # Decode configurion script file and add a line break
+    # at the end to ensure that the last line is empty.
+    # If it is not, we will get errors.
+    code = code.decode('utf-8', 'strict') + '\n'
+    code = compile(code, file, 'exec')
+    if cache is not None:
+        try:
+            os.makedirs(os.path.dirname(cache), exist_ok = True)
+            # Write to a temporary file and rename it, so
+            # that no other process sees a partial file
+            temp = '%s.%i' % (cache, os.getpid())
+            with open(temp, 'wb') as cached:
+                cached.write(header + marshal.dumps(code))
+            os.rename(temp, cache)
+        except OSError:
+            pass # We can run without a cache
+    return code
+
+
+def run_config(file):
+    '''
+    Run a configuration script, with the same globals as nightshift,
+    so that it can not only use what we have defined, but also redefine it
+    
+    @param  file:str  The configuration script
+    '''
+    global config_pristine
+    g = globals()
+    if config_pristine is None:
+        config_pristine = dict(g)
+    exec(compile_config(file), g)
+
+
+def stop_daemon_threads(proc, sock):
+    '''
+    Stop the threads started by `start_daemon_threads`, called before the configuration
+    script is reloaded, and before the first redshift instance's process is replaced
+    
+    @param  sock:socket  The server socket
+    @param  proc:Popen?  The process `start_daemon_threads` was given, `None` if it was not running
+    '''
+    pass
+
+
+def reload_config(proc, sock):
+    '''
+    Run the configuration script again, after it has been modified,
+    without restarting redshift
+    
+    Functions the configuration script has redefined are restored before
+    it is run again, so hooks that wrap their previous definition do not
+    wrap themselves. Variables it has changed are not restored.
+    
+    @param  proc:Popen?  The process of the first redshift instance, `None` if it is not running
+    @param  sock:socket  The server socket
+    '''
+    import traceback
+    stop_daemon_threads(proc, sock)
+    g = globals()
+    for (name, value) in config_pristine.items():
+        if callable(value) and (g.get(name, None) is not value):
+            g[name] = value
+    try:
+        run_config(config_file)
+    except Exception:
+        traceback.print_exc()
+    start_daemon_threads(proc, sock)
+
+
+class ConfigWatcher:
+    '''
+    Watches a configuration script for modifications using inotify
+    '''
+    
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO    = 0x00000080
+    IN_NONBLOCK    = 0o4000
+    IN_CLOEXEC     = 0o2000000
+    
+    EVENT = struct.Struct('iIII')
+    '''
+    :struct.Struct  The header of an inotify event: watch descriptor, mask, cookie and length of the name
+    '''
+    
+    def __init__(self, file):
+        '''
+        Constructor, start watching
+        
+        The directory of the file is watched, rather than the file
+        itself, so that files replaced by renaming are noticed
+        
+        @param  file:str  The configuration script
+        '''
+        import ctypes
+        file = os.path.realpath(file)
+        self.name = os.path.basename(file).encode('utf-8', 'surrogateescape')
+        '''
+        :bytes  The filename of the configuration script, without directory
+        '''
+        
+        libc = ctypes.CDLL(None, use_errno = True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        '''
+        :int  The inotify file descriptor
+        '''
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        directory = os.path.dirname(file).encode('utf-8', 'surrogateescape')
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO
+        if libc.inotify_add_watch(self.fd, directory, mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, os.strerror(errno))
+    
+    def fileno(self):
+        '''
+        Get the file descriptor, for use with selectors
+        
+        @return  :int  The inotify file descriptor
+        '''
+        return self.fd
+    
+    def read(self):
+        '''
+        Read pending events, without blocking
+        
+        @return  :bool  Whether the configuration script has been modified
+        '''
+        modified = False
+        while True:
+            try:
+                data = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            i = 0
+            while i < len(data):
+                (_wd, _mask, _cookie, length) = self.EVENT.unpack_from(data, i)
+                i += self.EVENT.size
+                if data[i : i + length].rstrip(b'\0') == self.name:
+                    modified = True
+                i += length
+        return modified
+    
+    def close(self):
+        '''
+        Stop watching
+        '''
+        os.close(self.fd)
+
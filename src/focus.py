@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import re
+
+
+FOCUS_FIELDS = ('instance', 'class', 'title')
+'''
+:tuple<str>  The fields of a window that focus rules can match, in the order
+             they are in a focus event: the instance and class names in
+             the window's WM_CLASS property, and the window's title
+'''
+
+FOCUS_CACHE_SIZE = 1024
+'''
+:int  The maximum number of windows `FocusTracker` remembers decisions for
+'''
+
+
+class PrefixTrie:
+    '''
+    A set of exact strings and prefixes, that can tell whether a string is
+    in it or starts with a prefix in it in time linear in the string's length
+    '''
+    
+    EXACT = 'exact'
+    '''
+    :str  The key that marks a node where an exact string ends, it is longer than a character
+    '''
+    
+    PREFIX = 'prefix'
+    '''
+    :str  The key that marks a node where a prefix ends, it is longer than a character
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.root = {}
+        '''
+        :dict<str, dict|bool>  The root node, each node maps characters to nodes,
+                               and `EXACT` and `PREFIX` to `True` where strings end
+        '''
+    
+    def add(self, string, prefix = False):
+        '''
+        Add a string
+        
+        @param  string:str   The string
+        @param  prefix:bool  Whether the string is a prefix of the strings it shall match
+        '''
+        node = self.root
+        for c in string:
+            node = node.setdefault(c, {})
+        node[self.PREFIX if prefix else self.EXACT] = True
+    
+    def match(self, string):
+        '''
+        Check whether a string is in the set, or starts with a prefix in it
+        
+        @param   string:str  The string
+        @return  :bool       Whether the string matches
+        '''
+        node = self.root
+        for c in string:
+            if self.PREFIX in node:
+                return True
+            node = node.get(c, None)
+            if node is None:
+                return False
+        return (self.PREFIX in node) or (self.EXACT in node)
+
+
+class FocusRules:
+    '''
+    Compiled focus rules, that tell whether redshift shall be disabled
+    while a window is focused, see `focus_rules`
+    '''
+    
+    def __init__(self, rules):
+        '''
+        Constructor, compile the rules
+        
+        @param  rules:list<(str, str)>  The field, one of `FOCUS_FIELDS`, and pattern, of each rule:
+                                        the exact value, a prefix followed by '*', or a regular
+                                        expression, that shall match anywhere, after 're:'
+        '''
+        self.tries = [PrefixTrie() for _field in FOCUS_FIELDS]
+        '''
+        :list<PrefixTrie>  The exact values and prefixes, for each field
+        '''
+        
+        self.patterns = [None] * len(FOCUS_FIELDS)
+        '''
+        :list<re.Pattern?>  The regular expressions, combined to one for each
+                            field, `None` for fields without regular expressions
+        '''
+        
+        expressions = [[] for _field in FOCUS_FIELDS]
+        for (field, pattern) in rules:
+            if field not in FOCUS_FIELDS:
+                raise ValueError('unrecognised focus rule field: %s' % field)
+            field = FOCUS_FIELDS.index(field)
+            if pattern.startswith('re:'):
+                try:
+                    # Report errors for the rule, rather than for the combination
+                    re.compile(pattern[3:])
+                except re.error as err:
+                    raise ValueError('invalid focus rule pattern: %s: %s' % (pattern, err))
+                expressions[field].append('(?:%s)' % pattern[3:])
+            elif pattern.endswith('*'):
+                self.tries[field].add(pattern[:-1], prefix = True)
+            else:
+                self.tries[field].add(pattern)
+        for (field, alternatives) in enumerate(expressions):
+            if len(alternatives) > 0:
+                self.patterns[field] = re.compile('|'.join(alternatives))
+    
+    def match(self, window):
+        '''
+        Check whether any rule matches a window
+        
+        @param   window:(str?, str?, str?)  The instance name, class name and title of the
+                                            window, see `FOCUS_FIELDS`, `None` if unknown
+        @return  :bool                      Whether redshift shall be disabled
+        '''
+        for (value, trie, pattern) in zip(window, self.tries, self.patterns):
+            if value is None:
+                continue
+            if trie.match(value) or ((pattern is not None) and (pattern.search(value) is not None)):
+                return True
+        return False
+
+
+class FocusTracker:
+    '''
+    Decides whether redshift shall be disabled for the focused window, remembering the
+    decision for each window, and the decision the daemon has not yet carried out
+    '''
+    
+    def __init__(self, rules, source):
+        '''
+        Constructor
+        
+        @param  rules:FocusRules  The compiled rules
+        @param  source:object     The focus event source, see `XFocusSource`
+        '''
+        self.rules = rules
+        '''
+        :FocusRules  The compiled rules
+        '''
+        
+        self.source = source
+        '''
+        :object  The focus event source, see `XFocusSource`
+        '''
+        
+        self.cache = {}
+        '''
+        :dict<int, ((str?, str?, str?), bool)>  The fields of each window the decision was
+                                                made for, and the decision, by window ID
+        '''
+        
+        self.wanted = False
+        '''
+        :bool  Whether redshift shall be disabled for the focused window
+        '''
+        
+        self.generation = 0
+        '''
+        :int  The number of times `wanted` has changed, so that a debounced
+              decision can tell whether it has been superseded
+        '''
+        
+        self.blocked = False
+        '''
+        :bool  Whether `wanted` could not be carried out for some redshift instance,
+               because it is frozen or dying, and shall be when the status changes
+        '''
+        
+        self.disabled = set()
+        '''
+        :set<RedshiftInstance>  The redshift instances that were disabled because of the rules,
+                                and shall be enabled again when the focus leaves, instances
+                                the user disabled are not enabled
+        '''
+    
+    def decide(self, event):
+        '''
+        Decide whether redshift shall be disabled for a window, reusing
+        the last decision for it unless its fields have changed
+        
+        @param   event:(int, str?, str?, str?)  The window ID, instance name, class
+                                                name and title of the focused window
+        @return  :bool                          Whether redshift shall be disabled
+        '''
+        (window, fields) = (event[0], event[1:])
+        cached = self.cache.get(window, None)
+        if (cached is not None) and (cached[0] == fields):
+            return cached[1]
+        if len(self.cache) >= FOCUS_CACHE_SIZE:
+            self.cache.clear()
+        decision = self.rules.match(fields)
+        self.cache[window] = (fields, decision)
+        return decision
+    
+    def update(self, events):
+        '''
+        Decide for the last of a number of focus events
+        
+        @param   events:list<(int, str?, str?, str?)>  The focus events, see `decide`, oldest first
+        @return  :bool                                 Whether the decision has changed
+        '''
+        if len(events) == 0:
+            return False
+        wanted = self.decide(events[-1])
+        if wanted == self.wanted:
+            return False
+        (self.wanted, self.blocked) = (wanted, False)
+        self.generation += 1
+        return True
+
+
+class XFocusSource:
+    '''
+    Reports which window is focused on the X display, using python3-xlib
+    
+    The root windows are only subscribed to focus and property change events,
+    and the focused window only to property change events, for its title;
+    the classes of windows are only fetched once
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor, connect to the X display, raises ImportError if python3-xlib is not installed
+        '''
+        from Xlib import X
+        import Xlib.display, Xlib.error
+        self.X = X
+        '''
+        :module  Xlib.X
+        '''
+        
+        self.closed = Xlib.error.ConnectionClosedError
+        '''
+        :type  The exception raised when the connection to the X display has been closed
+        '''
+        
+        self.errors = (Xlib.error.XError, Xlib.error.ConnectionClosedError)
+        '''
+        :tuple<type>  The exceptions raised for windows that no longer exist and the like
+        '''
+        
+        self.display = Xlib.display.Display()
+        '''
+        :Xlib.display.Display  The connection to the X display
+        '''
+        
+        self.active_atom = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        '''
+        :int  The atom for the property in which EWMH window managers list the focused window
+        '''
+        
+        self.title_atoms = (self.display.intern_atom('_NET_WM_NAME'), self.display.intern_atom('WM_NAME'))
+        '''
+        :(int, int)  The atoms for the properties with the title of a window, preferred first
+        '''
+        
+        self.roots = [self.display.screen(i).root for i in range(self.display.screen_count())]
+        '''
+        :list<Xlib.xobject.drawable.Window>  The root window of each screen
+        '''
+        
+        self.classes = {}
+        '''
+        :dict<int, (str?, str?)>  The instance and class names of windows, by window ID
+        '''
+        
+        self.window = None
+        '''
+        :Xlib.xobject.drawable.Window?  The focused window, `None` if none
+        '''
+        
+        for root in self.roots:
+            root.change_attributes(event_mask = X.FocusChangeMask | X.PropertyChangeMask)
+        self.display.flush()
+    
+    def fileno(self):
+        '''
+        Get the file descriptor, for use with selectors
+        
+        @return  :int  The file descriptor of the connection to the X display
+        '''
+        return self.display.fileno()
+    
+    def first(self):
+        '''
+        Get the window that is focused when the source is started
+        
+        @return  :list<(int, str?, str?, str?)>  The focus event, see `FocusTracker.decide`
+        '''
+        return [self.focused()]
+    
+    def read(self):
+        '''
+        Handle the events that have been received, without blocking,
+        raises ConnectionError if the connection to the X display has been closed
+        
+        @return  :list<(int, str?, str?, str?)>  The focus event, if the focused
+                                                 window or its title has changed
+        '''
+        changed = False
+        X = self.X
+        try:
+            while self.display.pending_events() > 0:
+                event = self.display.next_event()
+                if event.type in (X.FocusIn, X.FocusOut):
+                    changed = True
+                elif event.type == X.PropertyNotify:
+                    if event.atom == self.active_atom:
+                        changed = True
+                    elif (event.atom in self.title_atoms) and (self.window is not None):
+                        changed |= event.window.id == self.window.id
+        except self.closed as err:
+            raise ConnectionError(str(err))
+        return [self.focused()] if changed else []
+    
+    def focused(self):
+        '''
+        Get the focused window, and subscribe to changes of its title
+        
+        @return  :(int, str?, str?, str?)  The focus event, see `FocusTracker.decide`
+        '''
+        X = self.X
+        window = None
+        try:
+            active = self.roots[0].get_full_property(self.active_atom, X.AnyPropertyType)
+            if (active is not None) and (len(active.value) > 0) and (active.value[0] != X.NONE):
+                window = self.display.create_resource_object('window', active.value[0])
+            else:
+                # The window manager is not EWMH compliant
+                window = self.display.get_input_focus().focus
+                if isinstance(window, int):
+                    window = None
+        except self.errors:
+            window = None
+        if (window is None) or (self.window is None) or (window.id != self.window.id):
+            try:
+                if self.window is not None:
+                    self.window.change_attributes(event_mask = X.NoEventMask)
+                if window is not None:
+                    window.change_attributes(event_mask = X.PropertyChangeMask)
+            except self.errors:
+                pass
+            self.window = window
+        if window is None:
+            return (0, None, None, None)
+        return (window.id,) + self.window_class(window) + (self.window_title(window),)
+    
+    def window_class(self, window):
+        '''
+        Get the instance and class names of a window, which are fetched only once
+        
+        @param   window:Xlib.xobject.drawable.Window  The window
+        @return  :(str?, str?)                        The instance and class names, `None` if unknown
+        '''
+        if window.id not in self.classes:
+            try:
+                wm_class = window.get_wm_class()
+            except self.errors:
+                wm_class = None
+            if len(self.classes) >= FOCUS_CACHE_SIZE:
+                self.classes.clear()
+            self.classes[window.id] = (None, None) if wm_class is None else tuple(wm_class[:2])
+        return self.classes[window.id]
+    
+    def window_title(self, window):
+        '''
+        Get the title of a window
+        
+        @param   window:Xlib.xobject.drawable.Window  The window
+        @return  :str?                                The title, `None` if unknown
+        '''
+        for atom in self.title_atoms:
+            try:
+                title = window.get_full_property(atom, self.X.AnyPropertyType)
+            except self.errors:
+                return None
+            if (title is not None) and (len(title.value) > 0):
+                title = title.value
+                return title if isinstance(title, str) else bytes(title).decode('utf-8', 'replace')
+        return None
+    
+    def close(self):
+        '''
+        Disconnect from the X display
+        '''
+        try:
+            self.display.close()
+        except self.errors:
+            pass # The connection has already been closed
+
+
+class FakeFocusSource:
+    '''
+    A focus event source that reports the windows it is told are focused,
+    to test and benchmark focus rules without an X display
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        (self.r_end, self.w_end) = os.pipe()
+        '''
+        :int  The ends of a pipe that is written to when the focus has changed,
+              so that the source can be used with selectors
+        '''
+        
+        self.events = []
+        '''
+        :list<(int, str?, str?, str?)>  The focus events that have not been read
+        '''
+        
+        self.disconnected = False
+        '''
+        :bool  Whether `read` shall raise ConnectionError, as if the X display had been closed
+        '''
+    
+    def focus(self, window, instance = None, cls = None, title = None):
+        '''
+        Report that a window has been focused, or its title has changed
+        
+        @param  window:int     The window ID
+        @param  instance:str?  The instance name of the window
+        @param  cls:str?       The class name of the window
+        @param  title:str?     The title of the window
+        '''
+        self.events.append((window, instance, cls, title))
+        os.write(self.w_end, b'\n')
+    
+    def disconnect(self):
+        '''
+        Report that the connection to the display has been lost, so that
+        `read` raises ConnectionError, as `XFocusSource.read` does
+        '''
+        self.disconnected = True
+        os.write(self.w_end, b'\n')
+    
+    def fileno(self):
+        '''
+        Get the file descriptor, for use with selectors
+        
+        @return  :int  The read end of the pipe
+        '''
+        return self.r_end
+    
+    def first(self):
+        '''
+        Get the window that is focused when the source is started
+        
+        @return  :list<(int, str?, str?, str?)>  The focus events that have not been read
+        '''
+        return self.read()
+    
+    def read(self):
+        '''
+        Get the focus events that have been reported, raises ConnectionError
+        if the source has been disconnected with `disconnect`
+        
+        @return  :list<(int, str?, str?, str?)>  The focus events, oldest first
+        '''
+        if self.disconnected:
+            raise ConnectionError('the display has been disconnected')
+        if len(self.events) > 0:
+            os.read(self.r_end, len(self.events))
+        (events, self.events) = (self.events, [])
+        return events
+    
+    def close(self):
+        '''
+        Close the pipe
+        '''
+        os.close(self.r_end)
+        os.close(self.w_end)
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+class FrameReader:
+    '''
+    Splits a stream of bytes into frames that end with a delimiter, incrementally:
+    each byte is searched once and the consumed bytes are discarded in bulk,
+    so splitting n bytes into frames takes O(n) time however they arrive
+    
+    The daemon reads commands, that end with a line break, and clients
+    read messages, that end with an empty line, with frame readers
+    '''
+    
+    def __init__(self, delimiter):
+        '''
+        Constructor
+        
+        @param  delimiter:bytes  The bytes that end each frame
+        '''
+        self.delimiter = delimiter
+        '''
+        :bytes  The bytes that end each frame
+        '''
+        
+        self.buffer = bytearray()
+        '''
+        :bytearray  The received bytes that have not been discarded
+        '''
+        
+        self.start = 0
+        '''
+        :int  The position in `buffer` of the first byte that has not been returned in a frame
+        '''
+        
+        self.scanned = 0
+        '''
+        :int  The position in `buffer` up to which there is no delimiter
+        '''
+        
+        self.last = None
+        '''
+        :int?  The position in `buffer` where the last returned frame started,
+               `None` if it cannot be unread
+        '''
+    
+    def feed(self, data):
+        '''
+        Add received bytes
+        
+        @param  data:bytes  The bytes
+        '''
+        if self.start > len(self.buffer) // 2:
+            # Discard the returned frames, at most as many bytes as are
+            # kept are moved, so this is amortised over the frames
+            del self.buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+            self.last = None
+        self.buffer += data
+    
+    def next(self):
+        '''
+        Get the next complete frame
+        
+        @return  :bytes?  The frame, without the delimiter, `None` if there is no complete frame
+        '''
+        # This is called once per command, so it avoids function calls
+        # where it can, they cost more than the search for short commands
+        (start, scanned) = (self.start, self.scanned)
+        end = self.buffer.find(self.delimiter, scanned if scanned > start else start)
+        if end < 0:
+            self.scanned = max(len(self.buffer) - len(self.delimiter) + 1, start)
+            return None
+        frame = bytes(self.buffer[start : end])
+        self.last = start
+        self.start = self.scanned = end + len(self.delimiter)
+        return frame
+    
+    def unread(self):
+        '''
+        Put back the frame last returned by `next`, so that `next` returns it again,
+        this must be done before more bytes are added with `feed`
+        '''
+        (self.start, self.scanned, self.last) = (self.last, self.last, None)
+    
+    def pending(self):
+        '''
+        Check whether there is a complete frame, without consuming it
+        
+        @return  :bool  Whether `next` will return a frame
+        '''
+        return self.buffer.find(self.delimiter, max(self.scanned, self.start)) >= 0
+    
+    def receive(self, sock, size = 4096):
+        '''
+        Get the next complete frame, receiving from a blocking socket until there is one
+        
+        @param   sock:socket  The socket
+        @param   size:int     The maximum number of bytes to receive at a time
+        @return  :bytes?      The frame, without the delimiter, `None` if the
+                              connection was closed before a frame was complete
+        '''
+        frame = self.next()
+        while frame is None:
+            got = sock.recv(size)
+            if (got is None) or (len(got) == 0):
+                return None
+            self.feed(got)
+            frame = self.next()
+        return frame
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from array import array
+
+
+HISTORY_TIERS = ((1, 3600), (60, 1440), (3600, 720))
+'''
+:tuple<(int, int)>  The resolution, in seconds, and the number of records, of each tier
+                    of the status history: every second for an hour, every minute for a
+                    day and every hour for a month
+'''
+
+
+class HistoryTier:
+    '''
+    A ring buffer of status records, at most one per period of a fixed length,
+    each with the mean of the values recorded during its period, and the last flags
+    '''
+    
+    def __init__(self, resolution, capacity):
+        '''
+        Constructor
+        
+        @param  resolution:int  The length of a period, in seconds
+        @param  capacity:int    The maximum number of records
+        '''
+        self.resolution = resolution
+        '''
+        :int  The length of a period, in seconds
+        '''
+        
+        self.capacity = capacity
+        '''
+        :int  The maximum number of records
+        '''
+        
+        self.times = array('d', bytes(8 * capacity))
+        '''
+        :array<float>  When the last value of each record was recorded
+        '''
+        
+        self.temperatures = array('d', bytes(8 * capacity))
+        '''
+        :array<float>  The mean colour temperature of each record
+        '''
+        
+        self.brightnesses = array('d', bytes(8 * capacity))
+        '''
+        :array<float>  The mean brightness of each record
+        '''
+        
+        self.dayness = array('d', bytes(8 * capacity))
+        '''
+        :array<float>  The mean dayness of each record
+        '''
+        
+        self.flags = array('B', bytes(capacity))
+        '''
+        :array<int>  The last flags, see `STATUS_FLAGS`, of each record
+        '''
+        
+        self.count = 0
+        '''
+        :int  The number of records
+        '''
+        
+        self.end = 0
+        '''
+        :int  The index where the next record will be written
+        '''
+        
+        self.samples = 0
+        '''
+        :int  The number of values the last record is the mean of
+        '''
+    
+    def append(self, t, temperature, brightness, dayness, flags):
+        '''
+        Record values, in the last record if it is for the same period
+        
+        @param  t:float            When the values were recorded, not earlier than the last time
+        @param  temperature:float  The colour temperature
+        @param  brightness:float   The brightness
+        @param  dayness:float      The dayness
+        @param  flags:int          The flags, see `STATUS_FLAGS`
+        '''
+        last = (self.end - 1) % self.capacity
+        if (self.count > 0) and (t // self.resolution == self.times[last] // self.resolution):
+            self.samples += 1
+            n = self.samples
+            self.temperatures[last] += (temperature - self.temperatures[last]) / n
+            self.brightnesses[last] += (brightness - self.brightnesses[last]) / n
+            self.dayness[last] += (dayness - self.dayness[last]) / n
+        else:
+            (last, self.end, self.samples) = (self.end, (self.end + 1) % self.capacity, 1)
+            self.count = min(self.count + 1, self.capacity)
+            (self.temperatures[last], self.brightnesses[last], self.dayness[last]) = (temperature, brightness, dayness)
+        (self.times[last], self.flags[last]) = (t, flags)
+    
+    def oldest(self):
+        '''
+        Get the time of the oldest record
+        
+        @return  :float?  When the oldest record was last updated, `None` if there are no records
+        '''
+        return self.times[(self.end - self.count) % self.capacity] if self.count > 0 else None
+    
+    def since(self, t):
+        '''
+        Get the positions of the records updated at or after a time, oldest first
+        
+        @param   t:float         The time
+        @return  :iterable<int>  The indices of the records in the arrays
+        '''
+        first = self.end - self.count
+        (low, high) = (0, self.count)
+        # The records are in chronological order, find the first one at or after `t`
+        while low < high:
+            middle = (low + high) // 2
+            if self.times[(first + middle) % self.capacity] < t:
+                low = middle + 1
+            else:
+                high = middle
+        return ((first + i) % self.capacity for i in range(low, self.count))
+
+
+class StatusHistory:
+    '''
+    The history of the status of a redshift instance, in fixed memory,
+    with decreasing resolution further back, see `HISTORY_TIERS`
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.tiers = [HistoryTier(resolution, capacity) for (resolution, capacity) in HISTORY_TIERS]
+        '''
+        :list<HistoryTier>  The tiers, finest first
+        '''
+    
+    def record(self, t, values):
+        '''
+        Record a status
+        
+        @param  t:float                   When the status was published
+        @param  values:tuple<float|bool>  The status values, see `STATUS_FIELDS`
+        '''
+        flags = status_flags(values)
+        for tier in self.tiers:
+            tier.append(t, values[3], values[0], values[6], flags)
+    
+    def select(self, since, resolution = 0):
+        '''
+        Select the finest tier that is not finer than requested
+        and that goes back far enough, or the coarsest tier
+        
+        @param   since:float       The earliest time of interest
+        @param   resolution:float  The finest resolution of interest, in seconds
+        @return  :HistoryTier      The tier
+        '''
+        for tier in self.tiers:
+            if tier.resolution >= resolution:
+                oldest = tier.oldest()
+                if (oldest is None) or (oldest <= since) or (tier.count < tier.capacity):
+                    return tier
+        return self.tiers[-1]
+    
+    def lines(self, since, resolution = 0, chunk = 256):
+        '''
+        Render records as 'History: TIME TEMPERATURE BRIGHTNESS DAYNESS FLAGS' lines,
+        after a 'Resolution: SECONDS' line with the resolution of the records, in
+        chunks, so that they can be sent as the client is able to receive them
+        
+        @param   since:float           The earliest time of interest
+        @param   resolution:float      The finest resolution of interest, in seconds
+        @param   chunk:int             The number of lines per chunk
+        @return  :iterator<bytes>      The chunks, the last one ends with an empty line
+        '''
+        tier = self.select(since, resolution)
+        (lines, indices) = (['Resolution: %i\n' % tier.resolution], tier.since(since))
+        (times, temperatures, brightnesses, dayness, flags) = \
+            (tier.times, tier.temperatures, tier.brightnesses, tier.dayness, tier.flags)
+        for i in indices:
+            lines.append('History: %f %f %f %f %i\n' % (times[i], temperatures[i], brightnesses[i], dayness[i], flags[i]))
+            if len(lines) == chunk:
+                yield ''.join(lines).encode('utf-8')
+                lines = []
+        yield (''.join(lines) + '\n').encode('utf-8')
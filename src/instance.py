@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import signal
+from subprocess import Popen, PIPE
+
+
+RED_STATE = ('red_brightness', 'red_temperature', 'red_brightnesses', 'red_temperatures', 'red_period',
+             'red_location', 'red_status', 'red_running', 'red_dying', 'red_frozen', 'red_snapshot')
+'''
+:tuple<str>  The variables that make up the state of a redshift instance
+'''
+
+
+class RedshiftInstance:
+    '''
+    A redshift process run by the daemon, with its own options and status
+    '''
+    
+    def __init__(self, name, opts, ns):
+        '''
+        Constructor, does not start redshift
+        
+        @param  name:str         The name of the instance
+        @param  opts:list<str>   The options to run redshift with
+        @param  ns:dict<str, ?>  The namespace to keep the status in, with the
+                                 variables in `RED_STATE`, the globals for the
+                                 first instance
+        '''
+        self.name = name
+        '''
+        :str  The name of the instance
+        '''
+        
+        self.opts = opts
+        '''
+        :list<str>  The options to run redshift with
+        '''
+        
+        self.ns = ns
+        '''
+        :dict<str, ?>  The namespace the status is kept in
+        '''
+        
+        self.parser = RedshiftParser(ns, red_condition)
+        '''
+        :RedshiftParser  The parser for redshift's output
+        '''
+        
+        self.recorder = None
+        '''
+        :TranscriptRecorder?  The recorder of redshift's output, if it is recorded
+        '''
+        
+        self.proc = None
+        '''
+        :Popen?  The redshift process, `None` until it has been started
+        '''
+        
+        self.kills = 0
+        '''
+        :int  The number of times redshift shall be sent SIGTERM but has not yet been
+        '''
+        
+        self.halting = False
+        '''
+        :bool  Whether redshift has been stopped, so that it receives SIGTERM before it is sent another
+        '''
+        
+        self.starting = False
+        '''
+        :bool  Whether redshift has been started but has not yet reported its status
+        '''
+        
+        self.reported = 0
+        '''
+        :int  The number of colour temperatures redshift had reported when it was last started
+        '''
+        
+        self.releasing = False
+        '''
+        :bool  Whether redshift has been terminated because the daemon has been idle,
+               and shall be started again rather than be reported as exited
+        '''
+        
+        self.history = StatusHistory()
+        '''
+        :StatusHistory  The history of the status
+        '''
+        
+        self.ramps = None
+        '''
+        :numpy.ndarray|list<array<int>>?  The gamma ramps last written to `ramp_output`
+        '''
+        
+        self.status_file = None
+        '''
+        :StatusFile?  The file the status of the instance is published in, `None` if not created
+        '''
+        
+        self.desired = None
+        '''
+        :bool?  Whether redshift shall be enabled, according to the last toggle, enable
+                or disable command, `None` if redshift has reached that state
+        '''
+        
+        self.awaited = 0
+        '''
+        :int  The number of 'Status' lines redshift will have printed when it
+              has reported that it has toggled as it was last signalled to
+        '''
+        
+        self.reconciling = False
+        '''
+        :bool  Whether `reconcile_status` will be called when the event loop has handled
+               the events it is handling, because the desired state has been changed
+        '''
+    
+    def snapshot(self):
+        '''
+        Get the last published status of the instance
+        
+        @return  :StatusSnapshot?  The status, `None` if none has been published
+        '''
+        return self.ns['red_snapshot']
+    
+    def start(self, supervisor):
+        '''
+        Start redshift
+        
+        @param  supervisor:ChildSupervisor  The supervisor that shall supervise redshift
+        '''
+        self.proc = Popen(redshift_command(self.opts), stdout = PIPE, stderr = open(os.devnull))
+        os.set_blocking(self.proc.stdout.fileno(), False)
+        supervisor.watch(self.proc)
+        self.starting = True
+        self.reported = self.parser.counts.get(b'Color temperature', 0)
+        (self.desired, self.awaited) = (None, self.parser.counts.get(b'Status', 0))
+    
+    def target(self):
+        '''
+        Get whether redshift will be enabled when it has carried out the commands it has been given
+        
+        @return  :bool  The desired state, or the observed state if there is no desired state
+        '''
+        return self.ns['red_status'] if self.desired is None else self.desired
+    
+    def toggling(self):
+        '''
+        Check whether redshift has been signalled to toggle but has not yet reported it
+        
+        @return  :bool  Whether a toggle is in flight
+        '''
+        return self.parser.counts.get(b'Status', 0) < self.awaited
+    
+    def has_reported(self):
+        '''
+        Check whether redshift has reported its full status since it was last started
+        
+        @return  :bool  Whether redshift has reported its colour temperature
+        '''
+        return self.parser.counts.get(b'Color temperature', 0) > self.reported
+    
+    def release(self):
+        '''
+        Terminate redshift, so that it can be started again when it is needed
+        '''
+        self.releasing = True
+        # Thaw redshift, in case it is frozen, so that it can exit
+        self.proc.send_signal(signal.SIGCONT)
+        self.proc.terminate()
+
+
+def create_instances():
+    '''
+    Create the redshift instances listed in `red_instances`, or a single
+    instance named 'default' if it is `None`, without starting them
+    
+    @return  :list<RedshiftInstance>  The instances, the first one keeps its
+                                      status in the global `red_*` variables
+    '''
+    instances = []
+    for (name, opts) in (red_instances or { 'default' : [] }).items():
+        if len(instances) == 0:
+            ns = globals()
+        else:
+            ns = dict((var, globals()[var]) for var in RED_STATE)
+            ns['red_snapshot'] = None
+        instances.append(RedshiftInstance(name, red_opts + list(opts), ns))
+    return instances
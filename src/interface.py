@@ -18,7 +18,9 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import os
 import sys
+import time
 import fcntl
 import struct
 import signal
@@ -27,8 +29,55 @@ import threading
 
 
 ui_state = { 'focus' : 0
+           , 'dirty' : False
            }
 
+ui_frame = None
+'''
+:list<str>?  The lines on the screen, as last rendered, `None` if the screen must be redrawn completely
+'''
+
+ui_fields = {}
+'''
+:dict<str, str>  The last received value of each field in the status
+'''
+
+ui_history = {}
+'''
+:dict<int, float>  The colour temperature in each of the last `UI_HISTORY_MINUTES`
+                   minutes, by minute since the Epoch, for minutes where it is known
+'''
+
+UI_HISTORY_MINUTES = 60
+'''
+:int  The number of minutes the history of the colour temperature covers
+'''
+
+ui_sequence = None
+'''
+:int?  The version of the last status received from the daemon in delta mode
+'''
+
+UI_STATUS_FIELDS = { 'Current brightness'  : ('red_brightness',   None, float)
+                   , 'Daytime brightness'  : ('red_brightnesses', 0,    float)
+                   , 'Night brightness'    : ('red_brightnesses', 1,    float)
+                   , 'Current temperature' : ('red_temperature',  None, float)
+                   , 'Daytime temperature' : ('red_temperatures', 0,    float)
+                   , 'Night temperature'   : ('red_temperatures', 1,    float)
+                   , 'Dayness'             : ('red_period',       None, float)
+                   , 'Latitude'            : ('red_location',     0,    float)
+                   , 'Longitude'           : ('red_location',     1,    float)
+                   , 'Enabled'             : ('red_status',       None, lambda v : v == 'yes')
+                   , 'Running'             : ('red_running',      None, lambda v : v == 'yes')
+                   , 'Dying'               : ('red_dying',        None, lambda v : v == 'yes')
+                   , 'Frozen'              : ('red_frozen',       None, lambda v : v == 'yes')
+                   }
+'''
+:dict<str, (str, int?, (str)→float|bool)>  For each field in the status, the global variable it
+                                          is stored in, the index in that variable if it is a
+                                          tuple, and the function that converts the value
+'''
+
 
 def user_interface():
     '''
@@ -39,6 +88,7 @@ def user_interface():
     ui_winch()
     daemon_thread(ui_status).start()
     daemon_thread(ui_refresh).start()
+    daemon_thread(ui_resize).start()
     
     print('\033[?1049h\033[?25l')
     saved_stty = termios.tcgetattr(sys.stdout.fileno())
@@ -46,7 +96,7 @@ def user_interface():
     stty[3] &= ~(termios.ICANON | termios.ECHO | termios.ISIG)
     try:
         termios.tcsetattr(sys.stdout.fileno(), termios.TCSAFLUSH, stty)
-        sock.sendall('status\n'.encode('utf-8'))
+        sock.sendall((command_prefix + 'status\n' + ui_history_request()).encode('utf-8'))
         ui_read()
     finally:
         termios.tcsetattr(sys.stdout.fileno(), termios.TCSAFLUSH, saved_stty)
@@ -54,39 +104,100 @@ def user_interface():
         sys.stdout.buffer.flush()
 
 
-def ui_print():
+def ui_compose():
+    '''
+    Compose the user interface
+    
+    @return  :list<str>  The lines of the user interface
+    '''
     _button = lambda *i : ('[\033[1m%s\033[m]' if ui_state['focus'] in i else '<%s>')
     temperature =  tuple([red_temperature] + list(red_temperatures))
     brightness = [b * 100 for b in [red_brightness] + list(red_brightnesses)]
-    print('\033[H', end = '')
+    lines = []
     if red_running:
         lat, lon = red_location
         _if = lambda pn, v : pn[0] if v >= 0 else pn[1]
-        print('\033[2KLocation: %.4f°%s %.4f°%s' % (abs(lat), _if('NS', lat), abs(lon), _if('EW', lon)))
-        print('\033[2KTemperature: %.0f K (day: %.0f K, night: %.0f K)' % tuple(temperature))
-        print('\033[2KBrightness: %.0f %% (day: %.0f %%, night: %.0f %%)' % tuple(brightness))
-        print('\033[2KDayness: %.0f %%' % (red_period * 100))
-        print('\033[2K' + ('Dying' if red_dying else ('Enabled' if red_status else 'Disabled')))
-        print('\033[2K\n\033[2K', end = '')
+        lines.append('Location: %.4f°%s %.4f°%s' % (abs(lat), _if('NS', lat), abs(lon), _if('EW', lon)))
+        lines.append('Temperature: %.0f K (day: %.0f K, night: %.0f K)' % tuple(temperature))
+        lines.append('Brightness: %.0f %% (day: %.0f %%, night: %.0f %%)' % tuple(brightness))
+        lines.append('Dayness: %.0f %%' % (red_period * 100))
+        lines.append('Last hour: %s' % ui_sparkline())
+        lines.append('Dying' if red_dying else ('Enabled' if red_status else 'Disabled'))
+        lines.append('')
         if not red_dying:
             if red_frozen:
-                print(_button(0, 1) % 'Thaw', end = '  ')
-                print(_button(2) % 'Kill', end = '  ')
-                print(_button(3) % 'Close')
+                buttons = [_button(0, 1) % 'Thaw', _button(2) % 'Kill', _button(3) % 'Close']
             else:
-                print(_button(0) % ('Disable' if red_status else 'Enable'), end = '  ')
-                print(_button(1) % 'Freeze', end = '  ')
-                print(_button(2) % 'Kill', end = '  ')
-                print(_button(3) % 'Close')
+                buttons = [_button(0) % ('Disable' if red_status else 'Enable'), _button(1) % 'Freeze',
+                           _button(2) % 'Kill', _button(3) % 'Close']
         else:
-            print(_button(0, 1, 2) % 'Kill immediately', end = '  ')
-            print(_button(3) % 'Close')
+            buttons = [_button(0, 1, 2) % 'Kill immediately', _button(3) % 'Close']
     else:
-        print('\033[2KNot running')
-        print('\033[2K\n\033[2K', end = '')
-        print(_button(0, 1, 2) % 'Revive', end = '  ')
-        print(_button(3) % 'Close')
-    print('\033[J')
+        lines.append('Not running')
+        lines.append('')
+        buttons = [_button(0, 1, 2) % 'Revive', _button(3) % 'Close']
+    lines.append('  '.join(buttons))
+    return lines
+
+
+def ui_sparkline():
+    '''
+    Draw the colour temperature in each of the last `UI_HISTORY_MINUTES` minutes,
+    from the night temperature to the daytime temperature, oldest first
+    
+    @return  :str  The sparkline, with a space for each minute before the first known
+    '''
+    (now, bars) = (int(time.time() // 60), ' ▁▂▃▄▅▆▇█')
+    (night, day) = (red_temperatures[1], red_temperatures[0])
+    (line, value) = ([], None)
+    for minute in range(now - UI_HISTORY_MINUTES + 1, now + 1):
+        # Until the temperature changes again it is the same
+        value = ui_history.get(minute, value)
+        if value is None:
+            line.append(' ')
+        elif day == night:
+            line.append(bars[-1])
+        else:
+            level = min(max((value - night) / (day - night), 0), 1)
+            line.append(bars[1 + int(level * (len(bars) - 2) + 0.5)])
+    return ''.join(line)
+
+
+def ui_history_request():
+    '''
+    Get the command that requests the history the user interface shows
+    
+    @return  :str  The command, with line break
+    '''
+    return '%shistory -%i 60\n' % (command_prefix, UI_HISTORY_MINUTES * 60)
+
+
+def ui_render():
+    '''
+    Update the screen to the current state of the user interface, only rewriting the
+    lines that have changed since it was last rendered, in a single write
+    '''
+    global ui_frame
+    lines = ui_compose()
+    (output, previous) = ('', ui_frame)
+    if previous is None:
+        (output, previous) = ('\033[H\033[J', [])
+    output += ''.join('\033[%i;1H%s\033[K' % (i + 1, line) for (i, line) in enumerate(lines)
+                      if (i >= len(previous)) or not (previous[i] == line))
+    if len(lines) < len(previous):
+        output += '\033[%i;1H\033[J' % (len(lines) + 1)
+    ui_frame = lines
+    if len(output) > 0:
+        sys.stdout.buffer.write(output.encode('utf-8'))
+        sys.stdout.buffer.flush()
+
+
+def ui_invalidate():
+    '''
+    Request that the user interface is rendered, `red_condition` must be held
+    '''
+    ui_state['dirty'] = True
+    red_condition.notify()
 
 
 def ui_read():
@@ -109,7 +220,7 @@ def ui_read():
                     ui_state['focus'] = 0
                 else:
                     ui_state['focus'] = 3
-                red_condition.notify()
+                ui_invalidate()
             finally:
                 red_condition.release()
         elif c in b' \n':
@@ -119,93 +230,164 @@ def ui_read():
                     break
                 elif red_running:
                     if red_dying or (ui_state['focus'] == 2):
-                        sock.sendall('kill\n'.encode('utf-8'))
+                        sock.sendall((command_prefix + 'kill\n').encode('utf-8'))
                         red_dying = True
                     elif red_frozen:
-                        sock.sendall('thaw\n'.encode('utf-8'))
+                        sock.sendall((command_prefix + 'thaw\n').encode('utf-8'))
                         red_frozen = False
                     else:
                         if ui_state['focus'] == 0:
-                            sock.sendall('toggle\n'.encode('utf-8'))
+                            sock.sendall((command_prefix + 'toggle\n').encode('utf-8'))
                         elif ui_state['focus'] == 1:
-                            sock.sendall('freeze\n'.encode('utf-8'))
+                            sock.sendall((command_prefix + 'freeze\n').encode('utf-8'))
                             red_frozen = True
-                    red_condition.notify()
+                    ui_invalidate()
                 else:
                     respawn_daemon()
+                    ui_fields.clear()
                     daemon_thread(ui_status).start()
-                    sock.sendall('status\n'.encode('utf-8'))
-                    sock.sendall('listen\n'.encode('utf-8'))
+                    sock.sendall((command_prefix + 'status\n' + ui_history_request()).encode('utf-8'))
+                    sock.sendall((command_prefix + 'listen delta\n').encode('utf-8'))
             finally:
                 red_condition.release()
 
 
 def ui_refresh():
+    '''
+    Render the user interface whenever it has changed, but at most `ui_fps` times a
+    second, changes made while waiting for the next frame are rendered together
+    '''
+    last = 0
     while True:
         red_condition.acquire()
         try:
-            red_condition.wait()
-            ui_print()
+            while not ui_state['dirty']:
+                red_condition.wait()
+            # Let more changes arrive before rendering
+            delay = last + 1 / ui_fps - time.monotonic()
+            while delay > 0:
+                red_condition.wait(delay)
+                delay = last + 1 / ui_fps - time.monotonic()
+            ui_state['dirty'] = False
+            last = time.monotonic()
+            ui_render()
         finally:
             red_condition.release()
 
 
 def ui_winch():
-    global height, width
+    '''
+    Get the size of the terminal, and arrange for SIGWINCH to be reported to
+    `ui_resize` through a pipe, rather than be handled in the signal handler
+    '''
+    global height, width, ui_winch_pipe
     (height, width) = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))
-    def winch(signal, frame):
-        global height, width
-        (height, width) = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))
+    ui_winch_pipe = os.pipe()
+    os.set_blocking(ui_winch_pipe[1], False)
+    # The handler does nothing, but Python writes to the
+    # wakeup file descriptor when the signal is received
+    signal.signal(signal.SIGWINCH, lambda signo, frame : None)
+    signal.set_wakeup_fd(ui_winch_pipe[1])
+
+
+def ui_resize():
+    '''
+    Get the new size of the terminal, and redraw the user interface
+    completely, whenever the terminal has been resized
+    '''
+    global height, width, ui_frame
+    while len(os.read(ui_winch_pipe[0], 64)) > 0:
+        size = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))
         red_condition.acquire()
         try:
-            red_condition.notify()
+            (height, width) = size
+            # The terminal may have moved the lines around
+            ui_frame = None
+            ui_invalidate()
         finally:
             red_condition.release()
-    signal.signal(signal.SIGWINCH, winch)
 
 
 def ui_status():
-    buf = ''
-    continue_to_run = True
-    while continue_to_run:
-        while '\n\n' not in buf:
-            got = sock.recv(1024)
-            if (got is None) or (len(got) == 0):
-                continue_to_run = False
-                break
-            buf += got.decode('utf-8', 'replace')
-            if '\n\n' in buf:
-                break
-        if continue_to_run:
-            msg, buf = buf.split('\n\n')[0], '\n\n'.join(buf.split('\n\n')[1:])
-            ui_status_callback(dict([line.split(': ') for line in msg.split('\n')]))
+    '''
+    Receive status messages from the daemon until it disconnects
+    '''
+    reader = FrameReader(b'\n\n')
+    while True:
+        message = reader.receive(sock)
+        if message is None:
+            break
+        ui_status_message([line.split(': ', 1) for line in message.decode('utf-8', 'replace').split('\n')])
     ui_status_callback(None)
 
 
+def ui_status_message(fields):
+    '''
+    Apply a status message received from the daemon
+    
+    @param  fields:list<[str, str]>  The fields in the message, as name–value pairs
+    '''
+    global ui_sequence
+    if fields[0][0] == 'Resolution':
+        # The history requested when the user interface started
+        for (key, value) in fields[1:]:
+            (t, temperature) = value.split(' ')[:2]
+            ui_history.setdefault(int(float(t) // 60), float(temperature))
+        ui_status_callback({})
+        return
+    if fields[0][0] == 'Snapshot':
+        ui_sequence = int(fields[0][1])
+        fields = fields[1:]
+    elif fields[0][0] == 'Delta':
+        sequence = int(fields[0][1])
+        if (ui_sequence is None) or (not sequence == ui_sequence + 1):
+            # We have missed an update, we need the full status
+            sock.sendall((command_prefix + 'resync\n').encode('utf-8'))
+            return
+        ui_sequence = sequence
+        fields = fields[1:]
+    changed = {}
+    for (key, value) in fields:
+        if not ui_fields.get(key, None) == value:
+            ui_fields[key] = value
+            changed[key] = value
+    ui_status_callback(changed)
+
+
 def ui_status_callback(status):
-    global red_brightness, red_temperature, red_brightnesses, red_temperatures
-    global red_period, red_location, red_status, red_running, red_dying, red_frozen
+    '''
+    Update the status of redshift with changed fields, and refresh the user interface
+    
+    @param  status:dict<str, str>?  The changed fields, `None` if the daemon has disconnected
+    '''
+    global red_running
     if status is not None:
-        brightness  = [float(status['%s brightness' % k])  for k in ('Current', 'Daytime', 'Night')]
-        temperature = [float(status['%s temperature' % k]) for k in ('Current', 'Daytime', 'Night')]
+        g = globals()
         red_condition.acquire()
         try:
-            red_brightness,  red_brightnesses = brightness[0],  tuple(brightness[1:])
-            red_temperature, red_temperatures = temperature[0], tuple(temperature[1:])
-            red_period   = float(status['Dayness'])
-            red_location = (float(status['Latitude']), float(status['Longitude']))
-            red_status   = status['Enabled'] == 'yes'
-            red_running  = status['Running'] == 'yes'
-            red_dying    = status['Dying']   == 'yes'
-            red_frozen  = status['Frozen'] == 'yes'
-            red_condition.notify()
+            for key in status:
+                if key not in UI_STATUS_FIELDS:
+                    continue
+                (var, index, convert) = UI_STATUS_FIELDS[key]
+                if index is None:
+                    g[var] = convert(status[key])
+                else:
+                    value = list(g[var])
+                    value[index] = convert(status[key])
+                    g[var] = tuple(value)
+            if red_running:
+                minute = int(time.time() // 60)
+                ui_history[minute] = red_temperature
+                for old in [m for m in ui_history if m <= minute - UI_HISTORY_MINUTES]:
+                    del ui_history[old]
+            ui_invalidate()
         finally:
             red_condition.release()
     else:
         red_condition.acquire()
         try:
             red_running = False
-            red_condition.notify()
+            ui_invalidate()
         finally:
             red_condition.release()
 
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import time
+import bisect
+import threading
+
+
+class TimedCondition:
+    '''
+    A `threading.Condition` that keeps track of how long its lock has been held,
+    and logs waits for it that are longer than `lock_wait_threshold`
+    '''
+    
+    def __init__(self, name):
+        '''
+        Constructor
+        
+        @param  name:str  The name of the condition, used in the log
+        '''
+        self.name = name
+        '''
+        :str  The name of the condition, used in the log
+        '''
+        
+        self.condition = threading.Condition()
+        '''
+        :threading.Condition  The wrapped condition
+        '''
+        
+        self.held = 0
+        '''
+        :float  The total number of seconds the lock has been held
+        '''
+        
+        self.acquisitions = 0
+        '''
+        :int  The number of times the lock has been acquired
+        '''
+        
+        self.since = None
+        '''
+        :float?  When the lock was acquired, if it is held
+        '''
+    
+    def acquire(self):
+        '''
+        Acquire the lock
+        '''
+        if lock_wait_threshold is None:
+            self.condition.acquire()
+        elif not self.condition.acquire(blocking = False):
+            start = time.monotonic()
+            self.condition.acquire()
+            waited = time.monotonic() - start
+            if waited > lock_wait_threshold:
+                caller = sys._getframe(1).f_code.co_name
+                if caller == '__enter__':
+                    caller = sys._getframe(2).f_code.co_name
+                sys.stderr.write('%s: waited %f seconds for %s in %s, in thread %s\n'
+                                 % (sys.argv[0], waited, self.name, caller, threading.current_thread().name))
+        self.since = time.monotonic()
+        self.acquisitions += 1
+    
+    def release(self):
+        '''
+        Release the lock
+        '''
+        self.held += time.monotonic() - self.since
+        self.since = None
+        self.condition.release()
+    
+    def wait(self, timeout = None):
+        '''
+        Release the lock until the condition is notified, the lock must be held
+        
+        @param   timeout:float?  The maximum number of seconds to wait
+        @return  :bool           `False` if the timeout expired
+        '''
+        self.held += time.monotonic() - self.since
+        try:
+            return self.condition.wait(timeout)
+        finally:
+            self.since = time.monotonic()
+    
+    def notify(self, n = 1):
+        '''
+        Wake up threads waiting for the condition, the lock must be held
+        
+        @param  n:int  The maximum number of threads to wake up
+        '''
+        self.condition.notify(n)
+    
+    def notify_all(self):
+        '''
+        Wake up all threads waiting for the condition, the lock must be held
+        '''
+        self.condition.notify_all()
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class Histogram:
+    '''
+    A histogram of durations, with fixed buckets
+    '''
+    
+    BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+    '''
+    :tuple<float>  The upper bound, in seconds, of each bucket, except the last which has none
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        '''
+        :list<int>  The number of observations in each bucket, not cumulative
+        '''
+        
+        self.sum = 0
+        '''
+        :float  The sum of all observations
+        '''
+    
+    def observe(self, value):
+        '''
+        Add an observation
+        
+        @param  value:float  The duration, in seconds
+        '''
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+    
+    def cumulative(self):
+        '''
+        Get the number of observations at or below each bucket's upper bound
+        
+        @return  :list<(float?, int)>  The upper bound, `None` for no bound,
+                                       and number of observations of each bucket
+        '''
+        (buckets, total) = ([], 0)
+        for (bound, count) in zip(self.BUCKETS + (None,), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return buckets
+
+
+metric_bytes_sent = 0
+'''
+:int  The number of bytes the daemon has sent to clients
+'''
+
+metric_send_time = 0
+'''
+:float  The number of seconds the daemon has spent sending to clients
+'''
+
+metric_toggle_requests = 0
+'''
+:int  The number of toggle, enable and disable commands that changed the state redshift shall be in
+'''
+
+metric_toggle_signals = 0
+'''
+:int  The number of times redshift has been signalled to toggle
+'''
+
+metric_delivery = { 'listen' : Histogram(), 'delta' : Histogram(), 'binary' : Histogram() }
+'''
+:dict<str, Histogram>  The time from redshift's output arriving at the daemon until the status update
+                       it caused has been handed in full to the socket of a listening client, that is,
+                       until the client's queue has drained, not until the client has read it, by the
+                       kind of client: 'binary' for binary records, 'delta' for changed fields, and
+                       'listen' for full status messages
+'''
+
+
+def collect_metrics():
+    '''
+    Collect the daemon's metrics
+    
+    @return  :list<(str, str, str, list<(str, str, str, int|float)>)>
+                 For each metric: its name, its OpenMetrics type and a description, and
+                 for each sample: the suffix of the metric's name, the name and value of
+                 its label, or empty strings if it has none, and the value
+    '''
+    (counts, errors) = ({}, 0)
+    for instance in daemon_instances:
+        for (key, count) in instance.parser.counts.items():
+            key = key.decode('utf-8', 'replace') or 'unknown'
+            counts[key] = counts.get(key, 0) + count
+        errors += instance.parser.errors
+    counts = sorted(counts.items())
+    versions = sum(instance.snapshot().version + 1 for instance in daemon_instances)
+    conditions = [('red_condition', red_condition)]
+    ramps = cached_ramps.cache_info()
+    delivery = []
+    for (kind, listeners) in (('listen', 'listeners'), ('delta', 'delta listeners'), ('binary', 'binary listeners')):
+        histogram = metric_delivery[kind]
+        samples = [('_bucket', 'le', '+Inf' if bound is None else repr(bound), count) for (bound, count) in histogram.cumulative()]
+        samples.append(('_count', '', '', samples[-1][3]))
+        samples.append(('_sum', '', '', histogram.sum))
+        description = 'Seconds from redshift output until the queue to %s drained' % listeners
+        delivery.append(('nightshift_delivery_%s_seconds' % kind, 'histogram', description, samples))
+    return [('nightshift_lines', 'counter', 'Lines parsed', [('_total', 'key', k, c) for (k, c) in counts]),
+            ('nightshift_parse_errors', 'counter', 'Lines not parsed', [('_total', '', '', errors)]),
+            ('nightshift_status_versions', 'counter', 'Status versions published', [('_total', '', '', versions)]),
+            ('nightshift_clients', 'gauge', 'Connected clients', [('', '', '', len(daemon_clients))]),
+            ('nightshift_listeners', 'gauge', 'Listening clients', [('', '', '', sum(c.listening for c in daemon_clients))]),
+            ('nightshift_sent_bytes', 'counter', 'Bytes sent', [('_total', '', '', metric_bytes_sent)]),
+            ('nightshift_send_seconds', 'counter', 'Seconds spent sending', [('_total', '', '', metric_send_time)]),
+            ('nightshift_condition_held_seconds', 'counter', 'Seconds condition held',
+             [('_total', 'condition', n, c.held) for (n, c) in conditions]),
+            ('nightshift_condition_acquisitions', 'counter', 'Condition acquisitions',
+             [('_total', 'condition', n, c.acquisitions) for (n, c) in conditions]),
+            ('nightshift_toggle_requests', 'counter', 'Toggle requests', [('_total', '', '', metric_toggle_requests)]),
+            ('nightshift_toggle_signals', 'counter', 'Toggle signals sent', [('_total', '', '', metric_toggle_signals)]),
+            ('nightshift_ramp_cache_lookups', 'counter', 'Gamma ramp cache lookups',
+             [('_total', 'result', 'hit', ramps.hits), ('_total', 'result', 'miss', ramps.misses)])] + delivery
+
+
+def render_metrics(openmetrics = False):
+    '''
+    Render the daemon's metrics
+    
+    @param   openmetrics:bool  Whether to use the OpenMetrics text format rather than
+                               the format of status messages, with one field per sample
+    @return  :str              The metrics, ending with an empty line
+    '''
+    lines = []
+    for (name, kind, description, samples) in collect_metrics():
+        if openmetrics:
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('# HELP %s %s' % (name, description))
+        elif len(samples) == 0:
+            # Print every metric, so that the first line is always the same, clients
+            # recognise the metrics by it, even before redshift has printed anything
+            lines.append('%s: 0' % description)
+        for (suffix, label, value, number) in samples:
+            if openmetrics:
+                label = '{%s="%s"}' % (label, value) if label else ''
+                lines.append('%s%s%s %s' % (name, suffix, label, repr(number)))
+            else:
+                label = ' (%s%s)' % ('≤ ' if label == 'le' else '', value) if label else ''
+                suffix = {'_count' : ' count', '_sum' : ' sum'}.get(suffix, '')
+                lines.append('%s%s%s: %s' % (description, suffix, label, repr(number)))
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n\n'
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+
+def parse_coordinate(value):
+    '''
+    Parse a coordinate printed by redshift
+    
+    @param   value:bytes  The coordinate, either signed ('-18.07', old versions
+                          of redshift) or followed by a hemisphere ('18.07 W')
+    @return  :float       The coordinate, negative on the southern and western hemispheres
+    '''
+    (value, _space, hemisphere) = value.partition(b' ')
+    if hemisphere in (b'S', b'W'):
+        return -float(value)
+    return float(value)
+
+
+def parse_location(ns, value):
+    '''
+    Parse a 'Location' line, for example 'Location: 59.33 N, 18.07 E'
+    or 'Location: 59.330000, 18.070000', followed by 'Temperatures'
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    (lat, _comma, lon) = value.partition(b', ')
+    ns['red_location'] = (parse_coordinate(lat), parse_coordinate(lon))
+
+
+def parse_temperatures(ns, value):
+    '''
+    Parse a 'Temperatures' line, for example 'Temperatures: 5500K Day, 3500K Night',
+    followed by a two parameter 'Brightness'
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    (day, _comma, night) = value.partition(b', ')
+    ns['red_temperatures'] = (float(day.partition(b'K')[0]), float(night.partition(b'K')[0]))
+
+
+def parse_period(ns, value):
+    '''
+    Parse a 'Period' line, for example 'Period: Night', 'Period: Daytime'
+    or 'Period: Transition (42.13% day)', followed by 'Color temperature'
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    if value == b'Night':
+        ns['red_period'] = 0
+    elif value == b'Daytime':
+        ns['red_period'] = 1
+    elif value.startswith(b'Transition ('):
+        ns['red_period'] = float(value[12:].partition(b'%')[0]) / 100
+    # 'None' is printed when there is no period, keep the last known value
+
+
+def parse_color_temperature(ns, value):
+    '''
+    Parse a 'Color temperature' line, for example 'Color temperature: 4500K',
+    followed by a one parameter 'Brightness'
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    ns['red_temperature'] = float(value.rstrip(b'K'))
+
+
+def parse_brightness(ns, value):
+    '''
+    Parse a 'Brightness' line, either with the current brightness,
+    for example 'Brightness: 0.90', or with the daytime and night
+    brightness, for example 'Brightness: 1.00:0.80'
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    (day, colon, night) = value.partition(b':')
+    if colon:
+        ns['red_brightnesses'] = (float(day), float(night))
+    else:
+        ns['red_brightness'] = float(value)
+
+
+def parse_status(ns, value):
+    '''
+    Parse a 'Status' line, 'Status: Enabled' or 'Status: Disabled',
+    printed when redshift is toggled
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    ns['red_status'] = value == b'Enabled'
+
+
+def parse_ignored(ns, value):
+    '''
+    Parse a line that does not affect the status
+    
+    @param  ns:dict<str, ?>  The namespace to store the status in
+    @param  value:bytes      The value of the line
+    '''
+    pass
+
+
+REDSHIFT_FIELDS = { b'Location'          : (parse_location,          False)
+                  , b'Temperatures'      : (parse_temperatures,      False)
+                  , b'Period'            : (parse_period,            False)
+                  , b'Color temperature' : (parse_color_temperature, False)
+                  , b'Brightness'        : (parse_brightness,        True)
+                  , b'Status'            : (parse_status,            True)
+                  , b'Solar elevation'   : (parse_ignored,           False)
+                  }
+'''
+:dict<bytes, ((dict<str, ?>, bytes)→void, bool)>  For each field that redshift prints in verbose
+                                                  mode, the function that parses its value, and
+                                                  whether the field ends an update that clients
+                                                  should be notified about
+'''
+
+
+class RedshiftParser:
+    '''
+    Incremental parser for the output of `redshift -v`
+    '''
+    
+    def __init__(self, ns, condition):
+        '''
+        Constructor
+        
+        @param  ns:dict<str, ?>                The namespace to store the status in, with
+                                               the same variables as the globals `red_*`
+        @param  condition:threading.Condition  The condition that guards `ns`, it is
+                                               notified when an update is complete
+        '''
+        self.ns = ns
+        '''
+        :dict<str, ?>  The namespace to store the status in
+        '''
+        
+        self.condition = condition
+        '''
+        :threading.Condition  The condition that guards `ns`
+        '''
+        
+        self.buffer = b''
+        '''
+        :bytes  Output that has not yet been terminated by a line break
+        '''
+        
+        self.counts = {}
+        '''
+        :dict<bytes, int>  The number of parsed lines per field, lines without
+                           a field and with unknown fields are counted under `b''`
+        '''
+        
+        self.errors = 0
+        '''
+        :int  The number of lines with a known field that could not be parsed
+        '''
+        
+        self.last_error = None
+        '''
+        :bytes?  The last line that could not be parsed
+        '''
+    
+    def feed(self, data):
+        '''
+        Parse output from redshift
+        
+        @param   data:bytes  The output, it does not have to end at a line break
+        @return  :bool       Whether an update that clients should be notified about has been completed
+        '''
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        if len(lines) == 0:
+            return False
+        notify = False
+        counts = self.counts
+        self.condition.acquire()
+        try:
+            for line in lines:
+                (key, _colon, value) = line.partition(b': ')
+                entry = REDSHIFT_FIELDS.get(key, None)
+                if entry is None:
+                    key = b''
+                else:
+                    try:
+                        entry[0](self.ns, value)
+                        notify |= entry[1]
+                    except ValueError:
+                        self.errors += 1
+                        self.last_error = line
+                counts[key] = counts.get(key, 0) + 1
+            if notify:
+                self.condition.notify_all()
+        finally:
+            self.condition.release()
+        return notify
+
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import sys
+import time
+import threading
+
+
+class DaemonProfiler:
+    '''
+    Profiles a running daemon: the event loop's thread is profiled with cProfile,
+    and the stacks of all threads, including those started by the configuration
+    script, are sampled periodically
+    '''
+    
+    def __init__(self, interval = 0.005):
+        '''
+        Constructor, start profiling, must be called in the event loop's thread
+        
+        @param  interval:float  The number of seconds between samples
+        '''
+        import cProfile
+        self.interval = interval
+        '''
+        :float  The number of seconds between samples
+        '''
+        
+        self.samples = {}
+        '''
+        :dict<str, int>  The number of times each stack has been sampled, the
+                         stacks are the thread's name followed by the functions,
+                         outermost first, separated by semicolons
+        '''
+        
+        self.running = True
+        '''
+        :bool  Whether the profiler is running
+        '''
+        
+        self.profile = cProfile.Profile()
+        '''
+        :cProfile.Profile  The profiler for the event loop's thread
+        '''
+        self.profile.enable()
+        
+        self.sampler = threading.Thread(target = self.sample, name = 'profiler', daemon = True)
+        '''
+        :threading.Thread  The thread that samples the stacks of all other threads
+        '''
+        self.sampler.start()
+    
+    def sample(self):
+        '''
+        Sample the stacks of all threads until the profiler is stopped
+        '''
+        own = threading.get_ident()
+        while self.running:
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for (ident, frame) in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('%s (%s:%i)' % (code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                stack = ';'.join(reversed(stack))
+                self.samples[stack] = self.samples.get(stack, 0) + 1
+            time.sleep(self.interval)
+    
+    def stop(self, file):
+        '''
+        Stop profiling and write the statistics, must be called in the event loop's thread
+        
+        The cProfile statistics are written to `file`, and can be read with
+        the pstats module, and the sampled stacks are written to `file`
+        with '.samples' appended, in the collapsed format flame graphs use
+        
+        @param   file:str     The file to write the cProfile statistics to
+        @return  :list<str>   The files written
+        '''
+        self.profile.disable()
+        self.running = False
+        self.sampler.join()
+        self.profile.dump_stats(file)
+        with open(file + '.samples', 'wb') as samples:
+            for (stack, count) in sorted(self.samples.items()):
+                samples.write(('%s %i\n' % (stack, count)).encode('utf-8', 'replace'))
+        return [file, file + '.samples']
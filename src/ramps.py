@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import functools
+from array import array
+
+numpy = False
+'''
+:module?  numpy, `None` if it is not installed, `False` if it has not been imported, see `import_numpy`
+'''
+
+
+NEUTRAL_TEMPERATURE = 6500
+'''
+:int  The colour temperature, in kelvins, that leaves the colours unchanged
+'''
+
+
+def import_numpy():
+    '''
+    Import numpy, when it is first needed rather than when nightshift is started, as it
+    takes longer to import than the rest of nightshift, and only the gamma ramps, with
+    --ramp-output, and the forecasts, in solar.py, use it
+    
+    @return  :module?  numpy, `None` if it is not installed
+    '''
+    global numpy
+    if numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+
+def planckian_whitepoint(temperature):
+    '''
+    Calculate the linear sRGB colour of a blackbody, using the cubic
+    approximation of the Planckian locus by Kim et al., which is valid
+    from 1667 K to 25000 K, temperatures outside are clamped
+    
+    @param   temperature:float        The temperature, in kelvins
+    @return  :(float, float, float)   The red, green and blue components, unnormalised
+    '''
+    t = min(max(temperature, 1667), 25000)
+    if t < 4000:
+        x = -0.2661239e9 / t ** 3 - 0.2343589e6 / t ** 2 + 0.8776956e3 / t + 0.179910
+    else:
+        x = -3.0258469e9 / t ** 3 + 2.1070379e6 / t ** 2 + 0.2226347e3 / t + 0.240390
+    if t < 2222:
+        y = -1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683
+    elif t < 4000:
+        y = -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867
+    else:
+        y = 3.0817580 * x ** 3 - 5.87338670 * x ** 2 + 3.75112997 * x - 0.37001483
+    (X, Z) = (x / y, (1 - x - y) / y)
+    return (max( 3.2406 * X - 1.5372 - 0.4986 * Z, 0),
+            max(-0.9689 * X + 1.8758 + 0.0415 * Z, 0),
+            max( 0.0557 * X - 0.2040 + 1.0570 * Z, 0))
+
+
+def whitepoint_table():
+    '''
+    Tabulate the whitepoints for every 100 K from 1000 K to 25000 K, relative to
+    the whitepoint of `NEUTRAL_TEMPERATURE`, and scaled so that no component
+    is greater than 1, in the same way as redshift
+    
+    @return  :list<(float, float, float)>  The whitepoints, in order
+    '''
+    neutral = planckian_whitepoint(NEUTRAL_TEMPERATURE)
+    table = []
+    for temperature in range(1000, 25001, 100):
+        white = [c / n for (c, n) in zip(planckian_whitepoint(temperature), neutral)]
+        table.append(tuple(c / max(white) for c in white))
+    return table
+
+
+WHITEPOINTS = whitepoint_table()
+'''
+:list<(float, float, float)>  The whitepoint for every 100 K from 1000 K to 25000 K
+'''
+
+
+def whitepoint(temperature):
+    '''
+    Get the whitepoint of a colour temperature, interpolated between
+    the nearest entries in `WHITEPOINTS`
+    
+    @param   temperature:float       The temperature, in kelvins
+    @return  :(float, float, float)  The red, green and blue components, at most 1
+    '''
+    position = (min(max(temperature, 1000), 25000) - 1000) / 100
+    index = min(int(position), len(WHITEPOINTS) - 2)
+    alpha = position - index
+    (low, high) = (WHITEPOINTS[index], WHITEPOINTS[index + 1])
+    return tuple((1 - alpha) * l + alpha * h for (l, h) in zip(low, high))
+
+
+def generate_ramps(temperature, brightness, gamma, size, vectorise = None):
+    '''
+    Generate the gamma ramps for a colour temperature, brightness and gamma
+    
+    @param   temperature:float                     The colour temperature, in kelvins
+    @param   brightness:float                      The brightness, from 0 to 1
+    @param   gamma:(float, float, float)           The gamma correction of each channel
+    @param   size:int                              The number of stops in each ramp, at least 2
+    @param   vectorise:bool?                       Whether to use numpy, if it is available if `None`
+    @return  :numpy.ndarray|list<array<int>>       The red, green and blue ramps, with values from 0
+                                                   to 65535; a read-only 3-by-`size` array of uint16
+                                                   if numpy is used, otherwise three arrays of 'H'
+    '''
+    numpy = import_numpy()
+    if vectorise is None:
+        vectorise = numpy is not None
+    white = whitepoint(temperature)
+    scales = [brightness * w for w in white]
+    if vectorise:
+        stops = numpy.linspace(0, 1, size)
+        ramps = (stops[None, :] * numpy.array(scales)[:, None]) ** (1 / numpy.array(gamma, dtype = float))[:, None]
+        ramps = (ramps * 65535 + 0.5).astype(numpy.uint16)
+        ramps.flags.writeable = False
+        return ramps
+    ramps = []
+    for (scale, g) in zip(scales, gamma):
+        (factor, exponent) = (scale / (size - 1), 1 / g)
+        ramps.append(array('H', (int((i * factor) ** exponent * 65535 + 0.5) for i in range(size))))
+    return ramps
+
+
+@functools.lru_cache(maxsize = 64)
+def cached_ramps(temperature, brightness, gamma, size):
+    '''
+    Generate gamma ramps for quantised parameters, use `colour_ramps` instead
+    
+    @param   temperature:int                  The colour temperature, in kelvins
+    @param   brightness:int                   The brightness, in thousandths
+    @param   gamma:(int, int, int)            The gamma correction of each channel, in thousandths
+    @param   size:int                         The number of stops in each ramp
+    @return  :numpy.ndarray|list<array<int>>  See `generate_ramps`, must not be modified
+    '''
+    return generate_ramps(temperature, brightness / 1000, tuple(g / 1000 for g in gamma), size)
+
+
+def colour_ramps(temperature, brightness, gamma = (1, 1, 1), size = 256):
+    '''
+    Get the gamma ramps for a colour temperature, brightness and gamma,
+    reusing ramps recently generated for the same quantised parameters:
+    the temperature in whole kelvins, the others in thousandths
+    
+    @param   temperature:float                The colour temperature, in kelvins
+    @param   brightness:float                 The brightness, from 0 to 1
+    @param   gamma:(float, float, float)      The gamma correction of each channel
+    @param   size:int                         The number of stops in each ramp, at least 2
+    @return  :numpy.ndarray|list<array<int>>  See `generate_ramps`, must not be modified
+    '''
+    gamma = tuple(int(round(g * 1000)) for g in gamma)
+    return cached_ramps(int(round(temperature)), int(round(brightness * 1000)), gamma, size)
+
+
+def red_opt_gamma(opts):
+    '''
+    Get the gamma correction redshift is run with, from its -g option
+    
+    @param   opts:list<str>          The options redshift is run with
+    @return  :(float, float, float)  The gamma correction of each channel, 1 if not specified
+    '''
+    gamma = (1, 1, 1)
+    for i in range(len(opts) - 1):
+        if opts[i] == '-g':
+            try:
+                value = tuple(float(v) for v in opts[i + 1].split(':'))
+                if len(value) == 1:
+                    value *= 3
+                if (len(value) == 3) and all(v > 0 for v in value):
+                    gamma = value
+            except ValueError:
+                pass
+    return gamma
+
+
+def write_ramps(file, ramps):
+    '''
+    Write gamma ramps to a file, replacing it atomically, with one line for each
+    of the red, green and blue ramps, and the values separated by spaces
+    
+    @param  file:str                         The file
+    @param  ramps:numpy.ndarray|list<array>  The ramps
+    '''
+    text = ''.join(' '.join(str(int(v)) for v in ramp) + '\n' for ramp in ramps)
+    with open(file + '~', 'wb') as output:
+        output.write(text.encode('utf-8'))
+    os.replace(file + '~', file)
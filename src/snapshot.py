@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import struct
+
+
+STATUS_FIELDS = (('Current brightness',  '%f'),
+                 ('Daytime brightness',  '%f'),
+                 ('Night brightness',    '%f'),
+                 ('Current temperature', '%f'),
+                 ('Daytime temperature', '%f'),
+                 ('Night temperature',   '%f'),
+                 ('Dayness',             '%f'),
+                 ('Latitude',            '%f'),
+                 ('Longitude',           '%f'),
+                 ('Enabled',             '%s'),
+                 ('Running',             '%s'),
+                 ('Dying',               '%s'),
+                 ('Frozen',              '%s'))
+'''
+:tuple<(str, str)>  The name and format of each field in a status message,
+                    in the same order as the values in `StatusSnapshot.values`
+'''
+
+STATUS_RECORD = struct.Struct('<Q9dB')
+'''
+:struct.Struct  The layout of a status record in the binary protocol: the version,
+                the nine numerical status values as doubles, in the same order
+                as in `STATUS_FIELDS`, and a byte with `STATUS_FLAGS`
+'''
+
+STATUS_FLAGS = (('Enabled', 1), ('Running', 2), ('Dying', 4), ('Frozen', 8))
+'''
+:tuple<(str, int)>  The name and bit of each boolean status value in a status record
+'''
+
+FRAME_HEADER = struct.Struct('<BI')
+'''
+:struct.Struct  The header of each frame sent to a client using the binary protocol:
+                the type of the frame, `FRAME_STATUS` or `FRAME_TEXT`, and the length
+                of the payload, which follows the header
+'''
+
+FRAME_STATUS = 1
+'''
+:int  The type of frames with a status record, see `STATUS_RECORD`
+'''
+
+FRAME_TEXT = 2
+'''
+:int  The type of frames with text, such as replies to commands, in the
+      same format as in the text protocol, a long reply can be split
+      over several frames, a message ends with an empty line
+'''
+
+
+class StatusSnapshot:
+    '''
+    Immutable status of redshift, as published by the daemon
+    '''
+    
+    __slots__ = ('version', 'values', 'previous', 'lines', 'message', '_tagged', '_delta', '_record')
+    
+    def __init__(self, version, values, previous = None):
+        '''
+        Constructor, renders and encodes the status message
+        
+        @param  version:int                  The version of the status, increases with every change
+        @param  values:tuple<float|bool>     The status values, see `STATUS_FIELDS`
+        @param  previous:tuple<float|bool>?  The values of the previous version, if any
+        '''
+        lines = tuple(render_status_line(field, value) for (field, value) in zip(STATUS_FIELDS, values))
+        object.__setattr__(self, 'version', version)
+        object.__setattr__(self, 'values', values)
+        object.__setattr__(self, 'previous', previous)
+        object.__setattr__(self, 'lines', lines)
+        object.__setattr__(self, 'message', b''.join(lines) + b'\n')
+        object.__setattr__(self, '_tagged', None)
+        object.__setattr__(self, '_delta', None)
+        object.__setattr__(self, '_record', None)
+    
+    def __setattr__(self, name, value):
+        raise AttributeError('status snapshots are immutable')
+    
+    def __delattr__(self, name):
+        raise AttributeError('status snapshots are immutable')
+    
+    def tagged_message(self):
+        '''
+        Get the full status message, tagged with the version, for clients in delta mode
+        
+        @return  :bytes  The status message, starting with a `Snapshot` field
+        '''
+        if self._tagged is None:
+            object.__setattr__(self, '_tagged', ('Snapshot: %i\n' % self.version).encode('utf-8') + self.message)
+        return self._tagged
+    
+    def delta_message(self):
+        '''
+        Get the message with the fields that changed since the previous version,
+        tagged with the version, for clients in delta mode
+        
+        @return  :bytes  The status message, starting with a `Delta` field,
+                         or the tagged full message if there is no previous version
+        '''
+        if self.previous is None:
+            return self.tagged_message()
+        if self._delta is None:
+            changed = [line for (line, value, old) in zip(self.lines, self.values, self.previous) if not value == old]
+            delta = ('Delta: %i\n' % self.version).encode('utf-8') + b''.join(changed) + b'\n'
+            object.__setattr__(self, '_delta', delta)
+        return self._delta
+    
+    def record(self):
+        '''
+        Get the status as a record, for clients using the binary protocol
+        
+        @return  :bytes  The status record, see `STATUS_RECORD`
+        '''
+        if self._record is None:
+            object.__setattr__(self, '_record', encode_status_record(self.version, self.values))
+        return self._record
+
+
+def render_status_message(values):
+    '''
+    Render a status message
+    
+    @param   values:tuple<float|bool>  The status values, see `STATUS_FIELDS`
+    @return  :str                      Status message
+    '''
+    return b''.join(render_status_line(field, value) for (field, value) in zip(STATUS_FIELDS, values)).decode('utf-8')
+
+
+def encode_status_record(version, values):
+    '''
+    Encode a status record for the binary protocol
+    
+    @param   version:int               The version of the status
+    @param   values:tuple<float|bool>  The status values, see `STATUS_FIELDS`
+    @return  :bytes                    The status record, see `STATUS_RECORD`
+    '''
+    return STATUS_RECORD.pack(version, *(values[:9] + (status_flags(values),)))
+
+
+def status_flags(values):
+    '''
+    Combine the boolean status values into flags
+    
+    @param   values:tuple<float|bool>  The status values, see `STATUS_FIELDS`
+    @return  :int                      The flags, see `STATUS_FLAGS`
+    '''
+    flags = 0
+    for (value, (_name, bit)) in zip(values[9:], STATUS_FLAGS):
+        if value:
+            flags |= bit
+    return flags
+
+
+def decode_status_record(record):
+    '''
+    Decode a status record from the binary protocol
+    
+    @param   record:bytes               The status record, see `STATUS_RECORD`
+    @return  :(int, tuple<float|bool>)  The version of the status and the
+                                        status values, see `STATUS_FIELDS`
+    '''
+    values = STATUS_RECORD.unpack(record)
+    flags = values[10]
+    return (values[0], values[1 : 10] + tuple((flags & bit) != 0 for (_name, bit) in STATUS_FLAGS))
+
+
+def encode_frame(kind, payload):
+    '''
+    Encode a frame for the binary protocol
+    
+    @param   kind:int       The type of the frame, `FRAME_STATUS` or `FRAME_TEXT`
+    @param   payload:bytes  The payload of the frame
+    @return  :bytes         The frame, see `FRAME_HEADER`
+    '''
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def decode_frames(data):
+    '''
+    Decode the frames received from the daemon when using the binary protocol
+    
+    @param   data:bytes                     Received data, beginning with a frame
+    @return  :(list<(int, bytes)>, bytes)  The type and payload of each complete frame,
+                                            and the data that is not yet a complete frame
+    '''
+    (frames, offset, size) = ([], 0, FRAME_HEADER.size)
+    while len(data) - offset >= size:
+        (kind, length) = FRAME_HEADER.unpack_from(data, offset)
+        if len(data) - offset - size < length:
+            break
+        frames.append((kind, data[offset + size : offset + size + length]))
+        offset += size + length
+    return (frames, data[offset:])
+
+
+def render_status_line(field, value):
+    '''
+    Render and encode one line of a status message
+    
+    @param   field:(str, str)    The name and format of the field, see `STATUS_FIELDS`
+    @param   value:float|bool    The value of the field
+    @return  :bytes              The line, including the line break
+    '''
+    (name, fmt) = field
+    if isinstance(value, bool):
+        value = 'yes' if value else 'no'
+    return (('%s: ' + fmt + '\n') % (name, value)).encode('utf-8')
+
+
+def current_status_values(ns = None):
+    '''
+    Collect the current status of redshift
+    
+    @param   ns:dict<str, ?>?    The namespace with the `red_*` variables, the globals if `None`
+    @return  :tuple<float|bool>  The status values, see `STATUS_FIELDS`
+    '''
+    ns = globals() if ns is None else ns
+    (brightnesses, temperatures, location) = (ns['red_brightnesses'], ns['red_temperatures'], ns['red_location'])
+    return (float(ns['red_brightness']), float(brightnesses[0]), float(brightnesses[1]),
+            float(ns['red_temperature']), float(temperatures[0]), float(temperatures[1]),
+            float(ns['red_period']), float(location[0]), float(location[1]),
+            bool(ns['red_status']), bool(ns['red_running']), bool(ns['red_dying']), bool(ns['red_frozen']))
+
+
+red_snapshot = None
+'''
+:StatusSnapshot?  The last published status, replaced (never modified) when the
+                  status changes, so it can be read without any locking
+'''
+
+
+def publish_status(ns = None):
+    '''
+    Publish the current status of redshift, unless it has not changed
+    
+    @param   ns:dict<str, ?>?  The namespace with the `red_*` variables, including
+                               `red_snapshot`, the globals if `None`
+    @return  :bool             Whether a new status snapshot was published
+    '''
+    ns = globals() if ns is None else ns
+    values = current_status_values(ns)
+    snapshot = ns['red_snapshot']
+    if snapshot is None:
+        ns['red_snapshot'] = StatusSnapshot(0, values)
+        return True
+    if values == snapshot.values:
+        return False
+    ns['red_snapshot'] = StatusSnapshot(snapshot.version + 1, values, snapshot.values)
+    return True
+
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import math
+import functools
+
+# numpy is imported with `import_numpy`, from ramps.py, when it is first used
+
+
+TRANSITION_LOW = -6
+'''
+:float  The solar elevation, in degrees, at and below which it is night, as in redshift
+'''
+
+TRANSITION_HIGH = 3
+'''
+:float  The solar elevation, in degrees, at and above which it is day, as in redshift
+'''
+
+TABLE_STEP = 60
+'''
+:int  The number of seconds between the entries in a table made by `day_table`
+'''
+
+
+def solar_elevation(timestamps, latitude, longitude, vectorise = None):
+    '''
+    Calculate the elevation of the Sun, using the equations of NOAA's solar
+    calculator, without correction for atmospheric refraction
+    
+    @param   timestamps:list<float>|numpy.ndarray  The times, in seconds since the Epoch
+    @param   latitude:float                        The latitude, in degrees, north is positive
+    @param   longitude:float                       The longitude, in degrees, east is positive
+    @param   vectorise:bool?                       Whether to use numpy, if it is available if `None`
+    @return  :list<float>|numpy.ndarray            The elevation, in degrees, at each time
+    '''
+    numpy = import_numpy()
+    if vectorise is None:
+        vectorise = numpy is not None
+    if vectorise:
+        (sin, cos, tan, asin, acos) = (numpy.sin, numpy.cos, numpy.tan, numpy.arcsin, numpy.arccos)
+        clamp = lambda v : numpy.clip(v, -1, 1)
+        return _solar_elevation(numpy.asarray(timestamps, dtype = float), latitude, longitude,
+                                sin, cos, tan, asin, acos, clamp)
+    (sin, cos, tan, asin, acos) = (math.sin, math.cos, math.tan, math.asin, math.acos)
+    clamp = lambda v : min(max(v, -1), 1)
+    return [_solar_elevation(t, latitude, longitude, sin, cos, tan, asin, acos, clamp) for t in timestamps]
+
+
+def _solar_elevation(t, latitude, longitude, sin, cos, tan, asin, acos, clamp):
+    '''
+    Calculate the elevation of the Sun, use `solar_elevation` instead
+    
+    @param   t:float|numpy.ndarray  The time, or times, in seconds since the Epoch
+    @param   latitude:float         The latitude, in degrees
+    @param   longitude:float        The longitude, in degrees
+    @param   sin:(float)→float      The sine function, elementwise if `t` is an array, and so on
+    @param   cos:(float)→float      The cosine function
+    @param   tan:(float)→float      The tangent function
+    @param   asin:(float)→float     The arcsine function
+    @param   acos:(float)→float     The arccosine function
+    @param   clamp:(float)→float    Function that clamps to [-1, 1]
+    @return  :float|numpy.ndarray   The elevation, in degrees
+    '''
+    rad = math.pi / 180
+    jc = (t / 86400 + 2440587.5 - 2451545) / 36525
+    mean_longitude = (280.46646 + jc * (36000.76983 + jc * 0.0003032)) % 360
+    mean_anomaly = 357.52911 + jc * (35999.05029 - 0.0001537 * jc)
+    eccentricity = 0.016708634 - jc * (0.000042037 + 0.0000001267 * jc)
+    centre = (sin(mean_anomaly * rad) * (1.914602 - jc * (0.004817 + 0.000014 * jc))
+              + sin(2 * mean_anomaly * rad) * (0.019993 - 0.000101 * jc)
+              + sin(3 * mean_anomaly * rad) * 0.000289)
+    omega = (125.04 - 1934.136 * jc) * rad
+    apparent_longitude = mean_longitude + centre - 0.00569 - 0.00478 * sin(omega)
+    obliquity = 23 + (26 + (21.448 - jc * (46.815 + jc * (0.00059 - jc * 0.001813))) / 60) / 60
+    obliquity = obliquity + 0.00256 * cos(omega)
+    declination = asin(sin(obliquity * rad) * sin(apparent_longitude * rad))
+    y = tan(obliquity * rad / 2) ** 2
+    (l, m, e) = (mean_longitude * rad, mean_anomaly * rad, eccentricity)
+    equation_of_time = 4 / rad * (y * sin(2 * l) - 2 * e * sin(m) + 4 * e * y * sin(m) * cos(2 * l)
+                                  - 0.5 * y * y * sin(4 * l) - 1.25 * e * e * sin(2 * m))
+    true_solar_time = ((t % 86400) / 60 + equation_of_time + 4 * longitude) % 1440
+    hour_angle = (true_solar_time / 4 - 180) * rad
+    zenith = acos(clamp(sin(latitude * rad) * sin(declination)
+                        + cos(latitude * rad) * cos(declination) * cos(hour_angle)))
+    return 90 - zenith / rad
+
+
+@functools.lru_cache(maxsize = 32)
+def day_table(day, latitude, longitude):
+    '''
+    Tabulate the elevation of the Sun over a day, every `TABLE_STEP` seconds
+    
+    @param   day:int                           The day, in days since the Epoch, in UTC
+    @param   latitude:float                    The latitude, in degrees
+    @param   longitude:float                   The longitude, in degrees
+    @return  :tuple<float>|numpy.ndarray       The elevation, in degrees, from the start of the day
+                                               to the start of the next day, inclusively; a read-only
+                                               array if numpy is used, must not be modified
+    '''
+    timestamps = [day * 86400 + i * TABLE_STEP for i in range(86400 // TABLE_STEP + 1)]
+    table = solar_elevation(timestamps, latitude, longitude)
+    if import_numpy() is None:
+        return tuple(table)
+    table.flags.writeable = False
+    return table
+
+
+def elevations(timestamps, latitude, longitude):
+    '''
+    Get the elevation of the Sun, interpolated from the tables made by `day_table`,
+    which are reused for the same day and location rounded to a hundredth of a degree
+    
+    @param   timestamps:list<float>|numpy.ndarray  The times, in seconds since the Epoch
+    @param   latitude:float                        The latitude, in degrees
+    @param   longitude:float                       The longitude, in degrees
+    @return  :list<float>|numpy.ndarray            The elevation, in degrees, at each time
+    '''
+    (latitude, longitude) = (round(latitude, 2), round(longitude, 2))
+    numpy = import_numpy()
+    if numpy is not None:
+        timestamps = numpy.asarray(timestamps, dtype = float)
+        days = numpy.floor(timestamps / 86400)
+        grid = numpy.arange(86400 // TABLE_STEP + 1) * TABLE_STEP
+        result = numpy.empty(timestamps.shape)
+        for day in numpy.unique(days):
+            selected = days == day
+            table = day_table(int(day), latitude, longitude)
+            result[selected] = numpy.interp(timestamps[selected] - day * 86400, grid, table)
+        return result
+    result = []
+    for t in timestamps:
+        day = int(t // 86400)
+        (index, alpha) = divmod((t - day * 86400) / TABLE_STEP, 1)
+        table = day_table(day, latitude, longitude)
+        index = int(index)
+        result.append(table[index] * (1 - alpha) + table[min(index + 1, len(table) - 1)] * alpha)
+    return result
+
+
+def forecast(timestamps, location, temperatures, brightnesses):
+    '''
+    Calculate the dayness, colour temperature and brightness redshift targets
+    
+    @param   timestamps:list<float>               The times, in seconds since the Epoch
+    @param   location:(float, float)              The latitude and longitude, in degrees
+    @param   temperatures:(float, float)          The daytime and night colour temperatures
+    @param   brightnesses:(float, float)          The daytime and night brightnesses
+    @return  :list<(float, float, float, float)>  The time, dayness, colour temperature
+                                                  and brightness, for each time
+    '''
+    (span, numpy) = (TRANSITION_HIGH - TRANSITION_LOW, import_numpy())
+    if numpy is not None:
+        dayness = numpy.clip((elevations(timestamps, *location) - TRANSITION_LOW) / span, 0, 1)
+    else:
+        dayness = [min(max((e - TRANSITION_LOW) / span, 0), 1) for e in elevations(timestamps, *location)]
+    rows = []
+    for (t, d) in zip(timestamps, dayness):
+        temperature = temperatures[1] + d * (temperatures[0] - temperatures[1])
+        brightness = brightnesses[1] + d * (brightnesses[0] - brightnesses[1])
+        rows.append((float(t), float(d), float(temperature), float(brightness)))
+    return rows
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import mmap
+import stat
+import errno
+import struct
+
+
+STATUS_FILE_SIZE = 4096
+'''
+:int  The size of a status file
+'''
+
+
+class StatusFile:
+    '''
+    A memory-mapped file the daemon publishes the status of a redshift instance in,
+    so that it can be read without communicating with the daemon, see `STATUS_FILE_HEADER`
+    '''
+    
+    def __init__(self, path):
+        '''
+        Constructor, create the file, replacing a file left behind by a daemon that
+        died only if it is a regular file owned by the user, raises OSError if the
+        file cannot be created, or there is a file that shall not be replaced
+        
+        @param  path:str  The pathname of the file
+        '''
+        self.path = path
+        '''
+        :str  The pathname of the file
+        '''
+        
+        self.header = struct.Struct(STATUS_FILE_HEADER)
+        '''
+        :struct.Struct  The layout of the header
+        '''
+        
+        self.sequence = 0
+        '''
+        :int  The sequence number in the header, odd while the file is being written
+        '''
+        
+        self.state = None
+        '''
+        :(int, bool)?  The version of the published status, and whether it was
+                       available, `None` if nothing has been published
+        '''
+        
+        self.start_time = process_start_time(os.getpid()) or 0
+        '''
+        :int  The start time of the daemon, see `process_start_time`, 0 if it is not known,
+              in which case readers do not trust the file and ask the daemon instead
+        '''
+        
+        # /dev/shm is writable by everyone, so the file is created only if it does not exist, and
+        # an existing file is removed only if it is ours, others could read or write it otherwise
+        try:
+            attr = os.lstat(path)
+        except FileNotFoundError:
+            attr = None
+        if attr is not None:
+            if not (stat.S_ISREG(attr.st_mode) and (attr.st_uid == os.getuid())):
+                raise OSError(errno.EEXIST, 'exists and is not a file owned by the user', path)
+            os.unlink(path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o644)
+        try:
+            os.ftruncate(fd, STATUS_FILE_SIZE)
+            self.map = mmap.mmap(fd, STATUS_FILE_SIZE, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            '''
+            :mmap.mmap  The contents of the file
+            '''
+        finally:
+            os.close(fd)
+    
+    def publish(self, state, record, message):
+        '''
+        Write a status to the file
+        
+        Readers shall read the sequence number, and retry if it is odd, then the record
+        or message, then the sequence number again, and retry if it has changed
+        
+        @param  state:(int, bool)  The version of the status, and whether it is available, that is,
+                                   whether the daemon would reply with it without starting redshift
+        @param  record:bytes       The status record, see `STATUS_RECORD`
+        @param  message:bytes      The status message, as the daemon replies to 'status'
+        '''
+        pid = os.getpid() if state[1] else 0
+        self.sequence += 1
+        struct.pack_into('<Q', self.map, 0, self.sequence)
+        self.header.pack_into(self.map, 0, self.sequence, pid, self.start_time, len(record), len(message))
+        offset = self.header.size
+        self.map[offset : offset + len(record)] = record
+        offset += len(record)
+        self.map[offset : offset + len(message)] = message
+        self.sequence += 1
+        struct.pack_into('<Q', self.map, 0, self.sequence)
+        self.state = state
+    
+    def close(self):
+        '''
+        Remove the file
+        '''
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.map.close()
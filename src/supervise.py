@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import signal
+
+
+class ChildSupervisor:
+    '''
+    Reports when child processes stop, continue or exit, using SIGCHLD
+    and waitid(2), through a file descriptor that can be used with selectors
+    
+    Only one supervisor can exist at a time, and it must
+    be created and closed in the main thread
+    '''
+    
+    def __init__(self):
+        '''
+        Constructor, start supervising, the child processes are added with `watch`
+        '''
+        self.procs = []
+        '''
+        :list<Popen>  The child processes
+        '''
+        
+        (self.rfd, self.wfd) = os.pipe()
+        '''
+        :int  The read end and the write end of the pipe SIGCHLD is reported through
+        '''
+        os.set_blocking(self.rfd, False)
+        os.set_blocking(self.wfd, False)
+        
+        # The handler does nothing, but Python writes to the
+        # wakeup file descriptor when the signal is received
+        signal.signal(signal.SIGCHLD, lambda signo, frame : None)
+        signal.set_wakeup_fd(self.wfd)
+    
+    def watch(self, proc):
+        '''
+        Start supervising a child process
+        
+        @param  proc:Popen  The child process
+        '''
+        self.procs.append(proc)
+    
+    def fileno(self):
+        '''
+        Get the file descriptor, for use with selectors
+        
+        @return  :int  The read end of the pipe SIGCHLD is reported through
+        '''
+        return self.rfd
+    
+    def read(self):
+        '''
+        Get the state changes of the child processes since the last call, without blocking
+        
+        @return  :list<(Popen, str)>  The child processes and their state changes, in
+                                      order: 'stopped', 'continued' and 'exited'
+        '''
+        try:
+            while len(os.read(self.rfd, 4096)) > 0:
+                pass
+        except BlockingIOError:
+            pass
+        events = []
+        for proc in list(self.procs):
+            while proc.returncode is None:
+                try:
+                    info = os.waitid(os.P_PID, proc.pid, os.WSTOPPED | os.WCONTINUED | os.WNOHANG)
+                except ChildProcessError:
+                    info = None
+                if info is None:
+                    break
+                if info.si_code == os.CLD_STOPPED:
+                    events.append((proc, 'stopped'))
+                elif info.si_code == os.CLD_CONTINUED:
+                    events.append((proc, 'continued'))
+            if (proc.returncode is None) and (proc.poll() is not None):
+                events.append((proc, 'exited'))
+                self.procs.remove(proc)
+        return events
+    
+    def close(self):
+        '''
+        Stop supervising
+        '''
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+
+def signal_pending(pid, signo):
+    '''
+    Check whether a signal has been sent to a process but not yet delivered
+    
+    @param   pid:int    The process ID
+    @param   signo:int  The signal
+    @return  :bool      Whether the signal is pending, `False` if it cannot be determined
+    '''
+    try:
+        with open('/proc/%i/status' % pid, 'rb') as file:
+            status = file.read()
+    except OSError:
+        return False
+    for line in status.split(b'\n'):
+        if line.startswith(b'SigPnd:') or line.startswith(b'ShdPnd:'):
+            if int(line.split(b':')[1].strip(), 16) & (1 << (signo - 1)):
+                return True
+    return False
+
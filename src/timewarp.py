@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+import sys
+import math
+import time
+import signal
+
+
+class TranscriptRecorder:
+    '''
+    Records the output of redshift, with the time each line arrived,
+    in the format that `replay_transcript` reads:
+        
+        <seconds since the recording started>\t<line>
+    '''
+    
+    def __init__(self, file):
+        '''
+        Constructor
+        
+        @param  file:str  The file to record to, it is truncated
+        '''
+        self.file = open(file, 'wb')
+        '''
+        :io.BufferedWriter  The file recorded to
+        '''
+        
+        self.start = time.monotonic()
+        '''
+        :float  When the recording started
+        '''
+        
+        self.buffer = b''
+        '''
+        :bytes  Output that has not yet been terminated by a line break
+        '''
+    
+    def write(self, data):
+        '''
+        Record output from redshift
+        
+        @param  data:bytes  The output, it does not have to end at a line break
+        '''
+        lines = (self.buffer + data).split(b'\n')
+        self.buffer = lines.pop()
+        if len(lines) > 0:
+            stamp = ('%.6f\t' % (time.monotonic() - self.start)).encode('utf-8')
+            self.file.write(b''.join(stamp + line + b'\n' for line in lines))
+            self.file.flush()
+    
+    def close(self):
+        '''
+        Stop recording
+        '''
+        self.file.close()
+
+
+def read_transcript(file):
+    '''
+    Read a recorded transcript
+    
+    @param   file:str               The recorded file
+    @return  :list<(float, bytes)>  The time of each line, and the line without line break
+    '''
+    transcript = []
+    with open(file, 'rb') as f:
+        for line in f.read().split(b'\n'):
+            (stamp, tab, line) = line.partition(b'\t')
+            if tab:
+                transcript.append((float(stamp), line))
+    return transcript
+
+
+def synthesise_transcript(location, temperatures, brightnesses, step = 5):
+    '''
+    Create a transcript of a full day, starting at midnight, for a
+    simple model of the sun where it peaks at noon and bottoms at midnight
+    
+    @param   location:(float, float)      The latitude and longitude, in degrees
+    @param   temperatures:(float, float)  The colour temperature at daytime and at night
+    @param   brightnesses:(float, float)  The brightness at daytime and at night
+    @param   step:float                   The number of seconds between updates
+    @return  :list<(float, bytes)>        The time of each line, and the line without line break
+    '''
+    (lat, lon) = location
+    _if = lambda pn, v : pn[0] if v >= 0 else pn[1]
+    transcript = [(0, ('Location: %.2f %s, %.2f %s' % (abs(lat), _if('NS', lat), abs(lon), _if('EW', lon))).encode('utf-8')),
+                  (0, ('Temperatures: %iK Day, %iK Night' % tuple(temperatures)).encode('utf-8')),
+                  (0, ('Brightness: %.2f:%.2f' % tuple(brightnesses)).encode('utf-8'))]
+    t = 0
+    while t <= 24 * 60 * 60:
+        # Elevation in [-1, 1], with twilight in [-0.1, 0.05]
+        elevation = -math.cos(2 * math.pi * t / (24 * 60 * 60))
+        dayness = min(max((elevation + 0.1) / 0.15, 0), 1)
+        if dayness == 0:
+            period = 'Night'
+        elif dayness == 1:
+            period = 'Daytime'
+        else:
+            period = 'Transition (%.2f%% day)' % (dayness * 100)
+        temperature = temperatures[1] + dayness * (temperatures[0] - temperatures[1])
+        brightness = brightnesses[1] + dayness * (brightnesses[0] - brightnesses[1])
+        transcript.append((t, ('Period: %s' % period).encode('utf-8')))
+        transcript.append((t, ('Color temperature: %iK' % temperature).encode('utf-8')))
+        transcript.append((t, ('Brightness: %.2f' % brightness).encode('utf-8')))
+        t += step
+    return transcript
+
+
+def replay_transcript(transcript, speed):
+    '''
+    Replay a transcript of redshift's output to stdout, standing in for redshift
+    
+    Like redshift, the replay is toggled by SIGUSR1, and it terminates on SIGTERM
+    and SIGINT. It is frozen by SIGTSTP, and the time it is frozen does not count.
+    When the transcript has been replayed, it waits until it is terminated.
+    
+    @param  transcript:list<(float, bytes)>  The time of each line, and the line without line break
+    @param  speed:float                      How many times faster than real time to replay
+    '''
+    state = { 'start' : time.monotonic(), 'stopped' : None, 'enabled' : True }
+    out = sys.stdout.buffer
+    
+    def toggle(signo, frame):
+        state['enabled'] = not state['enabled']
+        out.write(('Status: %s\n' % ('Enabled' if state['enabled'] else 'Disabled')).encode('utf-8'))
+        out.flush()
+    def stop(signo, frame):
+        state['stopped'] = time.monotonic()
+        os.kill(os.getpid(), signal.SIGSTOP)
+    def resume(signo, frame):
+        if state['stopped'] is not None:
+            state['start'] += time.monotonic() - state['stopped']
+            state['stopped'] = None
+    def terminate(signo, frame):
+        sys.exit(0)
+    signal.signal(signal.SIGUSR1, toggle)
+    signal.signal(signal.SIGTSTP, stop)
+    signal.signal(signal.SIGCONT, resume)
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    
+    try:
+        for (stamp, line) in transcript:
+            while True:
+                delay = state['start'] + stamp / speed - time.monotonic()
+                if delay <= 0:
+                    break
+                time.sleep(delay)
+            out.write(line + b'\n')
+            out.flush()
+        while True:
+            signal.pause()
+    except BrokenPipeError:
+        sys.exit(0)
+
@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+# -*- python -*-
+'''
+nightshift - A terminal user interface for redshift
+Copyright © 2014  Mattias Andrée (m@maandree.se)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+# Helpers for the tests and the benchmarks, they run nightshift from the
+# source tree, with a user name and a home directory of their own, so that
+# they neither need redshift nor disturb a daemon that is already running
+
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+'''
+:str  The directory of nightshift's source files
+'''
+
+daemon_count = 0
+'''
+:int  The number of daemons that have been started, used to give each its own user name
+'''
+
+TRANSCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'transcripts')
+'''
+:str  The directory of the transcripts of redshift's output
+'''
+
+ACTIVATE = '''
+import os, sys
+fd = int(sys.argv[1])
+if fd != 3:
+    os.dup2(fd, 3)
+    os.close(fd)
+os.environ.update(LISTEN_PID = str(os.getpid()), LISTEN_FDS = '1')
+os.execv(sys.argv[2], sys.argv[2:])
+'''
+'''
+:str  Python code that socket activates a program, as a service manager does: it moves the
+      listening socket, whose file descriptor is the first argument, to file descriptor 3,
+      and executes the rest of the arguments as the same process, as LISTEN_PID requires
+'''
+
+PARSER_FIELDS = ('red_location', 'red_temperatures', 'red_period', 'red_temperature',
+                 'red_brightnesses', 'red_brightness', 'red_status')
+'''
+:tuple<str>  The variables the parsers of redshift's output store the status in
+'''
+
+
+def load_modules(*modules):
+    '''
+    Load some of nightshift's modules with shared globals, as `load_module` does
+    
+    @param   modules:*str         The names of the modules, in the order they shall be loaded
+    @return  :dict<str, object>   The shared globals
+    '''
+    ns = { '__name__' : 'nightshift', 'sys' : sys, 'os' : os }
+    for module in modules:
+        path = os.path.join(SOURCE_DIR, module + '.py')
+        with open(path, 'rb') as file:
+            exec(compile(file.read(), path, 'exec'), ns)
+    return ns
+
+
+def load_transcripts():
+    '''
+    Load the transcripts of redshift's output in `TRANSCRIPT_DIR`
+    
+    @return  :list<(str, list<bytes>)>  The name of each transcript, and its lines, with line breaks
+    '''
+    transcripts = []
+    for name in sorted(os.listdir(TRANSCRIPT_DIR)):
+        if name == 'README':
+            continue
+        with open(os.path.join(TRANSCRIPT_DIR, name), 'rb') as file:
+            data = file.read()
+        lines = [line.partition(b'\t')[2] + b'\n' for line in data.split(b'\n') if b'\t' in line]
+        transcripts.append((name, lines))
+    return transcripts
+
+
+def fail(message):
+    '''
+    Report that a test has failed, and exit with 1
+    
+    @param  message:str  Description of the failure
+    '''
+    sys.stderr.write('%s: FAIL: %s\n' % (sys.argv[0], message))
+    sys.exit(1)
+
+
+class Daemon:
+    '''
+    A nightshift daemon, that simulates redshift, run in isolation
+    '''
+    
+    def __init__(self, *options, script = '', speed = 60, user = None, activated = False):
+        '''
+        Constructor, start the daemon and wait until it accepts connections
+        
+        @param  options:*str    Additional options for nightshift
+        @param  script:str      The contents of the configuration script
+        @param  speed:float     How many times faster than real time to simulate the day
+        @param  user:str?       The user name of the daemon, a new one if `None`
+        @param  activated:bool  Whether to create the socket and pass it to the daemon, as a service manager does
+        '''
+        global daemon_count
+        daemon_count += 1
+        
+        self.home = tempfile.mkdtemp(prefix = 'nightshift-test-')
+        '''
+        :str  The home directory of the daemon
+        '''
+        
+        self.user = user or 'test-%i-%i' % (os.getpid(), daemon_count)
+        '''
+        :str  The user name of the daemon
+        '''
+        
+        self.path = '/dev/shm/.nightshift~%s' % self.user
+        '''
+        :str  The pathname of the daemon's socket
+        '''
+        
+        self.script = os.path.join(self.home, 'nightshiftrc')
+        '''
+        :str  The pathname of the configuration script
+        '''
+        
+        self.env = dict(os.environ, USER = self.user, HOME = self.home)
+        '''
+        :dict<str, str>  The environment of the daemon and its clients
+        '''
+        
+        self.activated = None
+        '''
+        :int?  The inode number of the socket passed to the daemon, `None` if it was not socket activated
+        '''
+        
+        with open(self.script, 'w') as file:
+            file.write(script)
+        command = [sys.executable, SOURCE_DIR, '-d', '+c', self.script, '--simulate', '--speed', str(speed)]
+        command += list(options)
+        server = None
+        if activated:
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(self.path)
+            server.listen(8)
+            self.activated = os.stat(self.path).st_ino
+            command = [sys.executable, '-c', ACTIVATE, str(server.fileno())] + command
+        try:
+            self.proc = subprocess.Popen(command, env = self.env, stdin = subprocess.DEVNULL,
+                                         pass_fds = () if server is None else (server.fileno(),))
+            '''
+            :Popen  The daemon's process
+            '''
+        finally:
+            if server is not None:
+                server.close()
+        
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                self.connect().close()
+                break
+            except OSError:
+                if (self.proc.poll() is not None) or (time.monotonic() > deadline):
+                    self.stop()
+                    fail('the daemon did not start')
+                time.sleep(0.01)
+    
+    def connect(self):
+        '''
+        Connect to the daemon
+        
+        @return  :socket  A new connection to the daemon
+        '''
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except:
+            sock.close()
+            raise
+        return sock
+    
+    def send(self, *commands):
+        '''
+        Send commands over a new connection, without waiting for replies
+        
+        @param  commands:*str  The commands, without line breaks
+        '''
+        sock = self.connect()
+        try:
+            sock.sendall(''.join(command + '\n' for command in commands).encode('utf-8'))
+        finally:
+            sock.close()
+    
+    def request(self, *commands, timeout = 5):
+        '''
+        Send commands over a new connection, and receive one message per command
+        
+        @param   commands:*str  The commands, without line breaks
+        @param   timeout:float  The maximum number of seconds to wait for each message
+        @return  :list<str>     The messages, without the empty line that ends them
+        '''
+        sock = self.connect()
+        sock.settimeout(timeout)
+        sock.sendall(''.join(command + '\n' for command in commands).encode('utf-8'))
+        (messages, buf) = ([], b'')
+        try:
+            while len(messages) < len(commands):
+                while b'\n\n' not in buf:
+                    got = sock.recv(1 << 16)
+                    if not got:
+                        fail('the daemon closed the connection')
+                    buf += got
+                (message, buf) = buf.split(b'\n\n', 1)
+                messages.append(message.decode('utf-8', 'replace'))
+        finally:
+            sock.close()
+        return messages
+    
+    def status(self):
+        '''
+        Get the status of redshift
+        
+        @return  :dict<str, str>  The fields of the status
+        '''
+        return fields(self.request('status')[0])
+    
+    def metrics(self):
+        '''
+        Get the daemon's metrics
+        
+        @return  :dict<str, float>  The value of each sample, by its description
+        '''
+        return { key : float(value) for (key, value) in fields(self.request('metrics')[0]).items() }
+    
+    def nightshift(self, *options, timeout = 10):
+        '''
+        Run nightshift as a client of the daemon
+        
+        @param   options:*str  The options
+        @param   timeout:float The maximum number of seconds to let it run
+        @return  :(int, str)   The exit value and the output of nightshift
+        '''
+        proc = subprocess.run([sys.executable, SOURCE_DIR] + list(options), env = self.env, timeout = timeout,
+                              stdin = subprocess.DEVNULL, stdout = subprocess.PIPE)
+        return (proc.returncode, proc.stdout.decode('utf-8', 'replace'))
+    
+    def settle(self, seconds = 0.5, timeout = 10):
+        '''
+        Wait until no toggle signal has been sent for a while
+        
+        @param  seconds:float  For how many seconds the number of toggle signals shall not change
+        @param  timeout:float  The maximum number of seconds to wait
+        '''
+        deadline = time.monotonic() + timeout
+        last = None
+        while time.monotonic() < deadline:
+            metrics = self.metrics()
+            now = (metrics['Toggle signals sent'], metrics.get('Lines parsed (Status)', 0))
+            if now == last:
+                return
+            last = now
+            time.sleep(seconds)
+        fail('the daemon did not settle')
+    
+    def stop(self):
+        '''
+        Stop the daemon and redshift, and remove the files they leave behind
+        '''
+        if self.proc.poll() is None:
+            try:
+                self.send('kill', 'kill')
+            except OSError:
+                pass
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        for path in (self.path, self.path + '.status'):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        shutil.rmtree(self.home, ignore_errors = True)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class Connection:
+    '''
+    A connection to a daemon, that stays open so that commands can be sent
+    and messages received over it one at the time, for example to listen
+    '''
+    
+    def __init__(self, daemon, timeout = 5):
+        '''
+        Constructor, connect to the daemon
+        
+        @param  daemon:Daemon  The daemon
+        @param  timeout:float  The maximum number of seconds to wait for each message
+        '''
+        self.sock = daemon.connect()
+        '''
+        :socket  The connection
+        '''
+        
+        self.sock.settimeout(timeout)
+        self.buf = b''
+        '''
+        :bytes  Received bytes that are not yet part of a returned message
+        '''
+    
+    def send(self, *commands):
+        '''
+        Send commands, without waiting for replies
+        
+        @param  commands:*str  The commands, without line breaks
+        '''
+        self.sock.sendall(''.join(command + '\n' for command in commands).encode('utf-8'))
+    
+    def receive(self):
+        '''
+        Receive the next message, fail if there is none before the timeout
+        
+        @return  :str  The message, without the empty line that ends it
+        '''
+        try:
+            while b'\n\n' not in self.buf:
+                got = self.sock.recv(1 << 16)
+                if not got:
+                    fail('the daemon closed the connection')
+                self.buf += got
+        except socket.timeout:
+            fail('no message was received before the timeout')
+        (message, self.buf) = self.buf.split(b'\n\n', 1)
+        return message.decode('utf-8', 'replace')
+    
+    def closed(self, timeout = 5):
+        '''
+        Wait until the daemon closes the connection, discarding what it sends
+        
+        @param   timeout:float  The maximum number of seconds to wait
+        @return  :bool          Whether the daemon closed the connection before the timeout
+        '''
+        deadline = time.monotonic() + timeout
+        try:
+            while time.monotonic() < deadline:
+                self.sock.settimeout(max(deadline - time.monotonic(), 0.001))
+                if not self.sock.recv(1 << 16):
+                    return True
+        except socket.timeout:
+            pass
+        except OSError:
+            return True
+        return False
+    
+    def close(self):
+        '''
+        Close the connection
+        '''
+        self.sock.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class OldParser:
+    '''
+    The parser nightshift used before `RedshiftParser`, taken from `read_status`,
+    it reads one line at the time, and holds the condition from the first line
+    of an update until the line that completes it
+    '''
+    
+    def __init__(self, ns, condition):
+        '''
+        Constructor
+        
+        @param  ns:dict<str, ?>                The namespace to store the status in
+        @param  condition:threading.Condition  The condition that guards `ns`
+        '''
+        self.ns = ns
+        self.condition = condition
+        self.released = True
+    
+    def feed_line(self, got):
+        '''
+        Parse a line
+        
+        @param   got:bytes  The line, with its line break
+        @return  :bool      Whether the line completed an update
+        '''
+        (ns, released) = (self.ns, False)
+        got = got.decode('utf-8', 'replace')[:-1]
+        if ': 'not in got:
+            return False
+        (key, value) = got.split(': ')
+        if self.released:
+            self.condition.acquire()
+            self.released = False
+        try:
+            if key == 'Location':
+                def coordcomp(v):
+                    v = (v + ' N').split(' ')[:2]
+                    return float(v[0]) * (-1 if v[1] in 'SW' else 1)
+                ns['red_location'] = [coordcomp(v) for v in value.split(', ')]
+            elif key == 'Temperatures':
+                ns['red_temperatures'] = [float(v.split(' ')[0][:-1]) for v in value.split(', ')]
+            elif key == 'Period':
+                if value == 'Night':
+                    ns['red_period'] = 0
+                elif value == 'Daytime':
+                    ns['red_period'] = 1
+                else:
+                    ns['red_period'] = float(value.split(' ')[1][1 : -1]) / 100
+            elif key == 'Color temperature':
+                ns['red_temperature'] = float(value[:-1])
+            elif key == 'Brightness':
+                if ':' in value:
+                    ns['red_brightnesses'] = [float(v) for v in value.split(':')]
+                else:
+                    ns['red_brightness'] = float(value)
+                released = True
+            elif key == 'Status':
+                ns['red_status'] = value == 'Enabled'
+                released = True
+            if released:
+                self.condition.notify_all()
+                self.condition.release()
+                self.released = True
+        except:
+            pass
+        return released
+
+
+def fields(message):
+    '''
+    Split a message into its fields
+    
+    @param   message:str      The message
+    @return  :dict<str, str>  The value of each field, by its name
+    '''
+    fields = {}
+    for line in message.split('\n'):
+        if ': ' in line:
+            (key, value) = line.split(': ', 1)
+            fields[key] = value
+    return fields